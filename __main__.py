@@ -0,0 +1,17 @@
+import sys
+from pathlib import Path
+
+from .cli import daemon
+
+# If there's a daemon around, it can run the command with everything already warm, and we don't even need to import
+# the rest of the package.
+exit_code = None
+socket_path = daemon.find_socket(sys.argv[1:])
+if socket_path is not None:
+    exit_code = daemon.send_command(socket_path, sys.argv[1:], Path.cwd(), sys.stdout)
+
+if exit_code is None:
+    from .cli import cli
+    exit_code = cli.main()
+
+sys.exit(exit_code)
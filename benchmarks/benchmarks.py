@@ -0,0 +1,166 @@
+from pathlib import Path
+import argparse
+import json
+import logging
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Optional
+
+from ..importers import markdown_index_file_importer
+from ..importers import markdown_single_file_importer
+from ..exporters import latex_pdf_exporter
+from ..exporters import markdown_exporter
+from ..word_count import word_count
+from ..page_count import page_count
+from . import synthetic_vault
+
+logger = logging.getLogger(__name__)
+
+BASELINE_FILE = Path(__file__).parent / "baseline.json"
+TEMPLATE = Path(latex_pdf_exporter.__file__).parent / "template.tex"
+
+# Manuscript shapes to benchmark with: (parts, chapters per part, scenes per chapter, words per scene).
+SIZES = {
+    "small": (1, 5, 3, 500),
+    "medium": (3, 10, 4, 1500),
+    "large": (5, 20, 5, 3000),
+}
+
+# How much slower than the baseline (as a fraction of it) a benchmark may get before it counts as a regression.
+DEFAULT_TOLERANCE = 0.25
+
+
+@dataclass
+class BenchmarkResult:
+    """How long a benchmark took, in seconds: the best and the median of its repeats.
+
+    The best is what gets compared with the baseline, as it's the least noisy of the two.
+    """
+    name: str
+    best: float
+    median: float
+    repeat: int
+
+
+def _time(function: Callable[[], object], repeat: int) -> List[float]:
+    """Runs the given function repeat times, returning how long each run took.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    return timings
+
+
+def run_benchmarks(folder: Path, size: str, repeat: int) -> List[BenchmarkResult]:
+    """Generates vaults of the given size in the given folder, and times importing and exporting them.
+    """
+    parts, chapters, scenes, words = SIZES[size]
+    vaults = {mode: synthetic_vault.generate_vault(folder / mode.name.lower(), parts, chapters, scenes, words, mode)
+              for mode in synthetic_vault.DelimiterMode}
+    emoji_vault = vaults[synthetic_vault.DelimiterMode.EMOJI]
+    manuscript = markdown_index_file_importer.load_manuscript_from_index_file(emoji_vault.index_file,
+                                                                              emoji_vault.root_folder)
+    out_file = folder / "output.md"
+
+    benchmarks: Dict[str, Callable[[], object]] = {}
+    for mode, vault in vaults.items():
+        benchmarks[f"import_index_file[{mode.name.lower()}]"] = (
+            lambda vault=vault, mode=mode: markdown_index_file_importer.load_manuscript_from_index_file(
+                vault.index_file, vault.root_folder, mode))
+    benchmarks["import_single_file"] = lambda: markdown_single_file_importer.load_manuscript_from_file(
+        emoji_vault.single_file.name, emoji_vault.root_folder)
+    benchmarks["word_count"] = lambda: word_count.count_words_in_manuscript(manuscript)
+    benchmarks["page_count"] = lambda: page_count.estimate_pages(manuscript, page_count.read_layout(TEMPLATE))
+    benchmarks["markdown_export"] = lambda: markdown_exporter.export(manuscript, out_file)
+
+    results = []
+    for name, function in benchmarks.items():
+        timings = _time(function, repeat)
+        results.append(BenchmarkResult(name, min(timings), statistics.median(timings), repeat))
+        logger.info(f"{name}: {min(timings) * 1000:.2f}ms")
+
+    return results
+
+
+def read_baseline(baseline_file: Path) -> dict:
+    """Reads the baseline in the given file: results by size, and then by benchmark name.
+    """
+    if not baseline_file.exists():
+        return {}
+
+    with open(baseline_file, encoding="utf-8") as input:
+        return json.load(input)
+
+
+def record_baseline(baseline_file: Path, size: str, results: List[BenchmarkResult]) -> None:
+    """Records the given results as the baseline for the given size, keeping the baselines of other sizes.
+    """
+    baseline = read_baseline(baseline_file)
+    baseline[size] = {"python": platform.python_version(),
+                      "results": {result.name: asdict(result) for result in results}}
+
+    with open(baseline_file, "w", encoding="utf-8") as out:
+        json.dump(baseline, out, indent=2)
+        out.write("\n")
+
+    logger.info(f"Recorded the baseline for {size} in {baseline_file}.")
+
+
+def compare(results: List[BenchmarkResult], baseline: Optional[dict], tolerance: float) -> List[str]:
+    """Compares the given results with the given baseline (for the same size), one line per benchmark.
+
+    Lines for regressions (anything slower than the baseline by more than tolerance) start with "REGRESSION".
+    """
+    lines = []
+    baseline_results = (baseline or {}).get("results", {})
+    for result in results:
+        line = f"{result.name}: {result.best * 1000:.2f}ms (median {result.median * 1000:.2f}ms)"
+        if result.name not in baseline_results:
+            lines.append(f"{line}, no baseline")
+            continue
+
+        previous = baseline_results[result.name]["best"]
+        change = (result.best - previous) / previous
+        line = f"{line}, {change:+.0%} against {previous * 1000:.2f}ms"
+        lines.append(f"REGRESSION {line}" if change > tolerance else line)
+
+    return lines
+
+
+def main(argv: List[str] = None) -> int:
+    """Runs the benchmarks, and compares them with the baseline (or records them as the new one).
+
+    Returns 1 if anything regressed, 0 otherwise.
+    """
+    parser = argparse.ArgumentParser(prog="manuscript_generator_3000.benchmarks",
+                                     description="Times importing and exporting generated manuscripts.")
+    parser.add_argument("--size", choices=SIZES, default="medium")
+    parser.add_argument("--repeat", type=int, default=5, help="How many times to run each benchmark.")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_FILE, help="Where the baseline lives.")
+    parser.add_argument("--record", action="store_true", help="Record the results as the new baseline.")
+    parser.add_argument("--tolerance",
+                        type=float,
+                        default=DEFAULT_TOLERANCE,
+                        help="How much slower than the baseline (as a fraction) counts as a regression.")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Log more.")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        results = run_benchmarks(Path(temp_dir), args.size, args.repeat)
+
+    lines = compare(results, read_baseline(args.baseline).get(args.size), args.tolerance)
+    print("\n".join(lines))
+
+    if args.record:
+        record_baseline(args.baseline, args.size, results)
+        return 0
+
+    return 1 if any(line.startswith("REGRESSION") for line in lines) else 0
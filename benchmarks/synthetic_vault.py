@@ -0,0 +1,112 @@
+from pathlib import Path
+import random
+from dataclasses import dataclass
+from typing import List
+
+from ..importers import markdown_importer_innards as importer_innards
+
+DelimiterMode = importer_innards.DelimiterMode
+
+# Words to make up prose with. It's not going to win any prizes, but it has the right shape (and a bit of markdown).
+WORDS = ["the", "engineer", "wrote", "a", "file", "and", "then", "another", "one", "*quietly*", "of", "to", "in",
+         "markdown", "was", "never", "**enough**", "for", "manuscript", "he", "she", "they", "said", "thought",
+         "again", "until", "morning", "came", "with", "coffee", "and", "deadlines", "—", "of", "course."]
+WORDS_PER_PARAGRAPH = 60
+
+INDEX_FILE_NAME = "Index.md"
+SINGLE_FILE_NAME = "Single File Manuscript.md"
+SCENES_DIRECTORY_NAME = "Scenes"
+
+
+@dataclass
+class SyntheticVault:
+    """Where the parts of a generated vault ended up.
+
+    index_file lists every scene file (for markdown_index_file_importer), while single_file holds the very same
+    manuscript in a single file (for markdown_single_file_importer). Both live in root_folder.
+    """
+    root_folder: Path
+    index_file: Path
+    single_file: Path
+    scene_files: List[Path]
+
+
+def _generate_scene(rng: random.Random, words: int) -> List[str]:
+    """Generates the paragraphs of a scene with (roughly) the given number of words.
+    """
+    paragraphs = []
+    while words > 0:
+        count = min(words, WORDS_PER_PARAGRAPH)
+        paragraphs.append(" ".join(rng.choice(WORDS) for _ in range(count)).capitalize())
+        words -= count
+
+    return paragraphs
+
+
+def generate_vault(folder: Path,
+                   parts: int,
+                   chapters_per_part: int,
+                   scenes_per_chapter: int,
+                   words_per_scene: int,
+                   delimiter_mode: DelimiterMode = DelimiterMode.EMOJI,
+                   seed: int = 3000) -> SyntheticVault:
+    """Generates a vault with a manuscript of the given shape in the given folder.
+
+    The same arguments always generate the same vault. Each scene lives in its own file, in a subfolder, as they would
+    in a real vault.
+    """
+    rng = random.Random(seed)
+    scenes_dir = folder / SCENES_DIRECTORY_NAME
+    scenes_dir.mkdir(parents=True, exist_ok=True)
+
+    file_start = importer_innards.FILENAME_START[delimiter_mode]
+    config_start = importer_innards.CONFIG_START[delimiter_mode]
+
+    # Separators look like config lines that happen to contain an indicator, e.g. "- 📚 -- Chapter".
+    separator_start = config_start.removesuffix(importer_innards.INLINE_CONFIG_START.lstrip())
+
+    index_lines = ["A generated manuscript, for benchmarking.",
+                   "",
+                   f"{config_start}{importer_innards.TITLE_KEY}: Synthetic Manuscript",
+                   f"{config_start}{importer_innards.AUTHOR_KEY}: Manuscript Generator 3000",
+                   ""]
+    single_lines = ["---",
+                    f"{importer_innards.TITLE_KEY}: Synthetic Manuscript",
+                    f"{importer_innards.AUTHOR_KEY}: Manuscript Generator 3000",
+                    "---",
+                    ""]
+    scene_files = []
+
+    for part in range(1, parts + 1):
+        index_lines.append(f"{separator_start}{importer_innards.PART_INDICATOR} -- Title: Part {part}")
+        single_lines.append(f"{importer_innards.PART_INDICATOR} -- Title: Part {part}")
+
+        for chapter in range(1, chapters_per_part + 1):
+            index_lines.append(f"{separator_start}{importer_innards.CHAPTER_INDICATOR}")
+            single_lines.append(importer_innards.CHAPTER_INDICATOR)
+
+            for scene in range(1, scenes_per_chapter + 1):
+                # Names all have the same length, so none of them is contained in another (which the importer
+                # wouldn't like).
+                name = f"Scene {part:03d}-{chapter:03d}-{scene:03d}"
+                paragraphs = _generate_scene(rng, words_per_scene)
+
+                # Scenes after the first in a chapter start with a scene break, so both files import the same way.
+                if scene > 1:
+                    paragraphs.insert(0, importer_innards.SCENE_INDICATORS[0])
+
+                scene_file = scenes_dir / f"{name}.md"
+                scene_file.write_text("\n\n".join(paragraphs) + "\n", encoding="utf-8")
+                scene_files.append(scene_file)
+
+                index_lines.append(f"{file_start}{name}{importer_innards.FILENAME_END}")
+                single_lines.extend(paragraphs)
+
+            index_lines.append("")
+
+    index_file = folder / INDEX_FILE_NAME
+    index_file.write_text("\n".join(index_lines) + "\n", encoding="utf-8")
+    single_file = folder / SINGLE_FILE_NAME
+    single_file.write_text("\n\n".join(single_lines) + "\n", encoding="utf-8")
+
+    return SyntheticVault(folder, index_file, single_file, scene_files)
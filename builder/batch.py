@@ -0,0 +1,241 @@
+from pathlib import Path
+import concurrent.futures
+import logging
+import multiprocessing
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Union
+
+from ..manuscript import Manuscript
+from ..importers import markdown_guide_file_importer
+from ..importers import markdown_importer_innards
+from ..importers import markdown_index_file_importer
+from ..importers import markdown_single_file_importer
+from ..exporters import external_tools
+from . import builder
+
+logger = logging.getLogger(__name__)
+
+# Workers are started from scratch rather than forked, so no book inherits anything from whatever came before it (the
+# daemon's threads and locks included).
+START_METHOD = "spawn"
+
+# The markdown files of every vault in a batch, listed once by whoever runs it and handed to every worker (see
+# _initialize_worker).
+_vault_files: Dict[Path, List[Path]] = {}
+
+
+@dataclass
+class BuildSpec:
+    """One manuscript to build in a batch (see build_batch).
+
+    The manuscript is imported from source (an index file, the whole manuscript if single_file is set, or a guide file if
+    heading is given) and the files in root_folder, and then built into targets, as builder.build would. targets can
+    also be a function that creates them out of the imported manuscript, for targets that depend on it (e.g. on its
+    cover).
+
+    Note:
+    * Specs go to other processes, so targets (and their export functions and arguments) must be picklable. Functions
+      defined at the top level of a module are, as are functools.partial objects of them.
+    * name tells the books of a batch apart, and shows up in their logs.
+    """
+    name: str
+    source: Path
+    root_folder: Path
+    targets: Union[List[builder.ExportTarget], Callable[[Manuscript], List[builder.ExportTarget]]]
+    single_file: bool = False
+    delimiter_mode: markdown_importer_innards.DelimiterMode = markdown_importer_innards.DelimiterMode.EMOJI
+    manifest_file: Optional[Path] = None
+    heading: Optional[str] = None
+
+
+@dataclass
+class BookResult:
+    """How building a BuildSpec went.
+
+    targets holds the result of every target (see builder.build), and error whatever went wrong before any of them got
+    to run (e.g. while importing), if anything. import_seconds is how long importing took, and seconds how long the
+    whole book took. log holds whatever the book logged, in order.
+    """
+    name: str
+    targets: List[builder.TargetResult] = field(default_factory=list)
+    error: Optional[BaseException] = None
+    import_seconds: float = 0.0
+    seconds: float = 0.0
+    log: List[logging.LogRecord] = field(default_factory=list)
+
+    @property
+    def failures(self) -> List[str]:
+        """The names of the targets that failed.
+        """
+        return [target.name for target in self.targets if not target.succeeded]
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None and not self.failures
+
+
+class _LogCollector(logging.Handler):
+    """Keeps every record logged while it's installed, ready to travel back from a worker.
+    """
+    def __init__(self):
+        super().__init__()
+        self.records: List[logging.LogRecord] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Arguments and tracebacks don't necessarily pickle, so they're baked into the record beforehand.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        self.records.append(record)
+
+
+def _initialize_worker(vault_files: Dict[Path, List[Path]], log_level: int, max_processes: Optional[int]) -> None:
+    """Sets up a worker process for a batch.
+    """
+    _vault_files.update(vault_files)
+    logging.getLogger().setLevel(log_level)
+    if max_processes is not None:
+        external_tools.set_max_processes(max_processes)
+
+
+def _import_manuscript(spec: BuildSpec) -> Manuscript:
+    """Imports the manuscript of the given spec, through the vault listed for the whole batch (if it was).
+    """
+    vault = markdown_importer_innards.Vault(spec.root_folder, files=_vault_files.get(spec.root_folder))
+    if spec.single_file:
+        manuscript = markdown_single_file_importer.load_manuscript_from_file(spec.source.name, spec.root_folder, vault)
+    elif spec.heading is not None:
+        manuscript = markdown_guide_file_importer.load_manuscript_from_guide_file(spec.source,
+                                                                                  spec.heading,
+                                                                                  spec.root_folder,
+                                                                                  spec.delimiter_mode,
+                                                                                  vault)
+    else:
+        manuscript = markdown_index_file_importer.load_manuscript_from_index_file(spec.source,
+                                                                                  spec.root_folder,
+                                                                                  spec.delimiter_mode,
+                                                                                  vault)
+
+    if manuscript is None:
+        logger.error(f"Could not load a manuscript from {spec.source}!")
+        raise ValueError
+
+    return manuscript
+
+
+def build_book(spec: BuildSpec) -> BookResult:
+    """Imports and builds a single book, never raising. This is what runs in the workers of a batch.
+    """
+    collector = _LogCollector()
+    root_logger = logging.getLogger()
+    root_logger.addHandler(collector)
+
+    result = BookResult(spec.name)
+    start = time.perf_counter()
+    try:
+        manuscript = _import_manuscript(spec)
+        result.import_seconds = time.perf_counter() - start
+
+        targets = spec.targets(manuscript) if callable(spec.targets) else spec.targets
+        result.targets = builder.build(manuscript, targets, manifest_file=spec.manifest_file)
+    except Exception as e:
+        logger.error(f"Building {spec.name} failed: {e!r}")
+        result.error = e
+    finally:
+        root_logger.removeHandler(collector)
+
+    result.seconds = time.perf_counter() - start
+    result.log = collector.records
+    return result
+
+
+def _emit_log(result: BookResult) -> None:
+    """Hands what a book logged (in a worker) over to the loggers of this process, all in one go, tagged with the name
+    of the book.
+    """
+    for record in result.log:
+        record.msg = f"[{result.name}] {record.msg}"
+        logging.getLogger(record.name).handle(record)
+
+
+def build_batch(specs: List[BuildSpec],
+                max_workers: Optional[int] = None,
+                max_processes: Optional[int] = None) -> List[BookResult]:
+    """Builds every one of the given books, several at a time, each in a process of its own.
+
+    Returns one result per spec, in the same order as the specs. A book failing doesn't stop the others (even if it
+    takes its worker down with it); its result holds the error instead.
+
+    Note:
+    * At most max_workers books are built at the same time (as many as there are CPUs, by default).
+    * If max_processes is given, it caps how many external tools (pandoc, pdflatex) every worker runs at the same time
+      (see external_tools.set_max_processes), so up to max_workers * max_processes of them in all.
+    * Every vault is only listed once, here, for every book in it. Books read their files themselves.
+    * What books log is passed on to the loggers of this process once they're done, one book at a time and tagged
+      with its name, so logs of different books don't get mixed up.
+    """
+    names = [spec.name for spec in specs]
+    if len(set(names)) != len(names):
+        logger.error(f"Book names must be unique, got {names}!")
+        raise ValueError
+
+    vault_files = {}
+    for root_folder in dict.fromkeys(spec.root_folder for spec in specs):
+        vault_files[root_folder] = markdown_importer_innards.list_markdown_files(root_folder)
+
+    logger.info(f"Building {len(specs)} books: {names}")
+    start = time.perf_counter()
+    results: Dict[str, BookResult] = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+                                                mp_context=multiprocessing.get_context(START_METHOD),
+                                                initializer=_initialize_worker,
+                                                initargs=(vault_files,
+                                                          logging.getLogger().getEffectiveLevel(),
+                                                          max_processes)) as executor:
+        futures = {executor.submit(build_book, spec): spec for spec in specs}
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future].name
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker itself died (or the result couldn't make it back), not just the book.
+                logger.error(f"Building {name} failed: {e!r}")
+                result = BookResult(name, error=e)
+
+            _emit_log(result)
+            results[name] = result
+
+    results = [results[name] for name in names]
+    failures = [result.name for result in results if not result.succeeded]
+    logger.info(f"Built {len(specs) - len(failures)} out of {len(specs)} books in {time.perf_counter() - start:.2f}s.")
+    if failures:
+        logger.warning(f"Failed books: {failures}")
+
+    return results
+
+
+def describe_results(results: List[BookResult]) -> List[str]:
+    """Sums up how a batch went: how long every book took, what failed, and the totals.
+    """
+    lines = []
+    for result in results:
+        line = f"{result.name}: "
+        if result.error is not None:
+            line += f"FAILED ({result.error!r})"
+        else:
+            built = [target for target in result.targets if not target.skipped]
+            line += (f"{len(built)} target(s) built, {len(result.targets) - len(built)} up to date "
+                     f"(import {result.import_seconds:.2f}s)")
+            if result.failures:
+                errors = {target.name: target.error for target in result.targets if not target.succeeded}
+                line += ", FAILED: " + ", ".join(f"{name} ({error!r})" for name, error in errors.items())
+        lines.append(f"{line}, {result.seconds:.2f}s")
+
+    failures = [result.name for result in results if not result.succeeded]
+    lines.append(f"{len(results) - len(failures)} out of {len(results)} book(s) built, "
+                 f"{sum(result.seconds for result in results):.2f}s in all.")
+    return lines
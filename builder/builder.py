@@ -0,0 +1,161 @@
+from pathlib import Path
+import concurrent.futures
+import contextlib
+import contextvars
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from ..manuscript import Manuscript
+from ..exporters import external_tools
+from . import manifest
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ExportTarget:
+    """One output to build from a manuscript.
+
+    export is an exporter's export function (e.g. epub_exporter.export), which gets called with the manuscript followed
+    by args and kwargs. name tells the results apart.
+
+    The rest only matters when building with a manifest (see build): outputs are the files the target produces,
+    input_files any files it reads besides the manuscript (template, cover...), and tools the external tools it runs,
+    whose versions count as inputs too.
+    """
+    name: str
+    export: Callable[..., Any]
+    args: tuple = ()
+    kwargs: dict = field(default_factory=dict)
+    outputs: List[Path] = field(default_factory=list)
+    input_files: List[Path] = field(default_factory=list)
+    tools: List[str] = field(default_factory=list)
+
+
+@dataclass
+class TargetResult:
+    """How building an ExportTarget went.
+
+    result is whatever the export function returned, and error whatever it raised (if anything). seconds is how long the
+    export took, from start to finish. skipped is set if the target was up to date, and so not built at all.
+    """
+    name: str
+    result: Any
+    error: Optional[BaseException]
+    seconds: float
+    skipped: bool = False
+
+    @property
+    def succeeded(self) -> bool:
+        return self.error is None
+
+
+def _build_target(manuscript: Manuscript, target: ExportTarget) -> TargetResult:
+    """Builds a single target, never raising.
+    """
+    logger.info(f"Building {target.name}.")
+    start = time.perf_counter()
+    try:
+        result = target.export(manuscript, *target.args, **target.kwargs)
+        error = None
+    except Exception as e:
+        logger.error(f"Building {target.name} failed: {e!r}")
+        result = None
+        error = e
+    seconds = time.perf_counter() - start
+
+    logger.info(f"Done with {target.name} after {seconds:.2f}s.")
+    return TargetResult(target.name, result, error, seconds)
+
+
+def collect_inputs(target: ExportTarget, manuscript_hash: str) -> Dict[str, str]:
+    """Hashes everything the given target depends on, for the manifest.
+    """
+    inputs = {
+        "manuscript": manuscript_hash,
+        "export": f"{target.export.__module__}.{target.export.__qualname__}",
+        "arguments": manifest.hash_arguments(*target.args, **target.kwargs),
+    }
+    for file in target.input_files:
+        inputs[f"file:{file}"] = manifest.hash_file(file)
+    for tool in target.tools:
+        inputs[f"tool:{tool}"] = manifest.hash_tool_version(tool)
+
+    return inputs
+
+
+def build(manuscript: Manuscript,
+          targets: List[ExportTarget],
+          max_workers: Optional[int] = None,
+          max_processes: Optional[int] = None,
+          manifest_file: Optional[Path] = None) -> List[TargetResult]:
+    """Builds all of the given targets from the given manuscript, at the same time.
+
+    Returns one result per target, in the same order as the targets. A target failing doesn't stop the others; its
+    result holds the error instead.
+
+    Note:
+    * Targets run in threads (max_workers of them at most), as exporters spend most of their time waiting on pandoc and
+      pdflatex. The manuscript is shared between them, so exporters must not modify it (and they don't).
+    * Targets must not write to the same outputs.
+    * If max_processes is given, it caps how many external tools (pandoc, pdflatex) the targets of this build run at the
+      same time (see external_tools.limit_processes), on top of the limit for the whole process. Nothing else (e.g.
+      other builds running at the same time) is affected by it.
+    * If manifest_file is given, the inputs of every target that was built successfully are recorded in it, and
+      targets whose inputs haven't changed since (and whose outputs are still there, untouched) are skipped.
+    """
+    names = [target.name for target in targets]
+    if len(set(names)) != len(names):
+        logger.error(f"Target names must be unique, got {names}!")
+        raise ValueError
+
+    entries = {}
+    inputs = {}
+    if manifest_file is not None:
+        entries = manifest.read_manifest(manifest_file)
+        manuscript_hash = manifest.hash_manuscript(manuscript)
+        inputs = {target.name: collect_inputs(target, manuscript_hash) for target in targets}
+
+    def build_target(target: ExportTarget) -> TargetResult:
+        if (manifest_file is not None
+                and manifest.is_up_to_date(target.name,
+                                           entries.get(target.name),
+                                           inputs[target.name],
+                                           target.outputs)):
+            logger.info(f"{target.name} is up to date.")
+            return TargetResult(target.name, None, None, 0.0, skipped=True)
+
+        return _build_target(manuscript, target)
+
+    logger.info(f"Building {len(targets)} targets: {names}")
+    start = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        if max_processes is not None:
+            stack.enter_context(external_tools.limit_processes(max_processes))
+
+        # Targets run in a copy of this context each, so they're under the limit above (contexts can't be shared
+        # between threads).
+        contexts = [contextvars.copy_context() for _ in targets]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(lambda context, target: context.run(build_target, target), contexts, targets))
+
+    if manifest_file is not None:
+        for target, result in zip(targets, results):
+            if result.skipped:
+                continue
+            elif result.succeeded:
+                entries[target.name] = {manifest.INPUTS_KEY: inputs[target.name],
+                                        manifest.OUTPUTS_KEY: manifest.describe_outputs(target.outputs)}
+            else:
+                entries.pop(target.name, None)
+        manifest.write_manifest(manifest_file, entries)
+
+    failures = [result.name for result in results if not result.succeeded]
+    logger.info(f"Built {len(targets) - len(failures)} out of {len(targets)} targets in "
+                f"{time.perf_counter() - start:.2f}s.")
+    if failures:
+        logger.warning(f"Failed targets: {failures}")
+
+    return results
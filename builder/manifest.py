@@ -0,0 +1,152 @@
+from pathlib import Path
+import functools
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import tempfile
+from typing import Dict, Iterable, Optional
+
+from ..manuscript import Manuscript
+from ..exporters import external_tools
+
+logger = logging.getLogger(__name__)
+
+# Bump this whenever what goes into a manifest changes, so old manifests are ignored rather than misread.
+MANIFEST_VERSION = 1
+
+# Stands in for the hash of inputs that don't exist (a missing file, a tool that isn't installed).
+MISSING = "missing"
+
+# Manifest keys. Per target, the manifest records the hash of each of its inputs and what its outputs looked like when
+# they were built.
+VERSION_KEY = "version"
+TARGETS_KEY = "targets"
+INPUTS_KEY = "inputs"
+OUTPUTS_KEY = "outputs"
+
+
+def hash_manuscript(manuscript: Manuscript) -> str:
+    """Hashes the content and config of the given manuscript, i.e. everything that was imported from the vault.
+
+    The time in the config is left out, as importers set it to the moment of importing, which would make every build
+    look new. (The flip side is that a skipped output keeps the date of when it was actually built.)
+    """
+    hasher = hashlib.sha256()
+    config = manuscript.config
+    if config is not None:
+        hasher.update(repr((config.title, config.author, config.cover)).encode("utf-8"))
+
+    for line in manuscript.content:
+        hasher.update(repr(line).encode("utf-8"))
+        hasher.update(b"\0")
+
+    return hasher.hexdigest()
+
+
+def hash_file(file: Path) -> str:
+    """Hashes the contents of the given file, or returns MISSING if there's no such file.
+    """
+    if not file.is_file():
+        return MISSING
+
+    hasher = hashlib.sha256()
+    with open(file, "rb") as in_file:
+        for block in iter(lambda: in_file.read(1 << 20), b""):
+            hasher.update(block)
+
+    return hasher.hexdigest()
+
+
+@functools.cache
+def hash_tool_version(tool: str) -> str:
+    """Hashes what the given external tool says its version is (asking it only once per process).
+    """
+    try:
+        output = external_tools.run_tool([tool, "--version"], check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError):
+        return MISSING
+
+    return hashlib.sha256(output.stdout).hexdigest()
+
+
+def hash_arguments(*args, **kwargs) -> str:
+    """Hashes the given (export) arguments, which are assumed to have a stable repr (strings, numbers, paths...).
+    """
+    return hashlib.sha256(repr((args, sorted(kwargs.items()))).encode("utf-8")).hexdigest()
+
+
+def describe_outputs(outputs: Iterable[Path]) -> Dict[str, Optional[list]]:
+    """Records what the given output files look like (size and modification time), or None for those that don't exist.
+
+    This is enough to notice outputs that were deleted or touched since they were built, without hashing them.
+    """
+    output = {}
+    for file in outputs:
+        try:
+            stat = file.stat()
+            output[str(file)] = [stat.st_size, stat.st_mtime_ns]
+        except FileNotFoundError:
+            output[str(file)] = None
+
+    return output
+
+
+def is_up_to_date(name: str, entry: Optional[dict], inputs: Dict[str, str], outputs: Iterable[Path]) -> bool:
+    """Checks whether the given target (with the given manifest entry) doesn't need building again, given its current
+    inputs and outputs.
+
+    Logs why, if it does.
+    """
+    if entry is None:
+        logger.info(f"{name} was never built before.")
+        return False
+
+    previous_inputs = entry[INPUTS_KEY]
+    changed = sorted(key for key in set(inputs) | set(previous_inputs) if inputs.get(key) != previous_inputs.get(key))
+    if changed:
+        logger.info(f"Inputs of {name} changed: {changed}")
+        return False
+
+    current_outputs = describe_outputs(outputs)
+    if None in current_outputs.values() or current_outputs != entry[OUTPUTS_KEY]:
+        logger.info(f"Outputs of {name} are missing or were changed since they were built.")
+        return False
+
+    return True
+
+
+def read_manifest(manifest_file: Path) -> Dict[str, dict]:
+    """Reads the entries of every target in the given manifest file.
+
+    A missing, broken or outdated manifest just means nothing is up to date.
+    """
+    try:
+        with open(manifest_file, "r", encoding="utf-8") as in_file:
+            manifest = json.load(in_file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read build manifest {manifest_file} ({e}), so building everything.")
+        return {}
+
+    if not isinstance(manifest, dict) or manifest.get(VERSION_KEY) != MANIFEST_VERSION:
+        logger.info(f"Build manifest {manifest_file} is from another version, so building everything.")
+        return {}
+
+    return manifest.get(TARGETS_KEY, {})
+
+
+def write_manifest(manifest_file: Path, entries: Dict[str, dict]) -> None:
+    """Writes the given target entries into the given manifest file (atomically, so it's never half-written).
+    """
+    manifest_file.parent.mkdir(parents=True, exist_ok=True)
+    file_descriptor, temp_name = tempfile.mkstemp(suffix=".json", dir=manifest_file.parent)
+    try:
+        with os.fdopen(file_descriptor, "w", encoding="utf-8") as out_file:
+            json.dump({VERSION_KEY: MANIFEST_VERSION, TARGETS_KEY: entries}, out_file, indent=2, sort_keys=True)
+        os.replace(temp_name, manifest_file)
+    except BaseException:
+        Path(temp_name).unlink(missing_ok=True)
+        raise
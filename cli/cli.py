@@ -0,0 +1,569 @@
+from pathlib import Path
+import argparse
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+from typing import Dict, List, Optional, TextIO, Tuple
+
+from ..manuscript import Manuscript
+from ..importers import markdown_guide_file_importer
+from ..importers import markdown_importer_innards
+from ..importers import markdown_index_file_importer
+from ..importers import markdown_single_file_importer
+from ..exporters import epub_exporter
+from ..exporters import latex_pdf_exporter
+from ..exporters import markdown_exporter
+from ..word_count import word_count
+from ..page_count import page_count
+from ..search import search
+from ..illustrations import illustrations
+from ..diff import diff
+from ..preview import preview
+from ..builder import batch
+from ..builder import builder
+from ..instrumentation import instrumentation
+from . import daemon
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ["pdf", "epub", "markdown"]
+DELIMITER_MODES = {
+    "emoji": markdown_importer_innards.DelimiterMode.EMOJI,
+    "task": markdown_importer_innards.DelimiterMode.TASK,
+}
+DEFAULT_TEMPLATE = Path(latex_pdf_exporter.__file__).parent / "template.tex"
+MANIFEST_FILE_NAME = "build_manifest.json"
+ILLUSTRATIONS_DIRECTORY_NAME = "illustrations"
+
+
+class ManuscriptCache:
+    """Keeps imported manuscripts around between commands, as long as the files they came from don't change.
+
+    Whether anything changed is worked out from the size and modification time of the files the manuscript was imported
+    from (the index file and the notes embedded in them included, see Manuscript.sources) and of the folders in the
+    root folder (files showing up or going away change those, see markdown_importer_innards.scan_markdown_folder), which
+    is much cheaper than importing everything again, or even listing the files in the vault.
+    """
+    def __init__(self):
+        self._manuscripts: Dict[tuple, Tuple[tuple, List[Path], Manuscript]] = {}
+        self._indexes: Dict[tuple, search.ManuscriptIndex] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _fingerprint(source: Path, root_folder: Path, folders: List[Path], sources: List[Path]) -> tuple:
+        # Files showing up or going away count too, as they can change which file a name refers to, and so does the
+        # ignore file.
+        ignore_file = root_folder / markdown_importer_innards.IGNORE_FILE_NAME
+        output = []
+        for file in [*folders, ignore_file, *sorted(set([source] + sources))]:
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                output.append((str(file), None, None))
+                continue
+            output.append((str(file), stat.st_size, stat.st_mtime_ns))
+
+        return tuple(output)
+
+    def load(self,
+             source: Path,
+             root_folder: Path,
+             single_file: bool,
+             delimiter_mode: str,
+             heading: Optional[str] = None) -> Manuscript:
+        key = (source, root_folder, single_file, delimiter_mode, heading)
+
+        with self._lock:
+            cached = self._manuscripts.get(key)
+        if cached is not None:
+            fingerprint, folders, manuscript = cached
+            if fingerprint == self._fingerprint(source, root_folder, folders, manuscript.sources):
+                logger.debug(f"Using the manuscript already loaded from {source}.")
+                return manuscript
+
+        manuscript = _load_manuscript(source, root_folder, single_file, delimiter_mode, heading)
+        # Which files count is only known after importing, so a file changing halfway through an import may go
+        # unnoticed until it changes again. That's a small price for not looking at every file in the vault.
+        folders = markdown_importer_innards.scan_markdown_folder(root_folder)[1]
+        fingerprint = self._fingerprint(source, root_folder, folders, manuscript.sources)
+        with self._lock:
+            self._manuscripts[key] = (fingerprint, folders, manuscript)
+
+        return manuscript
+
+    def index(self, source: Path, root_folder: Path, manuscript: Manuscript) -> search.ManuscriptIndex:
+        """Returns the search index of the given manuscript (as loaded from source), brought up to date with it.
+
+        Indexes are kept around too, so only scenes that changed since the last search are indexed again.
+        """
+        with self._lock:
+            index = self._indexes.setdefault((source, root_folder), search.ManuscriptIndex())
+            index.update(manuscript)
+
+        return index
+
+
+def _load_manuscript(source: Path,
+                     root_folder: Path,
+                     single_file: bool,
+                     delimiter_mode: str,
+                     heading: Optional[str] = None) -> Manuscript:
+    """Imports a manuscript with the importer the arguments ask for.
+    """
+    if single_file and heading is not None:
+        logger.error("A manuscript can come from a single file or from a heading in a guide file, not both!")
+        raise ValueError
+
+    if single_file:
+        manuscript = markdown_single_file_importer.load_manuscript_from_file(source.name, root_folder)
+    elif heading is not None:
+        manuscript = markdown_guide_file_importer.load_manuscript_from_guide_file(source,
+                                                                                  heading,
+                                                                                  root_folder,
+                                                                                  DELIMITER_MODES[delimiter_mode])
+    else:
+        manuscript = markdown_index_file_importer.load_manuscript_from_index_file(source,
+                                                                                  root_folder,
+                                                                                  DELIMITER_MODES[delimiter_mode])
+
+    if manuscript is None:
+        logger.error(f"Could not load a manuscript from {source}!")
+        raise ValueError
+
+    return manuscript
+
+
+def create_parser() -> argparse.ArgumentParser:
+    """Creates the parser for every command the CLI knows.
+    """
+    parser = argparse.ArgumentParser(prog="manuscript_generator_3000",
+                                     description="Generates publishable (ish) documents from manuscripts.")
+    parser.add_argument(daemon.SOCKET_OPTION,
+                        type=Path,
+                        default=os.environ.get(daemon.SOCKET_ENVIRONMENT_VARIABLE),
+                        help="Send commands to the daemon listening on this socket, if there is one "
+                             f"(defaults to ${daemon.SOCKET_ENVIRONMENT_VARIABLE}).")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Log more.")
+    parser.add_argument("--stats", type=Path, help="Write how long each stage took (and counters) here, as JSON.")
+    parser.add_argument("--trace", type=Path, help="Write a trace of the stages here, in the Chrome trace format.")
+    parser.add_argument("--memory",
+                        action="store_true",
+                        help="Also track the peak memory of each stage (and the external tools it ran) for --stats and "
+                             "--trace. Makes everything slower.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    # Everything that works on a manuscript needs to know where to import it from.
+    manuscript_parser = argparse.ArgumentParser(add_help=False)
+    manuscript_parser.add_argument("source", type=Path, help="The index file (or the single file) of the manuscript.")
+    manuscript_parser.add_argument("--root",
+                                   type=Path,
+                                   help="Where the files of the manuscript live (defaults to the folder of source).")
+    manuscript_parser.add_argument("--single-file",
+                                   action="store_true",
+                                   help="source is the whole manuscript, rather than an index file.")
+    manuscript_parser.add_argument("--heading",
+                                   help="source is a guide file, and the manuscript is what's under this heading in it.")
+    manuscript_parser.add_argument("--delimiter-mode", choices=DELIMITER_MODES, default="emoji")
+
+    # And everything that exports, where to put it.
+    export_parser = argparse.ArgumentParser(add_help=False)
+    export_parser.add_argument("--out-dir", type=Path, required=True, help="Where the output files go.")
+    export_parser.add_argument("--name", default="output", help="The name of the output files, minus extension.")
+    export_parser.add_argument("--illustrations",
+                               type=Path,
+                               help="Where the cover and illustrations live (defaults to the root folder).")
+    export_parser.add_argument("--template", type=Path, default=DEFAULT_TEMPLATE, help="The LaTeX template.")
+    export_parser.add_argument("--babel-language", default="english", help="The babel language, for PDFs.")
+    export_parser.add_argument("--language", default="en", help="The (BCP 47) language, for EPUBs.")
+    export_parser.add_argument("--typography",
+                               action="store_true",
+                               help="Curl quotes, turn -- and ... into em dashes and ellipses, and add the non-breaking "
+                                    "spaces the babel language asks for before typesetting, for PDFs.")
+
+    commands.add_parser("import",
+                        parents=[manuscript_parser],
+                        help="Import a manuscript and describe what was found.")
+    commands.add_parser("count", parents=[manuscript_parser], help="Count the words in a manuscript.")
+
+    search_command = commands.add_parser("search",
+                                         parents=[manuscript_parser],
+                                         help="Find where a word (or phrase, or prefix) shows up in a manuscript.")
+    search_command.add_argument("query")
+    search_mode = search_command.add_mutually_exclusive_group()
+    search_mode.add_argument("--phrase", action="store_true", help="Find the words of the query one after the other.")
+    search_mode.add_argument("--prefix", action="store_true", help="Find every word that starts with the query.")
+    search_command.add_argument("--index-file",
+                                type=Path,
+                                help="Keep the index here between searches, so only changed scenes are indexed again.")
+
+    pages_command = commands.add_parser("pages",
+                                        parents=[manuscript_parser],
+                                        help="Estimate how many pages a manuscript would take up as a PDF, without "
+                                             "building it.")
+    pages_command.add_argument("--template", type=Path, default=DEFAULT_TEMPLATE, help="The LaTeX template.")
+    pages_command.add_argument("--calibrate",
+                               type=Path,
+                               metavar="OUT_DIR",
+                               help="Where a previous PDF build of the manuscript went, to calibrate the estimate with.")
+    pages_command.add_argument("--name", default="output", help="The name of that build's files, minus extension.")
+
+    diff_command = commands.add_parser("diff",
+                                       parents=[manuscript_parser],
+                                       help="Compare a manuscript with a snapshot of a previous version of it.")
+    diff_command.add_argument("snapshot", type=Path, help="The snapshot (saved here if there isn't one yet).")
+    diff_command.add_argument("--notes", type=Path, help="Write revision notes (as markdown) here.")
+    diff_command.add_argument("--update-snapshot",
+                              action="store_true",
+                              help="Make the manuscript the new snapshot, once compared.")
+
+    export_command = commands.add_parser("export",
+                                         parents=[manuscript_parser, export_parser],
+                                         help="Export a manuscript into a single format.")
+    export_command.add_argument("format", choices=FORMATS)
+
+    build_command = commands.add_parser("build",
+                                        parents=[manuscript_parser, export_parser],
+                                        help="Export a manuscript into several formats at once, skipping the ones that "
+                                             "are up to date.")
+    build_command.add_argument("--formats", nargs="+", choices=FORMATS, default=FORMATS)
+    build_command.add_argument("--force", action="store_true", help="Build everything, up to date or not.")
+
+    batch_command = commands.add_parser("batch",
+                                        help="Build several manuscripts at once, each in a process of its own.")
+    batch_command.add_argument("batch_file",
+                               type=Path,
+                               help='A JSON list of the manuscripts to build: {"name": ..., "args": [...]}, where args '
+                                    'are what the build command would take.')
+    batch_command.add_argument("--workers", type=int, help="How many manuscripts to build at the same time.")
+    batch_command.add_argument("--max-processes",
+                               type=int,
+                               help="How many external tools (pandoc, pdflatex) each worker runs at the same time.")
+
+    preview_command = commands.add_parser("preview",
+                                          parents=[manuscript_parser],
+                                          help="Serve the manuscript as HTML pages (one per chapter) that reload "
+                                               "themselves as it changes.")
+    preview_command.add_argument("--port", type=int, default=preview.DEFAULT_PORT, help="The port to serve on.")
+    preview_command.add_argument("--illustrations",
+                                 type=Path,
+                                 help="Where the illustrations live (defaults to the root folder).")
+    preview_command.add_argument("--language", default="en", help="The (BCP 47) language of the manuscript.")
+
+    serve_command = commands.add_parser("serve", help="Run a daemon that keeps things warm between commands.")
+    serve_command.add_argument("--socket", dest="serve_socket", type=Path, required=True)
+
+    return parser
+
+
+def _prepare_illustrations(manuscript: Manuscript,
+                           args: argparse.Namespace,
+                           profile: illustrations.ImageProfile) -> Tuple[Path, List[Path]]:
+    """Prepares the illustrations the manuscript uses (cover included) for the given profile, cached under the output
+    folder (see illustrations.prepare_illustrations).
+
+    Returns the folder to export with in place of the illustrations folder, and the prepared illustrations in it.
+    """
+    illustration_dir = args.illustrations or args.root
+    names = illustrations.find_illustrations(manuscript, illustration_dir)
+    prepared_dir = illustrations.prepare_illustrations(manuscript,
+                                                       illustration_dir,
+                                                       args.out_dir / ILLUSTRATIONS_DIRECTORY_NAME,
+                                                       [profile],
+                                                       names=names)[profile.name]
+    return prepared_dir, [prepared_dir / name for name in names]
+
+
+def create_target(export_format: str, manuscript: Manuscript, args: argparse.Namespace) -> builder.ExportTarget:
+    """Creates the build target for exporting into the given format, as the arguments describe it.
+
+    The illustrations the manuscript uses are shrunk down for the format first (see _prepare_illustrations), and the
+    prepared ones are inputs of the targets that use them, so changing one makes them out of date.
+    """
+    if export_format == "pdf":
+        out_file = args.out_dir / f"{args.name}.pdf"
+        illustration_dir, used = _prepare_illustrations(manuscript, args, illustrations.PDF_PROFILE)
+        return builder.ExportTarget(export_format,
+                                    latex_pdf_exporter.export,
+                                    (args.template, illustration_dir, args.out_dir, f"{args.name}.tex",
+                                     args.babel_language, True),
+                                    {"typography": True} if args.typography else {},
+                                    outputs=[out_file],
+                                    input_files=[args.template] + used,
+                                    tools=["pandoc", "pdflatex"])
+    elif export_format == "epub":
+        out_file = args.out_dir / f"{args.name}.epub"
+        illustration_dir, used = _prepare_illustrations(manuscript, args, illustrations.EPUB_PROFILE)
+        return builder.ExportTarget(export_format,
+                                    epub_exporter.export,
+                                    (illustration_dir, out_file, args.language),
+                                    outputs=[out_file],
+                                    input_files=used)
+    else:
+        out_file = args.out_dir / f"{args.name}.md"
+        return builder.ExportTarget(export_format, markdown_exporter.export, (out_file,), outputs=[out_file])
+
+
+def create_targets(args: argparse.Namespace, manuscript: Manuscript) -> List[builder.ExportTarget]:
+    """Creates the build targets of every format the (build) arguments ask for.
+    """
+    return [create_target(export_format, manuscript, args) for export_format in dict.fromkeys(args.formats)]
+
+
+def read_batch_file(batch_file: Path, cwd: Path) -> List[batch.BuildSpec]:
+    """Reads the manuscripts to build from the given batch file (see the batch command), paths in it being relative to
+    cwd.
+    """
+    parser = create_parser()
+    with open(batch_file, "r", encoding="utf-8") as in_file:
+        entries = json.load(in_file)
+
+    specs = []
+    for entry in entries:
+        # argparse would rather exit than complain, which won't do in the daemon.
+        try:
+            args = parser.parse_args(["build"] + entry["args"])
+        except (KeyError, TypeError, SystemExit):
+            logger.error(f"Could not make sense of this entry in {batch_file}: {entry}")
+            raise ValueError
+        _resolve_paths(args, cwd)
+        args.out_dir.mkdir(parents=True, exist_ok=True)
+        specs.append(batch.BuildSpec(entry["name"],
+                                     args.source,
+                                     args.root,
+                                     functools.partial(create_targets, args),
+                                     args.single_file,
+                                     DELIMITER_MODES[args.delimiter_mode],
+                                     None if args.force else args.out_dir / MANIFEST_FILE_NAME,
+                                     args.heading))
+
+    return specs
+
+
+def _resolve_paths(args: argparse.Namespace, cwd: Path) -> None:
+    """Makes every path in the arguments absolute, relative to cwd (which isn't necessarily the working directory of
+    this process, when running in the daemon).
+    """
+    for key, value in vars(args).items():
+        if isinstance(value, Path):
+            setattr(args, key, cwd / value)
+
+    if getattr(args, "source", None) is not None and args.root is None:
+        args.root = args.source.parent
+
+
+def _describe_manuscript(manuscript: Manuscript) -> List[str]:
+    """Describes what was imported, briefly.
+    """
+    content = manuscript.content
+    return [f"Title: {manuscript.config.title}",
+            f"Author: {manuscript.config.author}",
+            f"Cover: {manuscript.config.cover or '(none)'}",
+            f"Parts: {sum(isinstance(line, Manuscript.StartPart) for line in content)}",
+            f"Chapters: {sum(isinstance(line, Manuscript.StartChapter) for line in content)}",
+            f"Scene breaks: {sum(isinstance(line, Manuscript.BreakScene) for line in content)}",
+            f"Paragraphs: {sum(not Manuscript.is_control_type(line) for line in content)}"]
+
+
+def _describe_hits(hits: List[search.Hit], index: search.ManuscriptIndex) -> List[str]:
+    """Describes where the given hits are, one line each.
+    """
+    output = []
+    for hit in hits:
+        title = index.chapter_titles.get(hit.chapter)
+        chapter = f"chapter {hit.chapter}" + (f" ({title})" if title else "")
+        output.append(f"{chapter}, scene {hit.scene}, paragraph {hit.paragraph}, word {hit.word}")
+
+    return output
+
+
+def run_command(args: argparse.Namespace, cwd: Path, out: TextIO, cache: Optional[ManuscriptCache] = None) -> int:
+    """Runs the command in the given (parsed) arguments, writing whatever it has to say into out.
+
+    Returns the exit code. cache, if given, is where manuscripts are kept between commands.
+    """
+    _resolve_paths(args, cwd)
+
+    if args.command == "batch":
+        results = batch.build_batch(read_batch_file(args.batch_file, cwd), args.workers, args.max_processes)
+        out.write("".join(line + "\n" for line in batch.describe_results(results)))
+        return 0 if all(result.succeeded for result in results) else 1
+
+    if cache is not None:
+        manuscript = cache.load(args.source, args.root, args.single_file, args.delimiter_mode, args.heading)
+    else:
+        manuscript = _load_manuscript(args.source, args.root, args.single_file, args.delimiter_mode, args.heading)
+
+    if getattr(args, "out_dir", None) is not None:
+        args.out_dir.mkdir(parents=True, exist_ok=True)
+
+    if args.command == "import":
+        out.write("\n".join(_describe_manuscript(manuscript)) + "\n")
+        return 0
+
+    elif args.command == "count":
+        out.write(f"{word_count.count_words_in_manuscript(manuscript)}\n")
+        return 0
+
+    elif args.command == "search":
+        if cache is not None and args.index_file is None:
+            index = cache.index(args.source, args.root, manuscript)
+        else:
+            index = search.build_index(manuscript, args.index_file)
+
+        if args.phrase:
+            hits = index.find_phrase(args.query)
+        elif args.prefix:
+            hits = index.find_prefix(args.query)
+        else:
+            hits = index.find(args.query)
+
+        out.write("".join(line + "\n" for line in _describe_hits(hits, index)))
+        out.write(f"{len(hits)} hit(s).\n")
+        return 0
+
+    elif args.command == "pages":
+        layout = page_count.read_layout(args.template)
+        calibration = None
+        if args.calibrate is not None:
+            calibration = page_count.calibrate(manuscript, layout, args.calibrate, f"{args.name}.tex")
+
+        estimate = page_count.estimate_pages(manuscript, layout, calibration)
+        out.write("".join(line + "\n" for line in page_count.describe_estimate(estimate)))
+        return 0
+
+    elif args.command == "diff":
+        if not args.snapshot.exists():
+            diff.write_snapshot(manuscript, args.snapshot)
+            out.write(f"No snapshot to compare with yet, so saved one: {args.snapshot}\n")
+            return 0
+
+        manuscript_diff = diff.diff_manuscripts(diff.read_snapshot(args.snapshot), manuscript)
+        out.write("".join(diff.describe_chapter(chapter) + "\n"
+                          for chapter in manuscript_diff.chapters
+                          if chapter.status != diff.UNCHANGED or chapter.moved))
+        out.write(f"{manuscript_diff.count(diff.ADDED)} chapter(s) added, {manuscript_diff.count(diff.REMOVED)} "
+                  f"removed, {manuscript_diff.count(diff.MODIFIED)} modified and {manuscript_diff.moved} moved.\n")
+
+        if args.notes is not None:
+            diff.write_revision_notes(manuscript_diff, args.notes, manuscript.config.title)
+        if args.update_snapshot:
+            diff.write_snapshot(manuscript, args.snapshot)
+        return 0
+
+    elif args.command == "export":
+        result = builder.build(manuscript, [create_target(args.format, manuscript, args)])[0]
+        if not result.succeeded:
+            out.write(f"{result.name}: FAILED ({result.error!r})\n")
+            return 1
+
+        out.write(f"{result.name}: done in {result.seconds:.2f}s\n")
+        return 0
+
+    elif args.command == "build":
+        manifest_file = None if args.force else args.out_dir / MANIFEST_FILE_NAME
+        results = builder.build(manuscript, create_targets(args, manuscript), manifest_file=manifest_file)
+        for result in results:
+            if result.skipped:
+                out.write(f"{result.name}: up to date\n")
+            elif result.succeeded:
+                out.write(f"{result.name}: done in {result.seconds:.2f}s\n")
+            else:
+                out.write(f"{result.name}: FAILED ({result.error!r})\n")
+
+        return 0 if all(result.succeeded for result in results) else 1
+
+    logger.error(f"Unknown command: {args.command}")
+    raise ValueError
+
+
+def _serve(socket_path: Path) -> None:
+    """Runs the daemon, which runs commands for clients with everything (manuscripts, compiled templates...) kept warm
+    in between.
+    """
+    parser = create_parser()
+    cache = ManuscriptCache()
+
+    def run(argv: List[str], cwd: Path, out: TextIO) -> Optional[int]:
+        # Clients don't check their arguments before sending them along. If they don't make sense (or ask for help),
+        # argparse wants to tell the client, so let the client do it.
+        try:
+            args = parser.parse_args(argv)
+        except SystemExit:
+            return None
+
+        if args.command == "serve":
+            out.write("Already serving.\n")
+            return 1
+
+        # Previews run until interrupted, which only the client can do.
+        if args.command == "preview":
+            return None
+
+        # Stats are for the whole process, which the daemon shares between commands, so the client is better off
+        # collecting them itself.
+        if args.stats is not None or args.trace is not None:
+            return None
+
+        try:
+            return run_command(args, cwd, out, cache)
+        except (ValueError, OSError) as e:
+            out.write(f"{args.command} failed: {e!r}\n")
+            return 1
+
+    daemon.serve(socket_path, run)
+
+
+def _preview(args: argparse.Namespace, out: TextIO) -> None:
+    """Serves a live preview of the manuscript until interrupted.
+    """
+    _resolve_paths(args, Path.cwd())
+    cache = ManuscriptCache()
+    manuscript_preview = preview.Preview(
+        lambda: cache.load(args.source, args.root, args.single_file, args.delimiter_mode, args.heading),
+        args.illustrations or args.root,
+        args.language)
+
+    with preview.PreviewServer(manuscript_preview, args.port) as server:
+        out.write(f"Previewing {args.source.name} at {server.url} (Ctrl+C to stop).\n")
+        out.flush()
+        preview.serve(server)
+
+
+def main(argv: List[str] = None) -> int:
+    """The command line entry point. Returns the exit code.
+
+    Commands are run right here, in this process. See __main__.py for how they get sent to a daemon instead.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    args = create_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    if args.command == "serve":
+        _serve(args.serve_socket)
+        return 0
+
+    if args.command == "preview":
+        try:
+            _preview(args, sys.stdout)
+        except (ValueError, OSError) as e:
+            logger.error(f"preview failed: {e!r}")
+            return 1
+        return 0
+
+    if args.stats is not None or args.trace is not None:
+        instrumentation.enable(track_memory=args.memory)
+
+    try:
+        return run_command(args, Path.cwd(), sys.stdout)
+    except (ValueError, OSError) as e:
+        logger.error(f"{args.command} failed: {e!r}")
+        return 1
+    finally:
+        recorder = instrumentation.disable()
+        if args.stats is not None:
+            instrumentation.write_json(recorder, args.stats)
+        if args.trace is not None:
+            instrumentation.write_chrome_trace(recorder, args.trace)
@@ -0,0 +1,129 @@
+from pathlib import Path
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+from typing import Callable, List, Optional, TextIO
+
+# Note: this module is all a client needs to send commands to a daemon, so it shouldn't import anything heavy (like the
+# rest of the package), or commands sent to the daemon won't be quick anymore.
+
+logger = logging.getLogger(__name__)
+
+# Where to find a running daemon, if --socket isn't given.
+SOCKET_ENVIRONMENT_VARIABLE = "MANUSCRIPT_GENERATOR_SOCKET"
+SOCKET_OPTION = "--socket"
+
+# Requests and responses are a single line of JSON each, with these keys.
+ARGV_KEY = "argv"
+CWD_KEY = "cwd"
+EXIT_CODE_KEY = "exit_code"
+OUTPUT_KEY = "output"
+
+ENCODING = "utf-8"
+
+# Runs a command (argv, as it would come from the command line) as if from the given working directory, writing its
+# output into the given stream and returning its exit code (or None if it can't run the command, e.g. because argv
+# doesn't make sense, in which case the client runs it itself, to report the problem).
+CommandRunner = Callable[[List[str], Path, TextIO], Optional[int]]
+
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, run: CommandRunner):
+        self.run = run
+        super().__init__(str(socket_path), _RequestHandler)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self) -> None:
+        request = json.loads(self.rfile.readline().decode(ENCODING))
+        logger.info(f"Running: {request[ARGV_KEY]}")
+
+        out = io.StringIO()
+        try:
+            exit_code = self.server.run(request[ARGV_KEY], Path(request[CWD_KEY]), out)
+        except Exception as e:
+            logger.exception("Command blew up.")
+            out.write(f"The daemon could not run the command: {e!r}\n")
+            exit_code = 1
+
+        response = {EXIT_CODE_KEY: exit_code, OUTPUT_KEY: out.getvalue()}
+        self.wfile.write(json.dumps(response).encode(ENCODING) + b"\n")
+
+
+def _is_listening(socket_path: Path) -> bool:
+    """Checks whether something is listening on the given socket.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(str(socket_path))
+        except (FileNotFoundError, ConnectionRefusedError):
+            return False
+
+    return True
+
+
+def serve(socket_path: Path, run: CommandRunner) -> None:
+    """Listens on the given (Unix) socket for commands, running each with the given runner, until interrupted.
+
+    Commands run in threads, so whatever run keeps around between commands must be thread-safe.
+    """
+    if socket_path.exists():
+        if _is_listening(socket_path):
+            logger.error(f"There's already a daemon listening on {socket_path}!")
+            raise ValueError
+
+        # Left behind by a daemon that didn't get to clean up after itself.
+        socket_path.unlink()
+
+    with _Server(socket_path, run) as server:
+        logger.info(f"Listening on {socket_path}.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Shutting down.")
+        finally:
+            socket_path.unlink(missing_ok=True)
+
+
+def send_command(socket_path: Path, argv: List[str], cwd: Path, out: TextIO) -> Optional[int]:
+    """Sends the given command to the daemon listening on the given socket, writing its output into out.
+
+    Returns the exit code of the command, or None if no daemon is listening (or it couldn't run the command).
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(str(socket_path))
+        except (FileNotFoundError, ConnectionRefusedError):
+            return None
+
+        request = {ARGV_KEY: argv, CWD_KEY: str(cwd)}
+        client.sendall(json.dumps(request).encode(ENCODING) + b"\n")
+
+        with client.makefile("rb") as responses:
+            response = json.loads(responses.readline().decode(ENCODING))
+
+    out.write(response[OUTPUT_KEY])
+    return response[EXIT_CODE_KEY]
+
+
+def find_socket(argv: List[str]) -> Optional[Path]:
+    """Finds the socket the given command line asks for (before the command itself), without parsing all of it.
+    """
+    for index, arg in enumerate(argv):
+        if arg == SOCKET_OPTION and index + 1 < len(argv):
+            return Path(argv[index + 1])
+        elif arg.startswith(SOCKET_OPTION + "="):
+            return Path(arg.split("=", 1)[1])
+        elif not arg.startswith("-"):
+            # That's the command, and whatever comes after is its own business.
+            break
+
+    if os.environ.get(SOCKET_ENVIRONMENT_VARIABLE):
+        return Path(os.environ[SOCKET_ENVIRONMENT_VARIABLE])
+
+    return None
@@ -0,0 +1,373 @@
+from pathlib import Path
+import bisect
+import datetime
+import difflib
+import hashlib
+import json
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from ..manuscript import Manuscript
+from ..exporters import markdown_exporter_innards
+from ..instrumentation import instrumentation
+
+logger = logging.getLogger(__name__)
+
+# Chapters whose title doesn't match are still taken for the same chapter if their paragraphs are at least this
+# similar (see difflib.SequenceMatcher.ratio).
+SIMILARITY_THRESHOLD = 0.6
+
+# What a change to a paragraph (or a run of them) can be, and what the revision notes call it.
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+
+# What can happen to a chapter, on top of ADDED and REMOVED.
+UNCHANGED = "unchanged"
+MODIFIED = "modified"
+
+# Snapshots (see write_snapshot) keep the content as JSON, with the control types tagged.
+SNAPSHOT_VERSION = 1
+SNAPSHOT_TYPE_KEY = "type"
+
+
+@dataclass
+class Chapter:
+    """A chapter of a manuscript, as far as comparing goes: its title and its lines (as markdown, see
+    markdown_exporter_innards.convert_content_to_lines), which include any scene breaks and parts within it.
+    """
+    index: int
+    title: Optional[str]
+    lines: List[str]
+    content_hash: str
+
+
+@dataclass
+class ParagraphChange:
+    """A run of paragraphs that was added, removed or changed within a chapter.
+
+    old_start and new_start are where the run starts in the lines of the old and new chapter, respectively.
+    """
+    kind: str
+    old_start: int
+    old_lines: List[str]
+    new_start: int
+    new_lines: List[str]
+
+
+@dataclass
+class ChapterDiff:
+    """What happened to a chapter between two manuscripts.
+
+    old_index and new_index are its position among the chapters of each (None if it isn't in one of them), and moved is
+    set if it changed places relative to the chapters around it.
+    """
+    status: str
+    title: Optional[str]
+    old_index: Optional[int]
+    new_index: Optional[int]
+    moved: bool = False
+    old_title: Optional[str] = None
+    changes: List[ParagraphChange] = field(default_factory=list)
+
+
+@dataclass
+class ManuscriptDiff:
+    """Everything that happened between two manuscripts, chapter by chapter (in the order of the new one, with removed
+    chapters last).
+    """
+    chapters: List[ChapterDiff]
+
+    def count(self, status: str) -> int:
+        return sum(chapter.status == status for chapter in self.chapters)
+
+    @property
+    def moved(self) -> int:
+        return sum(chapter.moved for chapter in self.chapters)
+
+    @property
+    def has_changes(self) -> bool:
+        return any(chapter.status != UNCHANGED or chapter.moved for chapter in self.chapters)
+
+
+def split_content_into_chapters(content: Manuscript.Content) -> List[Chapter]:
+    """Splits the content of a Manuscript into chapters, any text before the first chapter being a chapter of its own.
+    """
+    chapters = []
+    title = None
+    current = []
+    started = False
+
+    def finish():
+        lines = markdown_exporter_innards.convert_content_to_lines(current)
+        hasher = hashlib.sha256(repr(title).encode("utf-8"))
+        for line in lines:
+            hasher.update(b"\0")
+            hasher.update(line.encode("utf-8"))
+        chapters.append(Chapter(len(chapters), title, lines, hasher.hexdigest()))
+
+    for line in content:
+        if isinstance(line, Manuscript.StartChapter):
+            if started:
+                finish()
+            title = line.config.title
+            current = []
+        else:
+            current.append(line)
+        started = True
+
+    if started:
+        finish()
+
+    return chapters
+
+
+def diff_chapter(old: Chapter, new: Chapter) -> List[ParagraphChange]:
+    """Works out which paragraphs were added, removed or changed between two versions of a chapter.
+    """
+    output = []
+    matcher = difflib.SequenceMatcher(None, old.lines, new.lines, autojunk=False)
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+
+        kind = {"insert": ADDED, "delete": REMOVED, "replace": CHANGED}[tag]
+        output.append(ParagraphChange(kind,
+                                      old_start,
+                                      old.lines[old_start:old_end],
+                                      new_start,
+                                      new.lines[new_start:new_end]))
+
+    return output
+
+
+def _match_chapters(old: List[Chapter], new: List[Chapter]) -> Dict[int, int]:
+    """Works out which old chapter became which new one, returning the index of the old chapter for every new one that
+    has one.
+
+    Identical chapters are matched first (by hash), then chapters with the same title, and then chapters that are
+    similar enough (see SIMILARITY_THRESHOLD).
+    """
+    matches = {}
+    unmatched_old = list(old)
+
+    def match(new_chapter: Chapter, old_chapter: Chapter) -> None:
+        matches[new_chapter.index] = old_chapter.index
+        unmatched_old.remove(old_chapter)
+
+    by_hash: Dict[str, List[Chapter]] = {}
+    for chapter in old:
+        by_hash.setdefault(chapter.content_hash, []).append(chapter)
+    for chapter in new:
+        if by_hash.get(chapter.content_hash):
+            match(chapter, by_hash[chapter.content_hash].pop(0))
+
+    for chapter in new:
+        if chapter.index not in matches:
+            same_title = [candidate for candidate in unmatched_old if candidate.title == chapter.title]
+            if same_title:
+                match(chapter, same_title[0])
+
+    for chapter in new:
+        if chapter.index in matches or not unmatched_old:
+            continue
+
+        def similarity(candidate: Chapter) -> float:
+            matcher = difflib.SequenceMatcher(None, candidate.lines, chapter.lines, autojunk=False)
+            return matcher.ratio() if matcher.quick_ratio() >= SIMILARITY_THRESHOLD else 0.0
+
+        best = max(unmatched_old, key=similarity)
+        if similarity(best) >= SIMILARITY_THRESHOLD:
+            match(chapter, best)
+
+    return matches
+
+
+def _find_moved(matches: Dict[int, int]) -> List[int]:
+    """Works out which of the matched chapters (keyed on their new index) moved, i.e. the fewest chapters that, taken
+    out, leave the rest in the same order they were in.
+    """
+    pairs = sorted(matches.items())
+
+    # The longest increasing run of old indices (in the order of the new ones) stayed put.
+    tails: List[int] = []
+    tail_positions: List[int] = []
+    previous: List[Optional[int]] = []
+    for position, (_, old_index) in enumerate(pairs):
+        length = bisect.bisect_left(tails, old_index)
+        if length == len(tails):
+            tails.append(old_index)
+            tail_positions.append(position)
+        else:
+            tails[length] = old_index
+            tail_positions[length] = position
+        previous.append(tail_positions[length - 1] if length > 0 else None)
+
+    stayed = set()
+    position = tail_positions[-1] if tail_positions else None
+    while position is not None:
+        stayed.add(pairs[position][0])
+        position = previous[position]
+
+    return [new_index for new_index, _ in pairs if new_index not in stayed]
+
+
+@instrumentation.timed("diff")
+def diff_manuscripts(old: Manuscript, new: Manuscript) -> ManuscriptDiff:
+    """Compares two manuscripts (e.g. today's import and a snapshot of a previous one), chapter by chapter.
+
+    Chapters that are identical (by hash) are skipped over without looking at their paragraphs, so only the chapters
+    that actually changed cost anything.
+    """
+    old_chapters = split_content_into_chapters(old.content)
+    new_chapters = split_content_into_chapters(new.content)
+    matches = _match_chapters(old_chapters, new_chapters)
+    moved = set(_find_moved(matches))
+
+    output = []
+    for chapter in new_chapters:
+        if chapter.index not in matches:
+            output.append(ChapterDiff(ADDED, chapter.title, None, chapter.index))
+            continue
+
+        old_chapter = old_chapters[matches[chapter.index]]
+        if old_chapter.content_hash == chapter.content_hash:
+            status, changes = UNCHANGED, []
+        else:
+            status, changes = MODIFIED, diff_chapter(old_chapter, chapter)
+
+        output.append(ChapterDiff(status,
+                                  chapter.title,
+                                  old_chapter.index,
+                                  chapter.index,
+                                  chapter.index in moved,
+                                  old_chapter.title if old_chapter.title != chapter.title else None,
+                                  changes))
+
+    matched_old = set(matches.values())
+    for chapter in old_chapters:
+        if chapter.index not in matched_old:
+            output.append(ChapterDiff(REMOVED, chapter.title, chapter.index, None))
+
+    return ManuscriptDiff(output)
+
+
+def describe_chapter(chapter: ChapterDiff) -> str:
+    """Names the given chapter, and what happened to it.
+    """
+    index = chapter.new_index if chapter.new_index is not None else chapter.old_index
+    name = f"Chapter {index + 1}"
+    if chapter.title:
+        name += f": {chapter.title}"
+
+    details = [chapter.status] if chapter.status != UNCHANGED else []
+    if chapter.moved:
+        details.append(f"moved from {chapter.old_index + 1}")
+    if chapter.old_title is not None:
+        details.append(f"was {chapter.old_title or 'untitled'}")
+
+    return f"{name} ({', '.join(details)})"
+
+
+def _quote(lines: List[str]) -> List[str]:
+    """Quotes the given lines, so they stand out from the notes around them.
+    """
+    return ["\n".join("> " + part for part in line.splitlines() or [""]) for line in lines]
+
+
+def convert_diff_to_lines(diff: ManuscriptDiff) -> List[str]:
+    """Turns the given diff into (markdown) revision notes, one line per paragraph, for
+    markdown_exporter_innards.write_to_file.
+
+    Chapters that didn't change (or move) are left out.
+    """
+    output = [f"{markdown_exporter_innards.MD_HEADING_1} Revision notes",
+              f"{diff.count(ADDED)} chapter(s) added, {diff.count(REMOVED)} removed, {diff.count(MODIFIED)} modified "
+              f"and {diff.moved} moved."]
+
+    for chapter in diff.chapters:
+        if chapter.status == UNCHANGED and not chapter.moved:
+            continue
+
+        output.append(f"{markdown_exporter_innards.MD_HEADING_2} {describe_chapter(chapter)}")
+        for change in chapter.changes:
+            if change.kind == ADDED:
+                output.append(f"Added at paragraph {change.new_start + 1}:")
+                output.extend(_quote(change.new_lines))
+            elif change.kind == REMOVED:
+                output.append(f"Removed from paragraph {change.old_start + 1}:")
+                output.extend(_quote(change.old_lines))
+            else:
+                output.append(f"Changed at paragraph {change.new_start + 1}, was:")
+                output.extend(_quote(change.old_lines))
+                output.append("Now:")
+                output.extend(_quote(change.new_lines))
+
+    return output
+
+
+def write_revision_notes(diff: ManuscriptDiff, out_file: Path, title: str) -> None:
+    """Writes the given diff into the given file as (markdown) revision notes about the manuscript with the given title.
+    """
+    properties = ["---",
+                  f"title: Revision notes for {title}",
+                  f"time: {datetime.datetime.now().replace(microsecond=0).isoformat()}",
+                  "---"]
+    markdown_exporter_innards.write_to_file(properties, convert_diff_to_lines(diff), out_file)
+
+
+def _encode_line(line) -> object:
+    """Turns a line of content into something JSON can hold.
+    """
+    if isinstance(line, Manuscript.StartPart) or isinstance(line, Manuscript.StartChapter):
+        return {SNAPSHOT_TYPE_KEY: type(line).__name__, "title": line.config.title, "numbered": line.config.numbered}
+    if isinstance(line, Manuscript.BreakScene):
+        return {SNAPSHOT_TYPE_KEY: type(line).__name__}
+
+    return line
+
+
+def _decode_line(line) -> object:
+    """The reverse of _encode_line.
+    """
+    if not isinstance(line, dict):
+        return line
+    if line[SNAPSHOT_TYPE_KEY] == Manuscript.BreakScene.__name__:
+        return Manuscript.BreakScene()
+
+    separator_type = getattr(Manuscript, line[SNAPSHOT_TYPE_KEY])
+    return separator_type(Manuscript.SeparatorConfig(line["title"], line["numbered"]))
+
+
+def write_snapshot(manuscript: Manuscript, snapshot_file: Path) -> None:
+    """Saves the given manuscript into the given file, to compare later versions of it with (see read_snapshot).
+    """
+    config = manuscript.config
+    snapshot = {"version": SNAPSHOT_VERSION,
+                "config": {"title": config.title,
+                           "author": config.author,
+                           "cover": str(config.cover) if config.cover else "",
+                           "time": config.time.isoformat()},
+                "content": [_encode_line(line) for line in manuscript.content]}
+
+    with open(snapshot_file, "w", encoding="utf-8") as out:
+        json.dump(snapshot, out, ensure_ascii=False)
+
+
+def read_snapshot(snapshot_file: Path) -> Manuscript:
+    """Reads a manuscript saved by write_snapshot.
+    """
+    with open(snapshot_file, "r", encoding="utf-8") as in_file:
+        snapshot = json.load(in_file)
+
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        logger.error(f"Snapshot {snapshot_file} is from another version!")
+        raise ValueError
+
+    config = snapshot["config"]
+    return Manuscript([_decode_line(line) for line in snapshot["content"]],
+                      Manuscript.Config(config["title"],
+                                        config["author"],
+                                        config["cover"],
+                                        datetime.datetime.fromisoformat(config["time"])))
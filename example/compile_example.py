@@ -12,6 +12,8 @@ from manuscript_generator_3000.exporters import markdown_exporter
 from manuscript_generator_3000.exporters import latex_pdf_exporter
 from manuscript_generator_3000.exporters import epub_exporter
 from manuscript_generator_3000.word_count import word_count
+from manuscript_generator_3000.illustrations import illustrations
+from manuscript_generator_3000.builder import builder
 
 
 def compile():
@@ -34,35 +36,73 @@ def compile():
     # count.
     word_count.log_word_count(manuscript)
 
+    # Illustrations
+    # Straight out of the vault, the cover and any illustrations are usually much bigger than any output needs, so we
+    # shrink them down once per kind of output (and keep them around, so the next build doesn't have to.)
+    illustrations_folder = root_folder  # No illustrations in this example, we could just not pass this in.
+    prepared_illustrations = illustrations.prepare_illustrations(manuscript,
+                                                                 illustrations_folder,
+                                                                 output_path / "illustrations",
+                                                                 [illustrations.PDF_PROFILE,
+                                                                  illustrations.EPUB_PROFILE])
+    pdf_illustrations = prepared_illustrations[illustrations.PDF_PROFILE.name]
+    epub_illustrations = prepared_illustrations[illustrations.EPUB_PROFILE.name]
+    used_illustrations = illustrations.find_illustrations(manuscript, illustrations_folder)
+
     # PDF export (via markdown -> pandoc -> LaTeX)
     # We can export our manuscript into a PDF (which is what I usually do to mark for edits.)
     # To do that, we need to define a few more params.
     # This LaTeX file will contain the output of pandoc converting the markdown output into the latex template, and the
     # params below are substitutions to make in the template (where illustrations live, etc.)
     latex_file = "output.tex"
-    illustrations_folder = root_folder  # No illustrations in this example, we could just not pass this in.
     latex_template = package_path / Path("exporters/template.tex")
     babel_language = "english"
 
-    latex_pdf_exporter.export(manuscript,
-                              latex_template,
-                              illustrations_folder,
-                              output_path,
-                              latex_file,
-                              babel_language,
-                              True)
+    # Besides the export itself, the build needs to know what goes in and out of it, so it can skip the export when
+    # nothing changed since the last time around.
+    pdf_target = builder.ExportTarget("pdf",
+                                      latex_pdf_exporter.export,
+                                      (latex_template,
+                                       pdf_illustrations,
+                                       output_path,
+                                       latex_file,
+                                       babel_language,
+                                       True),
+                                      outputs=[output_path / "output.pdf"],
+                                      input_files=[latex_template] + [pdf_illustrations / name
+                                                                      for name in used_illustrations],
+                                      tools=["pandoc", "pdflatex"])
 
-    # EPUB export (via pandoc)
+    # EPUB export
     epub_file = output_path / "output.epub"
-    epub_exporter.export(manuscript,
-                         illustrations_folder,
-                         epub_file)
+    epub_target = builder.ExportTarget("epub",
+                                       epub_exporter.export,
+                                       (epub_illustrations, epub_file),
+                                       outputs=[epub_file],
+                                       input_files=[epub_illustrations / name for name in used_illustrations])
 
     # We can also export to markdown, which essentially means we've just concatenated our entire manuscript into a
     # single file. I find this useful as an intermediate format to export into other things (pandoc is awesome) or to
     # have a broader overview of the manuscript.
     out_md_file = output_path / Path("output.md")
-    markdown_exporter.export(manuscript, out_md_file)
+    markdown_target = builder.ExportTarget("markdown",
+                                           markdown_exporter.export,
+                                           (out_md_file,),
+                                           outputs=[out_md_file])
+
+    # The exporters only ever read the manuscript, so we can run them all at the same time. The manifest remembers what
+    # went into each output, so running this again on an untouched manuscript doesn't rebuild anything.
+    results = builder.build(manuscript,
+                            [pdf_target, epub_target, markdown_target],
+                            manifest_file=output_path / "build_manifest.json")
+    for result in results:
+        status = "up to date" if result.skipped else "done" if result.succeeded else "FAILED"
+        logging.info(f"{result.name}: {status} in {result.seconds:.2f}s")
+
+    # Don't let failures go unnoticed.
+    for result in results:
+        if not result.succeeded:
+            raise result.error
 
 
 if __name__ == "__main__":
@@ -1,34 +1,143 @@
 from pathlib import Path
+import asyncio
+import os
 import subprocess
 import logging
+from typing import Optional
 
 from ..manuscript import Manuscript
-from . import markdown_exporter_innards
+from ..instrumentation import instrumentation
+from . import pandoc_ast
+from . import epub_exporter_innards as innards
+from . import external_tools
 
 logger = logging.getLogger(__name__)
 
 
+@instrumentation.timed("export.epub")
 def export(manuscript: Manuscript,
            illustration_dir: Path,
-           out_file: Path) -> None:
-    """A (very) simple epub exporter.
+           out_file: Path,
+           language: str = "en",
+           incremental: bool = False) -> None:
+    """Exports the given manuscript into an EPUB (3) file, all by itself (i.e. no pandoc required).
+
+    Note:
+    * illustration_dir should contain any pictures included in the text (namely the cover specified in manuscript).
+    * out_file will be used as the file to output the epub into.
+    * language is the (BCP 47) language of the book, e.g. "en" or "pt-PT".
+    * Each chapter becomes its own document in the book, and is written straight into the archive, one chapter at a
+      time, so memory use doesn't grow with the size of the book.
+    * Only a subset of markdown is understood (emphasis, links, images, headings and quotes), which covers prose. For
+      lists, footnotes, strikeout, TeX math, raw HTML and HTML entities on top of that, see export_with_pandoc (and
+      pandoc_ast).
+    * If incremental is set and out_file already exists, chapters that haven't changed since it was built are copied
+      over from it (still compressed) instead of being rendered again. The new book is written next to the old one and
+      only replaces it once it's done.
+    """
+    config = manuscript.config
+    media = {}
+
+    cover = None
+    if config.cover:
+        cover = innards.add_media(illustration_dir, config.cover, media)
+
+    previous = None
+    if incremental and out_file.exists():
+        previous = innards.open_previous_epub(out_file)
+
+    target_file = out_file
+    if previous is not None:
+        target_file = out_file.with_name(out_file.name + ".partial")
+
+    logger.info(f"Writing EPUB: {out_file}")
+    try:
+        with innards.ZipWriter(target_file) as archive:
+            innards.write_fixed_files(archive)
+
+            if cover is not None:
+                innards.write_cover_page(archive, cover, config, language)
+
+            with instrumentation.stage("epub.chapters"):
+                documents = innards.write_chapters(archive,
+                                                   manuscript.content,
+                                                   language,
+                                                   illustration_dir,
+                                                   media,
+                                                   previous)
+            logger.info(f"Wrote {len(documents)} chapters.")
+
+            identifier = innards.create_identifier(config)
+            innards.write_media(archive, media.values())
+            innards.write_streamed(archive,
+                                   f"{innards.EPUB_DIRECTORY}/{innards.NAV_FILE}",
+                                   innards.render_nav(documents, config, language))
+            innards.write_streamed(archive,
+                                   f"{innards.EPUB_DIRECTORY}/{innards.NCX_FILE}",
+                                   innards.render_ncx(documents, config, identifier))
+            innards.write_streamed(archive,
+                                   f"{innards.EPUB_DIRECTORY}/{innards.PACKAGE_FILE}",
+                                   innards.render_package(documents,
+                                                          media.values(),
+                                                          cover,
+                                                          config,
+                                                          language,
+                                                          identifier,
+                                                          innards.create_chapter_hash_metadata(documents)))
+    except BaseException:
+        if target_file != out_file:
+            target_file.unlink(missing_ok=True)
+        raise
+    finally:
+        if previous is not None:
+            innards.close_previous_epub(previous)
+
+    if target_file != out_file:
+        os.replace(target_file, out_file)
+
+
+async def export_async(manuscript: Manuscript,
+                       illustration_dir: Path,
+                       out_file: Path,
+                       language: str = "en",
+                       incremental: bool = False) -> None:
+    """Same as export, but in a thread, so as not to block the event loop.
+    """
+    await asyncio.to_thread(export, manuscript, illustration_dir, out_file, language, incremental)
+
+
+def export_with_pandoc(manuscript: Manuscript,
+                       illustration_dir: Path,
+                       out_file: Path,
+                       timeout: Optional[float] = None) -> None:
+    """A (very) simple epub exporter (see export_with_pandoc_async for the details).
+    """
+    asyncio.run(export_with_pandoc_async(manuscript, illustration_dir, out_file, timeout))
+
+
+@instrumentation.timed("export.epub_with_pandoc")
+async def export_with_pandoc_async(manuscript: Manuscript,
+                                   illustration_dir: Path,
+                                   out_file: Path,
+                                   timeout: Optional[float] = None) -> None:
+    """A (very) simple epub exporter, which doesn't block the event loop while pandoc runs.
 
     Requires that pandoc be in the PATH.
 
     Note:
     * illustration_dir should contain any pictures included in the text (namely the cover specified in manuscript).
     * out_file will be used as the file to output the epub into.
-    starts.
+    * If timeout is given, pandoc gets that many seconds before it is killed (and subprocess.TimeoutExpired raised).
     """
 
-    # TODO: for the moment, we don't support parts when exporting to epub, we we tell the markdown side of the exporter
-    # to straight-up ignore them.
-    markdown_content = markdown_exporter_innards.convert_content_to_lines(manuscript.content, ignore_parts=True)
-    pandoc_input = markdown_exporter_innards.concatenate_content_lines_into_string(markdown_content).encode('utf-8')
+    # TODO: for the moment, we don't support parts when exporting to epub, we we tell the conversion to straight-up
+    # ignore them.
+    # pandoc gets the document ready-made (see pandoc_ast), rather than markdown to parse, and writes the epub itself.
+    pandoc_input = await pandoc_ast.encode_document_async([manuscript.content], ignore_parts=True)
 
     # This whole thing revolves around pandoc
     pandoc_cmd = ["pandoc",
-                  "-f", "markdown",
+                  "-f", "json",
                   "-t", "epub",
                   "--number-sections",
                   f"--metadata=title:{manuscript.config.title}",
@@ -43,13 +152,8 @@ def export(manuscript: Manuscript,
     logging.info("Executing pandoc with the following command:")
     logging.info(" ".join(pandoc_cmd))
 
-    # Cross fingers
+    # Cross fingers. Whatever pandoc has to say goes into the logs as it says it.
     try:
-        subprocess.run(pandoc_cmd,
-                       input=pandoc_input,
-                       check=True,
-                       capture_output=True)
+        await external_tools.run_tool_async(pandoc_cmd, input=pandoc_input, timeout=timeout)
     except subprocess.CalledProcessError as e:
-        print("Command failed with return code", e.returncode)
-        print("stdout:", e.stdout.decode('utf-8') if e.stdout else "")
-        print("stderr:", e.stderr.decode('utf-8') if e.stderr else "")
+        logger.error(f"Command failed with return code {e.returncode}")
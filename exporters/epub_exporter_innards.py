@@ -0,0 +1,783 @@
+from pathlib import Path
+import logging
+import datetime
+import hashlib
+import html
+import io
+import mimetypes
+import re
+import struct
+import urllib.parse
+import uuid
+import zipfile
+import zlib
+import xml.etree.ElementTree as ElementTree
+from dataclasses import dataclass
+from collections.abc import Iterable, Iterator
+from typing import BinaryIO, Dict, List, Optional, Set
+
+from ..manuscript import Manuscript
+
+logger = logging.getLogger(__name__)
+
+# Where things live inside the archive.
+MIMETYPE_FILE = "mimetype"
+MIMETYPE = "application/epub+zip"
+CONTAINER_FILE = "META-INF/container.xml"
+EPUB_DIRECTORY = "EPUB"
+PACKAGE_FILE = "content.opf"
+NAV_FILE = "nav.xhtml"
+NCX_FILE = "toc.ncx"
+STYLESHEET_FILE = "stylesheet.css"
+COVER_PAGE_FILE = "cover.xhtml"
+CHAPTER_FILE_NAME = "chapter_{index:03d}.xhtml"
+MEDIA_DIRECTORY = "media"
+
+# Each chapter's content hash is recorded in the package metadata under this prefix (followed by the chapter's file
+# name), so the next build can tell which chapters it can copy over as they are.
+CHAPTER_HASH_META_PREFIX = "manuscript_generator_3000:chapter-hash:"
+OPF_NAMESPACE = "http://www.idpf.org/2007/opf"
+
+# Bump this whenever the way chapters are rendered changes, so incremental builds don't hang on to stale chapters.
+CHAPTER_RENDERER_VERSION = "2"
+
+# The bits of the zip format EPUBs are written with (see ZipWriter), as laid out in PKWARE's APPNOTE.TXT. Headers are
+# little-endian structs, each starting with its signature.
+ZIP_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+ZIP_LOCAL_HEADER_SIGNATURE = 0x04034B50
+ZIP_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+ZIP_CENTRAL_HEADER_SIGNATURE = 0x02014B50
+ZIP_END_RECORD = struct.Struct("<IHHHHIIH")
+ZIP_END_RECORD_SIGNATURE = 0x06054B50
+# Version 2.0 of the format (deflate), made on Unix (for the file type and permissions in the external attributes,
+# which are those of a regular rw-r--r-- file).
+ZIP_VERSION = 20
+ZIP_MADE_BY = (3 << 8) | ZIP_VERSION
+ZIP_UTF8_FLAG = 0x800
+ZIP_EXTERNAL_ATTRIBUTES = 0o100644 << 16
+# Anything bigger than this needs zip64, which no EPUB should.
+ZIP_MAX_SIZE = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+
+# Entries get a fixed timestamp (1980-01-01 00:00:00, as MS-DOS has it), so that building the same book twice gives the
+# same file.
+ZIP_ENTRY_DATE = (1 << 5) | 1
+ZIP_ENTRY_TIME = 0
+
+# How much of a media file is read at a time while copying it into the book.
+MEDIA_CHUNK_SIZE = 64 * 1024
+
+# The identifier of the book is derived from its title and author, so that rebuilding the same book gives the same
+# identifier, and readers don't think it's a different one.
+IDENTIFIER_NAMESPACE = uuid.UUID("8ad4b0a1-4a7a-4a43-9a5e-2b0a53d8e7f1")
+
+CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="{package_path}" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+STYLESHEET = """body { margin: 5%; text-align: justify; }
+h1 { text-align: center; margin: 2em 0; }
+p { margin: 0; text-indent: 1.5em; }
+hr.scene-break { border: none; margin: 1em 0; text-align: center; }
+hr.scene-break::after { content: "* * *"; }
+div.cover { text-align: center; }
+div.cover img { max-width: 100%; max-height: 100%; }
+"""
+
+XHTML_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="{language}" lang="{language}">
+<head>
+  <meta charset="UTF-8"/>
+  <title>{title}</title>
+  <link rel="stylesheet" type="text/css" href="{stylesheet}"/>
+</head>
+<body{body_attributes}>
+"""
+XHTML_FOOTER = """</body>
+</html>
+"""
+
+# Bits of markdown we know how to turn into XHTML. This is by no means a full markdown parser (that's what the pandoc
+# exporter is for), but it covers what shows up in prose.
+MD_HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*)$")
+MD_BLOCKQUOTE_PREFIX = ">"
+MD_IMAGE_PATTERN = re.compile(r"!\[([^\]]*)\]\(([^)\s]+)\)")
+MD_LINK_PATTERN = re.compile(r"\[([^\]]+)\]\(([^)\s]+)\)")
+MD_CODE_PATTERN = re.compile(r"`([^`]+)`")
+MD_STRONG_PATTERN = re.compile(r"\*\*(?=\S)(.+?)(?<=\S)\*\*|__(?=\S)(.+?)(?<=\S)__")
+MD_EMPHASIS_PATTERN = re.compile(r"\*(?=\S)(.+?)(?<=\S)\*|(?<!\w)_(?=\S)(.+?)(?<=\S)_(?!\w)")
+MD_ESCAPE_PATTERN = re.compile(r"\\([\\`*_{}\[\]()#+\-.!>])")
+
+# Escaped characters and code spans are swapped out for these while the rest of the markup is converted, so that they
+# don't get mistaken for markup themselves.
+PLACEHOLDER = "\0{index}\0"
+PLACEHOLDER_PATTERN = re.compile("\0(\\d+)\0")
+
+# Smart punctuation, the way pandoc's markdown reader does it. Quotes open at the start of the text, after whitespace,
+# and after these, and close everywhere else.
+SMART_REPLACEMENTS = [("---", "\u2014"), ("--", "\u2013"), ("...", "\u2026")]
+SMART_QUOTE_PATTERN = re.compile("[\"']")
+OPENING_QUOTE_CONTEXT = "([{\u2014\u2013-/"
+SMART_QUOTES = {'"': ("\u201c", "\u201d"), "'": ("\u2018", "\u2019")}
+
+# Where links and images point to, which is left alone by smart punctuation, and the bits of inline markup that don't
+# count as what comes before a quote (as they aren't text).
+MD_TARGET_PATTERN = re.compile(r"\]\([^)\s]*\)")
+MD_MARKUP_CHARACTERS = "*_[]!"
+
+
+@dataclass
+class EpubDocument:
+    """A document in the spine of the book, i.e. one of the files the reader pages through.
+
+    title and number are what goes into the table of contents; documents without a title are left out of it.
+    content_hash identifies what went into the document (see hash_chapter).
+    """
+    file_name: str
+    title: Optional[str]
+    number: Optional[int]
+    content_hash: Optional[str] = None
+
+
+@dataclass
+class EpubMedia:
+    """An image (or other media) file that is copied into the book.
+    """
+    source: Path
+    file_name: str
+    media_type: str
+
+
+@dataclass
+class _ZipEntry:
+    """What the central directory of a zip file needs to know about an entry.
+    """
+    file_name: bytes
+    flags: int
+    compress_type: int
+    header_offset: int
+    crc: int = 0
+    compress_size: int = 0
+    file_size: int = 0
+
+
+class ZipWriter:
+    """Writes a zip file (an EPUB, really) one entry at a time, without holding any of them in memory.
+
+    zipfile can't add an entry that's already compressed, which incremental builds need (see copy_compressed_entry),
+    so EPUBs are written with this instead. It only does what EPUBs need: stored and deflated entries, with a fixed
+    timestamp and no zip64. Use it as a context manager; the central directory is only written if nothing went wrong.
+    """
+    def __init__(self, out_file: Path):
+        self._file = out_file.open("wb")
+        self._entries: List[_ZipEntry] = []
+        self._file_names: Set[bytes] = set()
+
+    def __enter__(self) -> "ZipWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            if exc_type is None:
+                self._write_central_directory()
+        finally:
+            self._file.close()
+
+    def _start_entry(self, file_name: str, compress_type: int) -> _ZipEntry:
+        encoded_name = file_name.encode("utf-8")
+        if encoded_name in self._file_names:
+            logger.error(f"There's already an entry called {file_name} in the archive!")
+            raise ValueError
+
+        if len(self._entries) == ZIP_MAX_ENTRIES:
+            logger.error("Too many entries for a zip file without zip64!")
+            raise ValueError
+
+        flags = ZIP_UTF8_FLAG if not file_name.isascii() else 0
+        entry = _ZipEntry(encoded_name, flags, compress_type, self._file.tell())
+        self._file_names.add(encoded_name)
+        self._entries.append(entry)
+        return entry
+
+    def _write_local_header(self, entry: _ZipEntry) -> None:
+        self._file.write(ZIP_LOCAL_HEADER.pack(ZIP_LOCAL_HEADER_SIGNATURE, ZIP_VERSION, entry.flags,
+                                               entry.compress_type, ZIP_ENTRY_TIME, ZIP_ENTRY_DATE, entry.crc,
+                                               entry.compress_size, entry.file_size, len(entry.file_name), 0))
+        self._file.write(entry.file_name)
+
+    def _finish_entry(self, entry: _ZipEntry) -> None:
+        if max(entry.compress_size, entry.file_size, self._file.tell()) > ZIP_MAX_SIZE:
+            logger.error(f"{entry.file_name.decode('utf-8')} doesn't fit in a zip file without zip64!")
+            raise ValueError
+
+    def write(self, file_name: str, chunks: Iterable[bytes], compress_type: int = zipfile.ZIP_DEFLATED) -> None:
+        """Writes an entry made of the given chunks of data, (deflate) compressing them as they come if asked to.
+
+        The sizes and CRC only get into the local header once all the data is in, so it's written twice.
+        """
+        if compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            logger.error(f"Unsupported compression type: {compress_type}")
+            raise ValueError
+
+        entry = self._start_entry(file_name, compress_type)
+        self._write_local_header(entry)
+
+        compressor = None
+        if compress_type == zipfile.ZIP_DEFLATED:
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+
+        for chunk in chunks:
+            entry.crc = zlib.crc32(chunk, entry.crc)
+            entry.file_size += len(chunk)
+            data = compressor.compress(chunk) if compressor is not None else chunk
+            self._file.write(data)
+            entry.compress_size += len(data)
+
+        if compressor is not None:
+            data = compressor.flush()
+            self._file.write(data)
+            entry.compress_size += len(data)
+
+        end = self._file.tell()
+        self._file.seek(entry.header_offset)
+        self._write_local_header(entry)
+        self._file.seek(end)
+        self._finish_entry(entry)
+
+    def write_compressed(self,
+                         file_name: str,
+                         compressed_data: bytes,
+                         compress_type: int,
+                         crc: int,
+                         file_size: int) -> None:
+        """Writes an entry whose data is already compressed (e.g. taken from another zip file) as it is.
+        """
+        entry = self._start_entry(file_name, compress_type)
+        entry.crc = crc
+        entry.compress_size = len(compressed_data)
+        entry.file_size = file_size
+        self._write_local_header(entry)
+        self._file.write(compressed_data)
+        self._finish_entry(entry)
+
+    def _write_central_directory(self) -> None:
+        start = self._file.tell()
+        for entry in self._entries:
+            # No extra field, comment, disk number or internal attributes.
+            self._file.write(ZIP_CENTRAL_HEADER.pack(ZIP_CENTRAL_HEADER_SIGNATURE, ZIP_MADE_BY, ZIP_VERSION,
+                                                     entry.flags, entry.compress_type, ZIP_ENTRY_TIME, ZIP_ENTRY_DATE,
+                                                     entry.crc, entry.compress_size, entry.file_size,
+                                                     len(entry.file_name), 0, 0, 0, 0, ZIP_EXTERNAL_ATTRIBUTES,
+                                                     entry.header_offset))
+            self._file.write(entry.file_name)
+
+        size = self._file.tell() - start
+        if self._file.tell() > ZIP_MAX_SIZE:
+            logger.error("The archive doesn't fit in a zip file without zip64!")
+            raise ValueError
+
+        self._file.write(ZIP_END_RECORD.pack(ZIP_END_RECORD_SIGNATURE, 0, 0, len(self._entries), len(self._entries),
+                                             size, start, 0))
+
+
+@dataclass
+class PreviousEpub:
+    """A previous build of an EPUB, whose chapters may be reused as they are.
+
+    raw_file is a separate handle on the same file, for reading compressed entries straight off the disk.
+    """
+    archive: zipfile.ZipFile
+    raw_file: BinaryIO
+    chapter_hashes: Dict[str, str]
+    file_names: Set[str]
+
+
+def create_identifier(config: Manuscript.Config) -> str:
+    """Creates a stable identifier for the book described by the given config.
+    """
+    return "urn:uuid:" + str(uuid.uuid5(IDENTIFIER_NAMESPACE, f"{config.title}\n{config.author}"))
+
+
+def _format_modified_time(time: datetime.datetime) -> str:
+    """Formats the given time the way EPUB wants it for dcterms:modified, i.e. in UTC without fractions of seconds.
+    """
+    if time.tzinfo is not None:
+        time = time.astimezone(datetime.timezone.utc)
+
+    return time.replace(microsecond=0, tzinfo=None).isoformat() + "Z"
+
+
+def add_media(illustration_dir: Path, name: str, media: Dict[str, EpubMedia]) -> EpubMedia:
+    """Registers the given file (relative to illustration_dir) to be copied into the book (once), returning its entry.
+
+    Where a file ends up in the book only depends on its name, so chapters can be reused across builds.
+    """
+    if name not in media:
+        media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        media[name] = EpubMedia(illustration_dir / name, f"{MEDIA_DIRECTORY}/{Path(name).as_posix()}", media_type)
+
+    return media[name]
+
+
+def smarten(text: str, previous: str = "", transparent: str = "") -> str:
+    """Curls the quotes in the given text, and turns dashes and dots into the real thing.
+
+    previous is whatever came right before the text (if anything), which decides whether a quote at the very start
+    opens or closes. Characters in transparent are looked past when deciding that (e.g. markup, which isn't text).
+    """
+    def curl(match: re.Match) -> str:
+        start = match.start()
+        while start > 0 and text[start - 1] in transparent:
+            start -= 1
+        before = text[start - 1] if start > 0 else previous
+        opening, closing = SMART_QUOTES[match.group()]
+        return opening if not before or before.isspace() or before in OPENING_QUOTE_CONTEXT else closing
+
+    text = SMART_QUOTE_PATTERN.sub(curl, text)
+    for plain, smart in SMART_REPLACEMENTS:
+        text = text.replace(plain, smart)
+
+    return text
+
+
+def _smarten_markdown(text: str) -> str:
+    """Applies smart punctuation (see smarten) to inline markdown, leaving where links and images point to alone.
+    """
+    output = []
+    position = 0
+    for match in MD_TARGET_PATTERN.finditer(text):
+        output.append(smarten(text[position:match.start()], text[position - 1] if position else "",
+                              MD_MARKUP_CHARACTERS))
+        output.append(match.group())
+        position = match.end()
+
+    output.append(smarten(text[position:], text[position - 1] if position else "", MD_MARKUP_CHARACTERS))
+    return "".join(output)
+
+
+def _quote_href(href: str) -> str:
+    """Makes the given (relative) file name safe to use in href/src attributes.
+    """
+    return html.escape(urllib.parse.quote(href))
+
+
+def convert_inline_markdown_to_xhtml(text: str,
+                                     illustration_dir: Path = None,
+                                     media: Dict[str, EpubMedia] = None) -> str:
+    """Converts the inline markdown in the given text (emphasis, links, etc) into XHTML, with smart punctuation (as
+    pandoc would have it).
+
+    Images are only kept if they can be found in illustration_dir, in which case they're added to media.
+    """
+    protected = []
+
+    def protect(xhtml: str) -> str:
+        protected.append(xhtml)
+        return PLACEHOLDER.format(index=len(protected) - 1)
+
+    # Code spans and escaped characters are taken literally, so they go first.
+    text = MD_CODE_PATTERN.sub(lambda match: protect("<code>" + html.escape(match.group(1), quote=False) + "</code>"),
+                               text)
+    text = MD_ESCAPE_PATTERN.sub(lambda match: protect(html.escape(match.group(1), quote=False)), text)
+    text = _smarten_markdown(text)
+
+    def convert_image(match: re.Match) -> str:
+        if illustration_dir is None or media is None or not (illustration_dir / match.group(2)).is_file():
+            logger.warning(f"Could not find image {match.group(2)}, leaving it out.")
+            return protect(html.escape(match.group(1), quote=False))
+
+        entry = add_media(illustration_dir, match.group(2), media)
+        return protect(f'<img src="../{_quote_href(entry.file_name)}" alt="{html.escape(match.group(1))}"/>')
+
+    text = MD_IMAGE_PATTERN.sub(convert_image, text)
+    text = MD_LINK_PATTERN.sub(lambda match: protect(f'<a href="{html.escape(match.group(2))}">')
+                               + match.group(1) + protect("</a>"),
+                               text)
+
+    text = html.escape(text, quote=False)
+    text = MD_STRONG_PATTERN.sub(lambda match: "<strong>" + (match.group(1) or match.group(2)) + "</strong>", text)
+    text = MD_EMPHASIS_PATTERN.sub(lambda match: "<em>" + (match.group(1) or match.group(2)) + "</em>", text)
+
+    return PLACEHOLDER_PATTERN.sub(lambda match: protected[int(match.group(1))], text)
+
+
+def convert_line_to_xhtml(line: str, illustration_dir: Path = None, media: Dict[str, EpubMedia] = None) -> str:
+    """Converts a line of Manuscript content (which is a paragraph, as far as markdown goes) into XHTML.
+    """
+    heading = MD_HEADING_PATTERN.match(line)
+    if heading:
+        # Chapter titles are h1, so anything in the text goes one level below that.
+        level = min(len(heading.group(1)) + 1, 6)
+        text = convert_inline_markdown_to_xhtml(heading.group(2), illustration_dir, media)
+        return f"<h{level}>{text}</h{level}>\n"
+
+    if line.startswith(MD_BLOCKQUOTE_PREFIX):
+        text = convert_inline_markdown_to_xhtml(line[len(MD_BLOCKQUOTE_PREFIX):].strip(), illustration_dir, media)
+        return f"<blockquote><p>{text}</p></blockquote>\n"
+
+    return f"<p>{convert_inline_markdown_to_xhtml(line, illustration_dir, media)}</p>\n"
+
+
+def split_content_into_chapters(content: Manuscript.Content) -> Iterator[Manuscript.Content]:
+    """Goes through the content of a Manuscript one chapter at a time.
+
+    Each chapter starts with its StartChapter, except for any text before the first chapter, which is a chapter of its
+    own. Parts are dropped, as we don't support them in EPUBs (yet).
+
+    This is a generator, so only one chapter is ever held at a time.
+    """
+    current_chapter = []
+
+    for line in content:
+        if isinstance(line, Manuscript.StartPart):
+            continue
+
+        if isinstance(line, Manuscript.StartChapter) and current_chapter:
+            yield current_chapter
+            current_chapter = []
+
+        current_chapter.append(line)
+
+    if current_chapter:
+        yield current_chapter
+
+
+def render_chapter(chapter: Manuscript.Content,
+                   number: Optional[int],
+                   language: str,
+                   illustration_dir: Path = None,
+                   media: Dict[str, EpubMedia] = None) -> Iterator[str]:
+    """Renders a chapter (as given by split_content_into_chapters) into XHTML, one piece at a time.
+
+    number is the number of the chapter, if it is numbered.
+    """
+    title = ""
+    if isinstance(chapter[0], Manuscript.StartChapter):
+        title = chapter[0].config.title
+
+    yield XHTML_HEADER.format(language=language,
+                              title=html.escape(title),
+                              stylesheet="../" + STYLESHEET_FILE,
+                              body_attributes="")
+    yield '<section epub:type="chapter">\n'
+
+    for line in chapter:
+        if isinstance(line, Manuscript.StartChapter):
+            heading = convert_inline_markdown_to_xhtml(line.config.title)
+            if number is not None:
+                heading = f'<span class="header-section-number">{number}</span> ' + heading
+            yield f"<h1>{heading}</h1>\n"
+
+        elif isinstance(line, Manuscript.BreakScene):
+            yield '<hr class="scene-break"/>\n'
+
+        elif not Manuscript.is_control_type(line):
+            yield convert_line_to_xhtml(line, illustration_dir, media)
+
+    yield "</section>\n"
+    yield XHTML_FOOTER
+
+
+def get_chapter_document(chapter: Manuscript.Content, index: int, number: Optional[int]) -> EpubDocument:
+    """Describes the given chapter as a document of the book.
+    """
+    title = None
+    if isinstance(chapter[0], Manuscript.StartChapter):
+        title = chapter[0].config.title
+
+    return EpubDocument("text/" + CHAPTER_FILE_NAME.format(index=index), title, number)
+
+
+def write_streamed(archive: ZipWriter, file_name: str, pieces: Iterable[str]) -> None:
+    """Writes the given pieces of text into a (compressed) file in the archive as they come.
+    """
+    archive.write(file_name, (piece.encode("utf-8") for piece in pieces))
+
+
+def write_fixed_files(archive: ZipWriter) -> None:
+    """Writes the bits of an EPUB that are the same for every book.
+
+    The mimetype has to go first, and uncompressed, for readers to recognise the file.
+    """
+    archive.write(MIMETYPE_FILE, [MIMETYPE.encode("ascii")], zipfile.ZIP_STORED)
+    write_streamed(archive, CONTAINER_FILE, [CONTAINER_XML.format(package_path=f"{EPUB_DIRECTORY}/{PACKAGE_FILE}")])
+    write_streamed(archive, f"{EPUB_DIRECTORY}/{STYLESHEET_FILE}", [STYLESHEET])
+
+
+def collect_chapter_media(chapter: Manuscript.Content, illustration_dir: Path, media: Dict[str, EpubMedia]) -> List[str]:
+    """Registers the images the given chapter uses (the ones that exist, at least) without rendering it.
+
+    Returns the names of those images.
+    """
+    output = []
+    for line in chapter:
+        if Manuscript.is_control_type(line):
+            continue
+
+        for match in MD_IMAGE_PATTERN.finditer(line):
+            if (illustration_dir / match.group(2)).is_file():
+                add_media(illustration_dir, match.group(2), media)
+                output.append(match.group(2))
+
+    return output
+
+
+def hash_chapter(chapter: Manuscript.Content, number: Optional[int], language: str, media_names: List[str]) -> str:
+    """Hashes everything that goes into rendering the given chapter.
+
+    Two chapters with the same hash render into the same document, so one can stand in for the other.
+    """
+    hasher = hashlib.sha256()
+    hasher.update(f"{CHAPTER_RENDERER_VERSION}\n{number}\n{language}\n{media_names}\n".encode("utf-8"))
+    for line in chapter:
+        hasher.update(repr(line).encode("utf-8"))
+        hasher.update(b"\0")
+
+    return hasher.hexdigest()
+
+
+def open_previous_epub(epub_file: Path) -> Optional[PreviousEpub]:
+    """Opens a previous build of an EPUB, to reuse its chapters.
+
+    Returns None (with a warning) if the file is not something we can reuse chapters from.
+    """
+    try:
+        archive = zipfile.ZipFile(epub_file, "r")
+    except (OSError, zipfile.BadZipFile) as e:
+        logger.warning(f"Could not open previous EPUB {epub_file} ({e}), so building from scratch.")
+        return None
+
+    try:
+        package = ElementTree.fromstring(archive.read(f"{EPUB_DIRECTORY}/{PACKAGE_FILE}"))
+    except (KeyError, ElementTree.ParseError) as e:
+        logger.warning(f"Could not read the package of previous EPUB {epub_file} ({e}), so building from scratch.")
+        archive.close()
+        return None
+
+    chapter_hashes = {}
+    for meta in package.iter(f"{{{OPF_NAMESPACE}}}meta"):
+        name = meta.get("name", "")
+        if name.startswith(CHAPTER_HASH_META_PREFIX):
+            chapter_hashes[name[len(CHAPTER_HASH_META_PREFIX):]] = meta.get("content")
+
+    logger.info(f"Found {len(chapter_hashes)} chapter hashes in previous EPUB {epub_file}.")
+    return PreviousEpub(archive, epub_file.open("rb"), chapter_hashes, set(archive.namelist()))
+
+
+def close_previous_epub(previous: PreviousEpub) -> None:
+    """Closes everything open_previous_epub opened.
+    """
+    previous.raw_file.close()
+    previous.archive.close()
+
+
+def copy_compressed_entry(previous: PreviousEpub, file_name: str, archive: ZipWriter) -> None:
+    """Copies an entry from the previous EPUB into the given archive as it is, i.e. without decompressing and
+    recompressing it.
+    """
+    old_info = previous.archive.getinfo(file_name)
+
+    # The compressed data comes right after the local header, which has a couple of variable-length bits.
+    previous.raw_file.seek(old_info.header_offset)
+    local_header = ZIP_LOCAL_HEADER.unpack(previous.raw_file.read(ZIP_LOCAL_HEADER.size))
+    if local_header[0] != ZIP_LOCAL_HEADER_SIGNATURE:
+        logger.error(f"{file_name} in the previous EPUB doesn't start with a local header!")
+        raise ValueError
+
+    name_length, extra_length = local_header[-2:]
+    previous.raw_file.seek(name_length + extra_length, io.SEEK_CUR)
+    compressed_data = previous.raw_file.read(old_info.compress_size)
+
+    archive.write_compressed(file_name, compressed_data, old_info.compress_type, old_info.CRC, old_info.file_size)
+
+
+def write_chapters(archive: ZipWriter,
+                   content: Manuscript.Content,
+                   language: str,
+                   illustration_dir: Path,
+                   media: Dict[str, EpubMedia],
+                   previous: PreviousEpub = None) -> List[EpubDocument]:
+    """Writes every chapter of the given content into its own document in the archive, one chapter at a time.
+
+    Chapters are numbered the way pandoc's --number-sections would, i.e. skipping the unnumbered ones. Returns the
+    documents that were written, in order.
+
+    If a previous build of the book is given, chapters that haven't changed since are copied over from it rather than
+    rendered again.
+    """
+    documents = []
+    chapter_count = 0
+    reused_count = 0
+
+    for index, chapter in enumerate(split_content_into_chapters(content)):
+        number = None
+        if isinstance(chapter[0], Manuscript.StartChapter) and chapter[0].config.numbered:
+            chapter_count += 1
+            number = chapter_count
+
+        document = get_chapter_document(chapter, index, number)
+        media_names = collect_chapter_media(chapter, illustration_dir, media)
+        document.content_hash = hash_chapter(chapter, number, language, media_names)
+        file_name = f"{EPUB_DIRECTORY}/{document.file_name}"
+
+        if (previous is not None
+                and previous.chapter_hashes.get(document.file_name) == document.content_hash
+                and file_name in previous.file_names):
+            logger.debug(f"Reusing chapter: {document.file_name}")
+            copy_compressed_entry(previous, file_name, archive)
+            reused_count += 1
+        else:
+            logger.debug(f"Writing chapter: {document.file_name}")
+            write_streamed(archive, file_name, render_chapter(chapter, number, language, illustration_dir, media))
+
+        documents.append(document)
+
+    if previous is not None:
+        logger.info(f"Reused {reused_count} out of {len(documents)} chapters from the previous build.")
+
+    return documents
+
+
+def create_chapter_hash_metadata(documents: Iterable[EpubDocument]) -> Dict[str, str]:
+    """Creates the package metadata that records the content hash of each document.
+    """
+    return {CHAPTER_HASH_META_PREFIX + document.file_name: document.content_hash
+            for document in documents if document.content_hash is not None}
+
+
+def write_cover_page(archive: ZipWriter, cover: EpubMedia, config: Manuscript.Config, language: str) -> None:
+    """Writes the page that shows the cover.
+    """
+    write_streamed(archive, f"{EPUB_DIRECTORY}/text/{COVER_PAGE_FILE}", render_cover_page(cover, config, language))
+
+
+def render_cover_page(cover: EpubMedia, config: Manuscript.Config, language: str) -> Iterator[str]:
+    """Renders the page that shows the cover.
+    """
+    yield XHTML_HEADER.format(language=language,
+                              title=html.escape(config.title),
+                              stylesheet="../" + STYLESHEET_FILE,
+                              body_attributes=' epub:type="cover"')
+    yield f'<div class="cover"><img src="../{_quote_href(cover.file_name)}" alt="{html.escape(config.title)}"/></div>\n'
+    yield XHTML_FOOTER
+
+
+def write_media(archive: ZipWriter, media: Iterable[EpubMedia]) -> None:
+    """Copies the given media files into the archive.
+
+    Images are already compressed, so they're stored as they are.
+    """
+    for entry in media:
+        with entry.source.open("rb") as source:
+            archive.write(f"{EPUB_DIRECTORY}/{entry.file_name}",
+                          iter(lambda: source.read(MEDIA_CHUNK_SIZE), b""),
+                          zipfile.ZIP_STORED)
+
+
+def render_nav(documents: List[EpubDocument], config: Manuscript.Config, language: str) -> Iterator[str]:
+    """Renders the navigation document (the EPUB 3 table of contents).
+    """
+    yield XHTML_HEADER.format(language=language, title=html.escape(config.title), stylesheet=STYLESHEET_FILE,
+                              body_attributes="")
+    yield '<nav epub:type="toc" id="toc">\n'
+    yield f"<h1>{html.escape(config.title)}</h1>\n"
+    yield "<ol>\n"
+    for document in _get_toc_documents(documents, config):
+        yield f'<li><a href="{_quote_href(document.file_name)}">{html.escape(_get_toc_label(document))}</a></li>\n'
+    yield "</ol>\n"
+    yield "</nav>\n"
+    yield XHTML_FOOTER
+
+
+def render_ncx(documents: List[EpubDocument], config: Manuscript.Config, identifier: str) -> Iterator[str]:
+    """Renders the NCX table of contents, for readers that predate EPUB 3.
+    """
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">\n'
+    yield f'<head><meta name="dtb:uid" content="{html.escape(identifier)}"/></head>\n'
+    yield f"<docTitle><text>{html.escape(config.title)}</text></docTitle>\n"
+    yield "<navMap>\n"
+    for index, document in enumerate(_get_toc_documents(documents, config)):
+        yield (f'<navPoint id="navpoint-{index + 1}">'
+               f"<navLabel><text>{html.escape(_get_toc_label(document))}</text></navLabel>"
+               f'<content src="{_quote_href(document.file_name)}"/></navPoint>\n')
+    yield "</navMap>\n"
+    yield "</ncx>\n"
+
+
+def _get_toc_documents(documents: List[EpubDocument], config: Manuscript.Config) -> List[EpubDocument]:
+    """Picks the documents that go in the table of contents, making sure there's at least one (readers insist).
+    """
+    output = [document for document in documents if document.title is not None]
+    if not output and documents:
+        output = [EpubDocument(documents[0].file_name, config.title, None)]
+
+    return output
+
+
+def _get_toc_label(document: EpubDocument) -> str:
+    """The text of a table of contents entry.
+    """
+    if document.number is None:
+        return document.title
+    return f"{document.number} {document.title}".strip()
+
+
+def render_package(documents: List[EpubDocument],
+                   media: Iterable[EpubMedia],
+                   cover: Optional[EpubMedia],
+                   config: Manuscript.Config,
+                   language: str,
+                   identifier: str,
+                   extra_metadata: Dict[str, str] = None) -> Iterator[str]:
+    """Renders the package document, which lists everything in the book and the order to read it in.
+
+    extra_metadata ends up as (EPUB 2 style) <meta name="..." content="..."/> elements.
+    """
+    # EPUB insists on a modification time, even if the config doesn't have one.
+    time = config.time or datetime.datetime.now()
+
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id">\n'
+    yield '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+    yield f'<dc:identifier id="book-id">{html.escape(identifier)}</dc:identifier>\n'
+    yield f"<dc:title>{html.escape(config.title)}</dc:title>\n"
+    yield f"<dc:creator>{html.escape(config.author)}</dc:creator>\n"
+    yield f"<dc:language>{html.escape(language)}</dc:language>\n"
+    yield f"<dc:date>{time.replace(microsecond=0).isoformat()}</dc:date>\n"
+    yield f'<meta property="dcterms:modified">{_format_modified_time(time)}</meta>\n'
+    if cover is not None:
+        yield '<meta name="cover" content="cover-image"/>\n'
+    for name, content in (extra_metadata or {}).items():
+        yield f'<meta name="{html.escape(name)}" content="{html.escape(content)}"/>\n'
+    yield "</metadata>\n"
+
+    yield "<manifest>\n"
+    yield f'<item id="nav" href="{NAV_FILE}" media-type="application/xhtml+xml" properties="nav"/>\n'
+    yield f'<item id="ncx" href="{NCX_FILE}" media-type="application/x-dtbncx+xml"/>\n'
+    yield f'<item id="stylesheet" href="{STYLESHEET_FILE}" media-type="text/css"/>\n'
+    if cover is not None:
+        yield f'<item id="cover-page" href="text/{COVER_PAGE_FILE}" media-type="application/xhtml+xml"/>\n'
+    for index, entry in enumerate(media):
+        if entry is cover:
+            yield (f'<item id="cover-image" href="{_quote_href(entry.file_name)}" media-type="{entry.media_type}" '
+                   'properties="cover-image"/>\n')
+        else:
+            yield f'<item id="media-{index}" href="{_quote_href(entry.file_name)}" media-type="{entry.media_type}"/>\n'
+    for index, document in enumerate(documents):
+        yield (f'<item id="document-{index}" href="{_quote_href(document.file_name)}" '
+               'media-type="application/xhtml+xml"/>\n')
+    yield "</manifest>\n"
+
+    yield '<spine toc="ncx">\n'
+    if cover is not None:
+        yield '<itemref idref="cover-page"/>\n'
+    for index in range(len(documents)):
+        yield f'<itemref idref="document-{index}"/>\n'
+    yield "</spine>\n"
+    yield "</package>\n"
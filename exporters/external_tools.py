@@ -0,0 +1,307 @@
+from pathlib import Path
+import asyncio
+import contextlib
+import contextvars
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Iterable, Iterator, List, Optional, Union
+
+try:
+    import resource
+except ImportError:
+    # Not a thing on Windows, where the memory of external tools just doesn't get tracked.
+    resource = None
+
+from ..instrumentation import instrumentation
+
+logger = logging.getLogger(__name__)
+
+# pandoc and pdflatex are hungry, so no matter how many exports run at the same time, only this many of them get to
+# run at once (across the whole process, threads and event loops alike). See set_max_processes.
+DEFAULT_MAX_PROCESSES = os.cpu_count() or 1
+
+# How often async callers check for a free slot. Tools take seconds to run, so this doesn't need to be snappy.
+SLOT_POLL_INTERVAL = 0.01
+
+# How much of a tool's stdout gets handed to a stdout_sink at a time (see run_tool_async).
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# When tracking memory (see instrumentation.enable), how often the memory of running tools is looked at, and where.
+MEMORY_POLL_INTERVAL = 0.05
+PROC_STATUS_FILE = "/proc/{pid}/status"
+PROC_STATUS_PEAK_RSS = "VmHWM:"
+
+_process_slots = threading.BoundedSemaphore(DEFAULT_MAX_PROCESSES)
+
+# The slots of whatever limit_processes the current code runs under, if any, on top of the ones above.
+_context_slots: contextvars.ContextVar[Optional[threading.BoundedSemaphore]] = contextvars.ContextVar("process_slots",
+                                                                                                      default=None)
+
+# What can be fed into a tool: all of it at once, or chunk by chunk (e.g. from a generator, so it never has to be in
+# memory all at once).
+ToolInput = Union[bytes, Iterable[bytes]]
+
+
+def set_max_processes(count: int) -> None:
+    """Sets how many external tools may run at the same time, from now on.
+
+    Tools that are already running (or waiting to run) carry on under the previous limit.
+    """
+    global _process_slots
+
+    if count < 1:
+        logger.error(f"Need to be able to run at least one external tool, got {count}!")
+        raise ValueError
+
+    _process_slots = threading.BoundedSemaphore(count)
+
+
+@contextlib.contextmanager
+def limit_processes(count: int) -> Iterator[None]:
+    """Caps how many external tools may run at the same time for whatever runs inside this, on top of the limit for the
+    whole process (see set_max_processes). The cap goes away on the way out, and nothing else is affected by it.
+
+    The cap lives in the current context (see contextvars), so asyncio tasks started inside get it too, but threads
+    only do if they run in a copy of it (see builder.build).
+    """
+    if count < 1:
+        logger.error(f"Need to be able to run at least one external tool, got {count}!")
+        raise ValueError
+
+    token = _context_slots.set(threading.BoundedSemaphore(count))
+    try:
+        yield
+    finally:
+        _context_slots.reset(token)
+
+
+def _get_slots() -> List[threading.BoundedSemaphore]:
+    """The slots a tool needs to take up before it runs, in the order in which they're taken.
+    """
+    context_slots = _context_slots.get()
+    return [_process_slots] if context_slots is None else [context_slots, _process_slots]
+
+
+def _try_acquire(slots: List[threading.BoundedSemaphore]) -> bool:
+    """Takes up every one of the given slots without waiting, or none of them.
+    """
+    for index, slot in enumerate(slots):
+        if not slot.acquire(blocking=False):
+            for acquired in slots[:index]:
+                acquired.release()
+            return False
+
+    return True
+
+
+def _release(slots: List[threading.BoundedSemaphore]) -> None:
+    for slot in reversed(slots):
+        slot.release()
+
+
+def _finished_children_peak_rss() -> int:
+    """Returns the largest resident set size (in bytes) of any tool that has finished so far, if we can tell.
+    """
+    if resource is None:
+        return 0
+
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # Linux counts in kilobytes, macOS in bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _read_peak_rss(pid: int) -> int:
+    """Returns the largest resident set size (in bytes) the given process has had so far, if we can tell.
+    """
+    try:
+        with open(PROC_STATUS_FILE.format(pid=pid), "r", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith(PROC_STATUS_PEAK_RSS):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    return 0
+
+
+async def _watch_memory(pid: int) -> None:
+    """Keeps recording the memory of the given (running) process, until cancelled.
+    """
+    while True:
+        instrumentation.record_child_rss(_read_peak_rss(pid))
+        await asyncio.sleep(MEMORY_POLL_INTERVAL)
+
+
+@contextlib.contextmanager
+def _instrument(cmd: list):
+    """Times the given tool as a stage of its own, and keeps count of how many tools ran and for how long.
+
+    If memory is being tracked, the tool's memory is recorded too, for every stage it ran in. The peak of all tools
+    that have finished only tells us anything when it goes up, though (a tool needing less than an earlier one doesn't
+    register), so async tools are watched while they run as well (see _run_process).
+    """
+    if not instrumentation.is_enabled():
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        with instrumentation.stage(f"tool.{Path(cmd[0]).name}", "subprocess"):
+            peak_before = _finished_children_peak_rss() if instrumentation.is_tracking_memory() else 0
+            try:
+                yield
+            finally:
+                if instrumentation.is_tracking_memory():
+                    peak_after = _finished_children_peak_rss()
+                    if peak_after > peak_before:
+                        instrumentation.record_child_rss(peak_after)
+    finally:
+        instrumentation.count("subprocesses")
+        instrumentation.count("subprocess_seconds", time.perf_counter() - start)
+
+
+def run_tool(cmd: list, **kwargs) -> subprocess.CompletedProcess:
+    """Runs the given external tool (see subprocess.run for the arguments), waiting for a free slot first.
+    """
+    slots = _get_slots()
+    with contextlib.ExitStack() as stack:
+        for slot in slots:
+            stack.enter_context(slot)
+        with _instrument(cmd):
+            logger.debug(f"Running: {cmd}")
+            return subprocess.run(cmd, **kwargs)
+
+
+async def _log_lines(stream: asyncio.StreamReader, prefix: str, level: int, keep: bool) -> Optional[bytes]:
+    """Logs every line that comes out of the given stream as it comes, returning all of it if keep is set.
+    """
+    kept = []
+    async for line in stream:
+        logger.log(level, prefix + line.decode("utf-8", errors="replace").rstrip())
+        if keep:
+            kept.append(line)
+
+    return b"".join(kept) if keep else None
+
+
+async def _pipe(stream: asyncio.StreamReader, sink: Callable[[bytes], None]) -> None:
+    """Hands everything that comes out of the given stream to sink, chunk by chunk, as it comes.
+    """
+    while chunk := await stream.read(STREAM_CHUNK_SIZE):
+        sink(chunk)
+
+
+async def _feed(process: asyncio.subprocess.Process, input: Optional[ToolInput]) -> None:
+    """Writes the given input into the process' stdin, and closes it.
+
+    Input given in chunks is written chunk by chunk, waiting for the process to keep up in between.
+    """
+    if input is None:
+        return
+
+    try:
+        for chunk in [input] if isinstance(input, bytes) else input:
+            process.stdin.write(chunk)
+            await process.stdin.drain()
+        process.stdin.close()
+        await process.stdin.wait_closed()
+    except (BrokenPipeError, ConnectionResetError):
+        # The process didn't want (all of) it; its exit code will tell us whether that's a problem.
+        pass
+
+
+async def _run_process(cmd: list,
+                       input: Optional[ToolInput],
+                       cwd: Optional[Path],
+                       timeout: Optional[float],
+                       stream_stdout: bool,
+                       stdout_sink: Optional[Callable[[bytes], None]]) -> subprocess.CompletedProcess:
+    """Runs the given command, logging its stderr (and its stdout, if stream_stdout is set, or handing it to
+    stdout_sink, if given, rather than keeping it).
+
+    Raises subprocess.TimeoutExpired if it takes longer than timeout seconds, and subprocess.CalledProcessError if it
+    fails. The process is killed if it times out or the caller is cancelled.
+    """
+    logger.debug(f"Running: {cmd}")
+    process = await asyncio.create_subprocess_exec(*cmd,
+                                                   stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+                                                   stdout=subprocess.PIPE,
+                                                   stderr=subprocess.PIPE,
+                                                   cwd=cwd)
+    prefix = f"{Path(cmd[0]).name}: "
+    watcher = asyncio.ensure_future(_watch_memory(process.pid)) if instrumentation.is_tracking_memory() else None
+
+    async def communicate():
+        if stream_stdout:
+            stdout_reader = _log_lines(process.stdout, prefix, logging.INFO, keep=False)
+        elif stdout_sink is not None:
+            stdout_reader = _pipe(process.stdout, stdout_sink)
+        else:
+            stdout_reader = process.stdout.read()
+        _, stdout, stderr = await asyncio.gather(_feed(process, input),
+                                                 stdout_reader,
+                                                 _log_lines(process.stderr, prefix, logging.WARNING, keep=True))
+        await process.wait()
+        return stdout, stderr
+
+    try:
+        stdout, stderr = await asyncio.wait_for(communicate(), timeout)
+    except asyncio.TimeoutError:
+        logger.error(f"{cmd[0]} took longer than {timeout}s, so killing it.")
+        await _kill(process)
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    except BaseException:
+        # Cancelled, or whatever was handling the output gave up on it.
+        await _kill(process)
+        raise
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+
+    return subprocess.CompletedProcess(cmd, process.returncode, stdout, stderr)
+
+
+async def _kill(process: asyncio.subprocess.Process) -> None:
+    """Kills the given process (if it's still around), and waits for it to go.
+    """
+    with contextlib.suppress(ProcessLookupError):
+        process.kill()
+    await process.wait()
+
+
+async def run_tool_async(cmd: list,
+                         input: Optional[ToolInput] = None,
+                         cwd: Optional[Path] = None,
+                         timeout: Optional[float] = None,
+                         stream_stdout: bool = False,
+                         stdout_sink: Optional[Callable[[bytes], None]] = None) -> subprocess.CompletedProcess:
+    """Runs the given external tool without blocking the event loop, waiting for a free slot first.
+
+    Note:
+    * input, if given, is fed into the tool's stdin, either all at once (bytes) or chunk by chunk as the tool takes it
+      (an iterable of bytes, which is only consumed as the tool reads).
+    * stderr is logged line by line as it comes (as warnings), and also returned. stdout is returned, unless
+      stream_stdout is set, in which case it is logged line by line instead (for chatty tools like pdflatex), or
+      stdout_sink is given, in which case every chunk of it is handed to stdout_sink as it comes (e.g. to write it
+      straight into a file).
+    * If the tool takes longer than timeout seconds, it is killed, and subprocess.TimeoutExpired raised. It is killed
+      too if the caller is cancelled.
+    * If the tool fails, subprocess.CalledProcessError is raised.
+    """
+    # Slots are shared with run_tool, which runs in threads, so we can't wait on them the asyncio way.
+    slots = _get_slots()
+    while not _try_acquire(slots):
+        await asyncio.sleep(SLOT_POLL_INTERVAL)
+
+    try:
+        with _instrument(cmd):
+            return await _run_process(cmd, input, cwd, timeout, stream_stdout, stdout_sink)
+    finally:
+        _release(slots)
@@ -1,7 +1,15 @@
 from ..manuscript import Manuscript
+from ..instrumentation import instrumentation
+from ..typography import apply_typography
 from . import latex_pdf_exporter_innards as innards
 
+from collections.abc import Iterable
 from pathlib import Path
+import asyncio
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
 
 
 def export(manuscript: Manuscript,
@@ -10,8 +18,36 @@ def export(manuscript: Manuscript,
            out_directory: Path,
            out_name: str,
            babel_language: str,
-           remove_artifacts: bool) -> None:
-    """Export the given manuscript to a PDF via LaTeX.
+           remove_artifacts: bool,
+           draft_chapters: Optional[Iterable[int]] = None,
+           timeout: Optional[float] = None,
+           typography: bool = False) -> None:
+    """Export the given manuscript to a PDF via LaTeX (see export_async for the details).
+    """
+    asyncio.run(export_async(manuscript,
+                             template,
+                             illustration_dir,
+                             out_directory,
+                             out_name,
+                             babel_language,
+                             remove_artifacts,
+                             draft_chapters,
+                             timeout,
+                             typography))
+
+
+@instrumentation.timed("export.pdf")
+async def export_async(manuscript: Manuscript,
+                       template: Path,
+                       illustration_dir: Path,
+                       out_directory: Path,
+                       out_name: str,
+                       babel_language: str,
+                       remove_artifacts: bool,
+                       draft_chapters: Optional[Iterable[int]] = None,
+                       timeout: Optional[float] = None,
+                       typography: bool = False) -> None:
+    """Export the given manuscript to a PDF via LaTeX, without blocking the event loop while pandoc and pdflatex run.
 
     Requires that pdflatex be in the PATH and accessible by this script.
 
@@ -20,16 +56,58 @@ def export(manuscript: Manuscript,
     * out_directory will be used as an output.
     * If remove_artifacts is set, then at the end this exporter will remove intermediate artifacts.
     * Internally, this exporter relies on pdflatex and pandoc being available in the PATH.
+    * This exporter never changes the working directory of the process, so it is safe to run several exports at the
+      same time (e.g. in threads), as long as they write to different outputs.
+    * If draft_chapters is given, only those sections of the book are converted and typeset (see
+      innards.split_content_into_chapters for what a section is; they are numbered from 0, in order). Page and chapter
+      numbers are kept from the last full build into the same out_directory, so do one of those first.
+    * If timeout is given, each call to pandoc or pdflatex gets that many seconds before it is killed (and
+      subprocess.TimeoutExpired raised). Cancelling the export kills whatever tool is running, too.
+    * If typography is set, the paragraphs are typeset for babel_language first (curly quotes, em dashes, ellipses and
+      non-breaking spaces, see typography.apply_typography). Otherwise, pandoc's smart punctuation is all there is.
     """
+    # Work with absolute paths throughout, so that nothing depends on where the process happens to be.
+    out_directory = out_directory.absolute()
+    illustration_dir = illustration_dir.absolute()
+
     innards.tidy_up_output_dir(out_directory)
-    latex_contents = innards.convert_to_latex(manuscript)
+
+    if typography:
+        manuscript = apply_typography(manuscript, babel_language)
+
+    # Each section of the book goes into its own file, \include-d from the main one.
+    chapters = innards.split_content_into_chapters(manuscript.content)
+    if draft_chapters is None:
+        selected_chapters = list(range(len(chapters)))
+    else:
+        selected_chapters = sorted(set(draft_chapters))
+        if any(index < 0 or index >= len(chapters) for index in selected_chapters):
+            logger.error(f"Asked for a draft of sections {selected_chapters}, but there are only {len(chapters)}!")
+            raise ValueError
+
+        logger.info(f"Building a draft of sections {selected_chapters} out of {len(chapters)}.")
+        innards.check_chapter_aux_files(len(chapters), selected_chapters, out_directory)
+
+    # The document (a pandoc AST, see pandoc_ast) streams into pandoc, and the LaTeX streams out of it straight into the
+    # chapter files.
+    with instrumentation.stage("pdf.convert"):
+        await innards.convert_chapters_to_latex_files_async({index: chapters[index] for index in selected_chapters},
+                                                            out_directory,
+                                                            timeout)
+
+    latex_contents = innards.create_chapter_includes(len(chapters))
     full_latex = innards.load_contents_onto_template(latex_contents,
                                                      manuscript.config,
                                                      template,
                                                      illustration_dir,
                                                      babel_language)
+    if draft_chapters is not None:
+        full_latex = [innards.create_includeonly_command(selected_chapters)] + list(full_latex)
+
     innards.write_latex_file(full_latex, out_directory / out_name, out_directory)
-    innards.build_latex(out_directory / out_name, out_directory)
+    innards.prepare_toc_file(manuscript.content, len(chapters), out_name, out_directory)
+    with instrumentation.stage("pdf.build"):
+        await innards.build_latex_async(out_directory / out_name, out_directory, timeout)
 
     if remove_artifacts:
         innards.tidy_up_latex_artifacts(out_name, out_directory)
@@ -1,14 +1,16 @@
 from pathlib import Path
+import asyncio
 import logging
-import subprocess
-import os
+import re
+import threading
+from dataclasses import dataclass
 from collections.abc import Iterable
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
 
 from ..manuscript import Manuscript
 
-# TODO: this is a bit ugly, maybe the markdown conversion functionality should be in some common utils, so exporters
-# don't need to import one another.
-from . import markdown_exporter_innards
+from . import external_tools
+from . import pandoc_ast
 
 # Bits of text we need to replace in the template:
 COVER_FILE_LOCATION = "COVER_FILE_HERE"
@@ -19,16 +21,136 @@ DATE_LOCATION = "DATE_HERE"
 AUTHOR_LOCATION = "AUTHOR_HERE"
 BABEL_LANGUAGE_LOCATION = "BABEL_LANGUAGE_HERE"
 
+# All of the above in one pattern, so that a single pass over the template finds every placeholder, however many of
+# them share a line.
+TEMPLATE_PLACEHOLDERS = [COVER_FILE_LOCATION,
+                         TITLE_LOCATION,
+                         LATEX_FILE_LOCATION,
+                         ILLUSTRATIONS_FOLDER_LOCATION,
+                         DATE_LOCATION,
+                         AUTHOR_LOCATION,
+                         BABEL_LANGUAGE_LOCATION]
+TEMPLATE_PLACEHOLDER_PATTERN = re.compile("|".join(re.escape(placeholder) for placeholder in TEMPLATE_PLACEHOLDERS))
+
 # The command that includes the cover, only to be included in the output latex if a cover is supplied, and an
 # alternative in case there is no cover.
 # TODO: this is too much LaTeX here, this sort of thing should be in the template.
 COVER_FILE_LATEX_COMMAND = r"\includegraphics[width=\textwidth]{COVER_FILE_HERE}\\"
 NO_COVER_FILE_LATEX_COMMAND = r"~\\\vspace{5cm}"
 
+# The body of the book is split into sections (parts/chapters), each of which is written into its own file in this
+# folder and pulled into the main file with \include. This is what lets us build drafts of selected chapters with
+# \includeonly: LaTeX keeps one .aux file per included file, and uses the ones left behind by previous builds to get
+# page and chapter numbers right for the chapters it skips.
+CHAPTERS_DIRECTORY_NAME = "chapters"
+CHAPTER_FILE_STEM = "chapter_{index:03d}"
+
+# Marks the boundaries between sections in what we send to pandoc, so we can convert all of them in one go and split
+# them back up afterwards. It goes through pandoc untouched as a raw LaTeX block (a comment, at that).
+SECTION_BREAK_MARKER = "% manuscript_generator_3000: section break"
+SECTION_BREAK_BLOCK = pandoc_ast.raw_block("latex", SECTION_BREAK_MARKER)
+SECTION_BREAK_MARKER_BYTES = SECTION_BREAK_MARKER.encode("utf-8")
+
+# pdflatex writes these out for the *next* pass to read (the table of contents and the PDF bookmarks), so if a pass
+# changes any of them we need another one. They're left in place after a build so the next one can start from them.
+LATEX_RERUN_ARTIFACTS = [".toc", ".out"]
+
+# LaTeX is also kind enough to tell us in its log when it wants another pass, e.g. for cross-references.
+LATEX_RERUN_LOG_MESSAGE = "Rerun to get"
+
+# We never need more than this many passes (hopefully).
+LATEX_MAX_PASSES = 3
+
+# How we ask pandoc to turn a document (see pandoc_ast) into LaTeX.
+PANDOC_TO_LATEX_CMD = ["pandoc",
+                       "-f", "json",
+                       "-t", "latex",
+                       "--top-level-division=part",
+                       "--wrap=preserve"]
+
+# Lines in .aux files that end up in the table of contents, and the bits of those lines we care about.
+AUX_TOC_LINE_PATTERN = re.compile(r"^\\@writefile\{toc\}\{(.*?)(?:\\protected@file@percent ?)?\}\s*$")
+CONTENTSLINE_PATTERN = re.compile(r"^\\contentsline \{(\w+)\}\{(?:\\numberline \{([^}]*)\})?")
+
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class TocEntry:
+    """A single entry of the table of contents.
+
+    kind is the LaTeX sectioning command ("part" or "chapter"), and number is the number as LaTeX would print it, or
+    None for unnumbered entries. title may be None when we only know the entry from LaTeX's side of things.
+    """
+    kind: str
+    number: Optional[str]
+    title: Optional[str]
+
+
+@dataclass(frozen=True)
+class CompiledTemplate:
+    """A template that has been parsed into a substitution plan.
+
+    The template text is broken up into static chunks with a placeholder between each pair of them, so
+    static_chunks[i] is followed by placeholders[i], and there is always one more static chunk than there are
+    placeholders. Rendering is then just a matter of gluing the pieces back together.
+    """
+    path: Path
+    mtime_ns: int
+    static_chunks: Tuple[str, ...]
+    placeholders: Tuple[str, ...]
+
+    def render(self, substitutions: Dict[str, str]) -> Iterable[str]:
+        """Fills in the placeholders with the given substitutions, returning the pieces of the output in order.
+
+        Every placeholder in the template must have a substitution.
+        """
+        output = [self.static_chunks[0]]
+        for placeholder, static_chunk in zip(self.placeholders, self.static_chunks[1:]):
+            output.append(substitutions[placeholder])
+            output.append(static_chunk)
+
+        return output
+
+
+# Templates we've already compiled, keyed on their (resolved) path. Each entry remembers the mtime of the file it was
+# compiled from, so an edited template gets recompiled. Exports can run in threads, hence the lock.
+_compiled_templates: Dict[Path, CompiledTemplate] = {}
+_compiled_templates_lock = threading.Lock()
+
+
+def compile_template(template: Path) -> CompiledTemplate:
+    """Parses the given template into a CompiledTemplate, or fetches it from the cache if it hasn't changed on disk.
+    """
+    template = template.resolve()
+    mtime_ns = template.stat().st_mtime_ns
+
+    with _compiled_templates_lock:
+        compiled = _compiled_templates.get(template)
+        if compiled is not None and compiled.mtime_ns == mtime_ns:
+            return compiled
+
+    logger.info(f"Compiling template: {template}")
+    text = template.read_text(encoding="utf8")
+
+    static_chunks = []
+    placeholders = []
+    chunk_start = 0
+    for match in TEMPLATE_PLACEHOLDER_PATTERN.finditer(text):
+        static_chunks.append(text[chunk_start:match.start()])
+        placeholders.append(match.group())
+        chunk_start = match.end()
+    static_chunks.append(text[chunk_start:])
+
+    compiled = CompiledTemplate(template, mtime_ns, tuple(static_chunks), tuple(placeholders))
+
+    with _compiled_templates_lock:
+        _compiled_templates[template] = compiled
+
+    return compiled
+
+
 def tidy_up_output_dir(out_directory: Path) -> None:
     """Makes sure the output directory is usable.
 
@@ -38,35 +160,75 @@ def tidy_up_output_dir(out_directory: Path) -> None:
         logger.info("Output directory at:")
         logger.info(out_directory)
         logger.info("does not exist, so we're gonna create it.")
-        out_directory.mkdir()
+        # Someone else (e.g. another export running in a different thread) may beat us to it, which is fine.
+        out_directory.mkdir(parents=True, exist_ok=True)
         return
 
 
 def tidy_up_latex_artifacts(latex_filename: str, out_directory: Path) -> None:
     """Removes leftover LaTeX outputs post-compilation.
+
+    The .aux files of individual chapters are left alone, as draft builds depend on them for their numbering, and later
+    builds on them and on the LATEX_RERUN_ARTIFACTS to avoid running pdflatex more than once.
     """
     base_name = Path(latex_filename).stem
-    latex_artifacts = [".aux", ".log", ".tex", ".out"]
+    # (The LATEX_RERUN_ARTIFACTS stay, so the next build can get away with a single pass.)
+    latex_artifacts = [".aux", ".log", ".tex"]
 
     for ext in latex_artifacts:
         to_remove = (out_directory / base_name).with_suffix(ext)
         logger.info(f"Removing leftover file: {to_remove}")
         to_remove.unlink()
 
+    for to_remove in (out_directory / CHAPTERS_DIRECTORY_NAME).glob("*.tex"):
+        logger.info(f"Removing leftover file: {to_remove}")
+        to_remove.unlink()
+
 
-def build_latex(latex_file: Path, out_directory: Path) -> None:
+def _read_rerun_artifacts(latex_file: Path, out_directory: Path) -> List[Optional[bytes]]:
+    """Reads the LATEX_RERUN_ARTIFACTS of the given file, with None for the ones that don't exist (yet).
+    """
+    output = []
+    for ext in LATEX_RERUN_ARTIFACTS:
+        artifact = (out_directory / latex_file.stem).with_suffix(ext)
+        output.append(artifact.read_bytes() if artifact.exists() else None)
+
+    return output
+
+
+def _log_asks_for_rerun(latex_file: Path, out_directory: Path) -> bool:
+    """Checks whether the log of the last pdflatex pass over the given file asks for another pass.
+    """
+    log_file = (out_directory / latex_file.stem).with_suffix(".log")
+    if not log_file.exists():
+        return False
+
+    return LATEX_RERUN_LOG_MESSAGE in log_file.read_text(encoding="utf8", errors="replace")
+
+
+def build_latex(latex_file: Path, out_directory: Path, timeout: Optional[float] = None) -> None:
+    """Calls pdflatex to build the given file in the given directory (see build_latex_async).
+    """
+    asyncio.run(build_latex_async(latex_file, out_directory, timeout))
+
+
+async def build_latex_async(latex_file: Path, out_directory: Path, timeout: Optional[float] = None) -> None:
     """Calls pdflatex to build the given file in the given directory
+
+    pdflatex is run with the output directory as its working directory, rather than by changing the working directory
+    of the whole process, so that multiple builds can run side by side.
+
+    pdflatex is only run again if the previous pass changed the table of contents or bookmarks, or if LaTeX asks for it.
+    When nothing moved since the last build (see prepare_toc_file), that's a single pass.
+
+    Whatever pdflatex has to say goes into the logs. Each pass gets timeout seconds (if given) before it is killed.
     """
     if not out_directory.exists():
         logger.error("Output directory does not exist!")
         raise ValueError
 
-    # TODO: we're using os here, but pathlib probably does all of this.
-    old_working_dir = os.getcwd()
-    os.chdir(out_directory)
-
-    logger.info(f"CD-ing out of {old_working_dir}")
-    logger.info(f"... and into {out_directory}")
+    out_directory = out_directory.resolve()
+    latex_file = latex_file.resolve()
 
     pdflatex_cmd = ["pdflatex",
                     "-jobname=" + latex_file.stem,
@@ -75,18 +237,21 @@ def build_latex(latex_file: Path, out_directory: Path) -> None:
                     "-file-line-error",
                     str(latex_file)]
 
-    # Run subprocess twice so the ToC gets compiled
     logger.info("Calling pdflatex!")
     logger.info(f"Command: {pdflatex_cmd}")
-    logger.info("Brace for lots of terminal noise...")
-    print("=======================================================================================")
-    subprocess.run(pdflatex_cmd, check=True)
-    subprocess.run(pdflatex_cmd, check=True)
-    print("=======================================================================================")
+    logger.info(f"Working directory: {out_directory}")
+    for latex_pass in range(1, LATEX_MAX_PASSES + 1):
+        artifacts_before = _read_rerun_artifacts(latex_file, out_directory)
+        await external_tools.run_tool_async(pdflatex_cmd, cwd=out_directory, timeout=timeout, stream_stdout=True)
+
+        if (_read_rerun_artifacts(latex_file, out_directory) == artifacts_before
+                and not _log_asks_for_rerun(latex_file, out_directory)):
+            logger.info(f"pdflatex settled after {latex_pass} pass(es).")
+            break
 
-    logger.info(f"CD-ing out of {os.getcwd()}")
-    logger.info(f"... and into {old_working_dir}")
-    os.chdir(old_working_dir)
+        logger.info(f"Pass {latex_pass} changed the table of contents, bookmarks or references.")
+    else:
+        logger.warning(f"pdflatex didn't settle after {LATEX_MAX_PASSES} passes. Output may be slightly off.")
 
 
 def load_contents_onto_template(latex_contents: str,
@@ -95,41 +260,73 @@ def load_contents_onto_template(latex_contents: str,
                                 illustration_dir: Path,
                                 babel_language: str) -> Iterable[str]:
     """Writes the given latex-valid contents into the given template, making replacements where needed.
+
+    The template is only parsed the first time it is seen (see compile_template), so building lots of books off the
+    same template is cheap.
     """
-    output = []
+    # If there is no cover in the config, we put in some blank space instead.
+    if config.cover:
+        cover_file_command = COVER_FILE_LATEX_COMMAND.replace(COVER_FILE_LOCATION, str(config.cover))
+    else:
+        cover_file_command = NO_COVER_FILE_LATEX_COMMAND
 
-    with template.open("r", encoding="utf8") as temp:
-        for template_line in temp:
-            if COVER_FILE_LOCATION in template_line:
-                # If there is no cover in the config, this line is simply ignored.
-                if config.cover:
-                    cover_file_command = COVER_FILE_LATEX_COMMAND.replace(COVER_FILE_LOCATION, config.cover)
-                    output.append(template_line.replace(COVER_FILE_LOCATION, cover_file_command))
-                else:
-                    output.append(template_line.replace(COVER_FILE_LOCATION, NO_COVER_FILE_LATEX_COMMAND))
+    substitutions = {
+        COVER_FILE_LOCATION: cover_file_command,
+        TITLE_LOCATION: config.title,
+        ILLUSTRATIONS_FOLDER_LOCATION: illustration_dir.as_posix(),
+        LATEX_FILE_LOCATION: latex_contents,
+        DATE_LOCATION: config.time.replace(microsecond=0).isoformat(),
+        AUTHOR_LOCATION: config.author,
+        BABEL_LANGUAGE_LOCATION: babel_language,
+    }
 
-            elif TITLE_LOCATION in template_line:
-                output.append(template_line.replace(TITLE_LOCATION, config.title))
+    return compile_template(template).render(substitutions)
 
-            elif ILLUSTRATIONS_FOLDER_LOCATION in template_line:
-                output.append(template_line.replace(ILLUSTRATIONS_FOLDER_LOCATION, illustration_dir.as_posix()))
 
-            elif LATEX_FILE_LOCATION in template_line:
-                output.append(latex_contents)
+def split_content_into_chapters(content: Manuscript.Content) -> List[Manuscript.Content]:
+    """Splits the content of a Manuscript into sections that can each live in their own included LaTeX file.
 
-            elif DATE_LOCATION in template_line:
-                output.append(template_line.replace(DATE_LOCATION, config.time.replace(microsecond=0).isoformat()))
+    A new section starts at every part and every chapter, except for a chapter that immediately follows the start of a
+    part, which stays with its part. Any text before the first part or chapter gets a section of its own.
 
-            elif AUTHOR_LOCATION in template_line:
-                output.append(template_line.replace(AUTHOR_LOCATION, config.author))
+    Since parts and chapters start on a fresh page anyway, splitting at these points doesn't change the layout of the
+    book.
+    """
+    sections = []
+    current_section = []
 
-            elif BABEL_LANGUAGE_LOCATION in template_line:
-                output.append(template_line.replace(BABEL_LANGUAGE_LOCATION, babel_language))
+    for line in content:
+        starts_section = isinstance(line, Manuscript.StartPart) or isinstance(line, Manuscript.StartChapter)
+        follows_part = len(current_section) == 1 and isinstance(current_section[0], Manuscript.StartPart)
 
-            else:
-                output.append(template_line)
+        if starts_section and current_section and not (isinstance(line, Manuscript.StartChapter) and follows_part):
+            sections.append(current_section)
+            current_section = []
+
+        current_section.append(line)
+
+    if current_section:
+        sections.append(current_section)
+
+    return sections
 
-    return output
+
+async def _run_pandoc_to_latex_async(document: Iterable[bytes],
+                                     timeout: Optional[float] = None,
+                                     stdout_sink: Optional[Callable[[bytes], None]] = None) -> Optional[str]:
+    """Pushes the given (encoded, chunk by chunk) document through pandoc without blocking the event loop.
+
+    Returns the resulting LaTeX, unless stdout_sink is given, in which case the LaTeX goes into stdout_sink as it comes
+    (see external_tools.run_tool_async) and None is returned.
+    """
+    output = await external_tools.run_tool_async(PANDOC_TO_LATEX_CMD,
+                                                 input=document,
+                                                 timeout=timeout,
+                                                 stdout_sink=stdout_sink)
+
+    # stdout is always bytes, so we need to decode it. Input went in as utf-8, so surely the output will come out the
+    # same way.
+    return None if stdout_sink is not None else output.stdout.decode("utf-8")
 
 
 def convert_to_latex(manuscript: Manuscript) -> str:
@@ -145,44 +342,282 @@ def convert_to_latex(manuscript: Manuscript) -> str:
     As such, we shall use pandoc.
 
     Now, in my defense, I'm pushing the whole thing via stdin/stdout, which at the very least should save some mass
-    storage calls. Maybe. Probably.
+    storage calls. Maybe. Probably. (And pandoc doesn't even need to parse markdown: it gets the document ready-made,
+    see pandoc_ast.)
     """
-    # Start by converting the content to valid markdown, to feed into... something else.
-    markdown_content = markdown_exporter_innards.convert_content_to_lines(manuscript.content)
-    pandoc_input = markdown_exporter_innards.concatenate_content_lines_into_string(markdown_content).encode('utf-8')
+    return asyncio.run(convert_to_latex_async(manuscript))
 
-    pandoc_cmd = ["pandoc",
-                  "-r", "markdown-auto_identifiers",
-                  "-f", "markdown",
-                  "-t", "latex",
-                  "--top-level-division=part",
-                  "--wrap=preserve"]
 
-    # Cross fingers
-    output = subprocess.run(pandoc_cmd,
-                            check=True,
-                            input=pandoc_input,
-                            capture_output=True)
+async def convert_to_latex_async(manuscript: Manuscript, timeout: Optional[float] = None) -> str:
+    """Same as convert_to_latex, without blocking the event loop.
+    """
+    document = await pandoc_ast.encode_document_async([manuscript.content])
+    return await _run_pandoc_to_latex_async(document, timeout)
+
+
+async def convert_to_latex_file_async(manuscript: Manuscript, out_file: Path, timeout: Optional[float] = None) -> None:
+    """Same as convert_to_latex, but the LaTeX goes straight from pandoc into the given file, as pandoc writes it.
+    """
+    document = await pandoc_ast.encode_document_async([manuscript.content])
+    with out_file.open("wb") as out:
+        await _run_pandoc_to_latex_async(document, timeout, out.write)
 
-    # stdout is always bytes, so we need to decode it. Input went in as utf-8, so surely the output will come out the
-    # same way.
-    decoded_output = output.stdout.decode("utf-8")
-    return decoded_output
+
+def convert_chapters_to_latex(chapters: List[Manuscript.Content]) -> List[str]:
+    """Converts each of the given sections (as returned by split_content_into_chapters) into LaTeX (see
+    convert_chapters_to_latex_async).
+    """
+    return asyncio.run(convert_chapters_to_latex_async(chapters))
+
+
+async def convert_chapters_to_latex_async(chapters: List[Manuscript.Content],
+                                          timeout: Optional[float] = None) -> List[str]:
+    """Converts each of the given sections (as returned by split_content_into_chapters) into LaTeX.
+
+    All sections go through a single pandoc call, separated by SECTION_BREAK_MARKER, and are split up again on the way
+    out. See convert_chapters_to_latex_files_async to skip holding the output in memory.
+    """
+    if not chapters:
+        return []
+
+    document = await pandoc_ast.encode_document_async(chapters, section_break=SECTION_BREAK_BLOCK)
+    latex = await _run_pandoc_to_latex_async(document, timeout)
+    output = latex.split(SECTION_BREAK_MARKER)
+
+    if len(output) != len(chapters):
+        logger.error(f"Expected {len(chapters)} sections back from pandoc, but got {len(output)}!")
+        raise ValueError
+
+    return output
+
+
+class _ChapterFileWriter:
+    """Writes pandoc's output for a run of sections into their chapter files as it comes, moving on to the next file at
+    every SECTION_BREAK_MARKER.
+
+    The marker has a line of its own, so it can't straddle a line break: output is only looked at a line at a time
+    (well, however many whole lines have come through so far), with the rest held back until its line ends.
+    """
+    def __init__(self, chapter_files: List[Path]):
+        self.chapter_files = chapter_files
+        self.sections = 0
+        self._current: Optional[BinaryIO] = None
+        self._pending = bytearray()
+
+    def __call__(self, chunk: bytes) -> None:
+        self._pending += chunk
+        end = self._pending.rfind(b"\n") + 1
+        if end:
+            self._write(bytes(self._pending[:end]))
+            del self._pending[:end]
+
+    def _write(self, latex: bytes) -> None:
+        for index, piece in enumerate(latex.split(SECTION_BREAK_MARKER_BYTES)):
+            if index > 0 or self._current is None:
+                self._next_file()
+            self._current.write(piece)
+
+    def _next_file(self) -> None:
+        if self.sections >= len(self.chapter_files):
+            logger.error(f"Expected {len(self.chapter_files)} sections back from pandoc, but got more!")
+            raise ValueError
+
+        if self._current is not None:
+            self._current.close()
+
+        logger.debug(f"Writing chapter file: {self.chapter_files[self.sections]}")
+        self._current = self.chapter_files[self.sections].open("wb")
+        self.sections += 1
+
+    def flush(self) -> None:
+        """Writes out whatever is left, once pandoc is done.
+        """
+        self._write(bytes(self._pending))
+        self._pending.clear()
+
+    def close(self) -> None:
+        if self._current is not None:
+            self._current.close()
+
+
+async def convert_chapters_to_latex_files_async(chapters: Dict[int, Manuscript.Content],
+                                                out_directory: Path,
+                                                timeout: Optional[float] = None) -> None:
+    """Converts each of the given sections (keyed on their index, see split_content_into_chapters) into LaTeX, straight
+    into their own file (see write_chapter_files).
+
+    Same as convert_chapters_to_latex_async followed by write_chapter_files, except that pandoc's output is streamed out
+    into the files as pandoc writes it, so it's never held in memory whole.
+    """
+    if not chapters:
+        return
+
+    (out_directory / CHAPTERS_DIRECTORY_NAME).mkdir(exist_ok=True)
+    chapter_files = [(out_directory / get_chapter_include_name(index)).with_suffix(".tex") for index in chapters]
+    writer = _ChapterFileWriter(chapter_files)
+
+    document = await pandoc_ast.encode_document_async(list(chapters.values()), section_break=SECTION_BREAK_BLOCK)
+    try:
+        await _run_pandoc_to_latex_async(document, timeout, writer)
+        writer.flush()
+    finally:
+        writer.close()
+
+    if writer.sections != len(chapters):
+        logger.error(f"Expected {len(chapters)} sections back from pandoc, but got {writer.sections}!")
+        raise ValueError
+
+
+def get_chapter_include_name(index: int) -> str:
+    """Returns the name by which the given section is \\include-d, relative to the output directory.
+    """
+    return CHAPTERS_DIRECTORY_NAME + "/" + CHAPTER_FILE_STEM.format(index=index)
+
+
+def write_chapter_files(chapters_latex: Dict[int, str], out_directory: Path) -> None:
+    """Writes the LaTeX of each of the given sections (keyed on their index) into their own file.
+    """
+    (out_directory / CHAPTERS_DIRECTORY_NAME).mkdir(exist_ok=True)
+
+    for index, latex in chapters_latex.items():
+        chapter_file = (out_directory / get_chapter_include_name(index)).with_suffix(".tex")
+        logger.debug(f"Writing chapter file: {chapter_file}")
+        chapter_file.write_text(latex, encoding="utf8")
+
+
+def create_chapter_includes(chapter_count: int) -> str:
+    """Creates the LaTeX that pulls every section of the book into the main file.
+    """
+    return "\n".join(f"\\include{{{get_chapter_include_name(index)}}}" for index in range(chapter_count)) + "\n"
+
+
+def create_includeonly_command(selected_chapters: Iterable[int]) -> str:
+    """Creates the \\includeonly command that restricts a build to the given sections.
+
+    This has to come before \\begin{document}, so it goes right at the top of the main file (the same trick as running
+    pdflatex with "\\includeonly{...}\\input{file}").
+    """
+    return "\\includeonly{" + ",".join(get_chapter_include_name(index) for index in selected_chapters) + "}\n"
+
+
+def check_chapter_aux_files(chapter_count: int, selected_chapters: Iterable[int], out_directory: Path) -> None:
+    """Warns about sections that are left out of a draft build and have no .aux file from a previous build.
+
+    Without those, LaTeX has no way of knowing the page and chapter numbers of what comes after them.
+    """
+    selected_chapters = set(selected_chapters)
+    missing = [index for index in range(chapter_count)
+               if index not in selected_chapters
+               and not (out_directory / get_chapter_include_name(index)).with_suffix(".aux").exists()]
+
+    if missing:
+        logger.warning(f"No .aux files from a previous full build for sections {missing}.")
+        logger.warning("Page and chapter numbers in this draft may be off. A full build will sort that out.")
+
+
+def _to_roman(number: int) -> str:
+    """Converts a (positive) number to Roman numerals, as LaTeX numbers parts.
+    """
+    numerals = [(1000, "M"), (900, "CM"), (500, "D"), (400, "CD"), (100, "C"), (90, "XC"),
+                (50, "L"), (40, "XL"), (10, "X"), (9, "IX"), (5, "V"), (4, "IV"), (1, "I")]
+    output = ""
+    for value, numeral in numerals:
+        while number >= value:
+            output += numeral
+            number -= value
+
+    return output
+
+
+def compute_toc_entries(content: Manuscript.Content) -> List[TocEntry]:
+    """Works out the table of contents LaTeX will produce for the given content, without running LaTeX.
+
+    This follows the book class: parts are numbered in Roman numerals, chapters in Arabic numerals, and chapter numbers
+    carry on across parts. Entries that aren't numbered don't advance the count.
+    """
+    output = []
+    part_count = 0
+    chapter_count = 0
+
+    for line in content:
+        if isinstance(line, Manuscript.StartPart):
+            number = None
+            if line.config.numbered:
+                part_count += 1
+                number = _to_roman(part_count)
+            output.append(TocEntry("part", number, line.config.title))
+
+        elif isinstance(line, Manuscript.StartChapter):
+            number = None
+            if line.config.numbered:
+                chapter_count += 1
+                number = str(chapter_count)
+            output.append(TocEntry("chapter", number, line.config.title))
+
+    return output
+
+
+def read_toc_from_aux_files(aux_files: Iterable[Path]) -> Tuple[List[str], List[TocEntry]]:
+    """Reads the table of contents a previous build wrote into the given .aux files.
+
+    Returns the lines of the .toc file those would produce (page numbers and all), along with the entries they contain.
+    """
+    toc_lines = []
+    entries = []
+
+    for aux_file in aux_files:
+        with aux_file.open("r", encoding="utf8", errors="replace") as aux:
+            for line in aux:
+                toc_line = AUX_TOC_LINE_PATTERN.match(line)
+                if not toc_line:
+                    continue
+
+                toc_lines.append(toc_line.group(1) + "%\n")
+
+                contentsline = CONTENTSLINE_PATTERN.match(toc_line.group(1))
+                if contentsline:
+                    entries.append(TocEntry(contentsline.group(1), contentsline.group(2), None))
+
+    return toc_lines, entries
+
+
+def prepare_toc_file(content: Manuscript.Content, chapter_count: int, latex_filename: str, out_directory: Path) -> bool:
+    """Writes the .toc file for the upcoming build, so pdflatex has the table of contents right on its first pass.
+
+    The structure (and numbering) of the table of contents is worked out from the content, and the page numbers are
+    taken from the .aux files of the previous build, as long as that build had the same structure. If it didn't (or
+    there wasn't one), nothing is written, and build_latex will need a second pass.
+
+    Returns whether a .toc file was written.
+    """
+    aux_files = [(out_directory / get_chapter_include_name(index)).with_suffix(".aux") for index in range(chapter_count)]
+    if not all(aux_file.exists() for aux_file in aux_files):
+        logger.info("No .aux files from a previous build, so the table of contents can't be worked out up front.")
+        return False
+
+    toc_lines, previous_entries = read_toc_from_aux_files(aux_files)
+    expected_entries = compute_toc_entries(content)
+
+    if ([(entry.kind, entry.number) for entry in expected_entries]
+            != [(entry.kind, entry.number) for entry in previous_entries]):
+        logger.info("The parts/chapters of the book changed since the last build, so its page numbers can't be reused.")
+        return False
+
+    toc_file = (out_directory / Path(latex_filename).stem).with_suffix(".toc")
+    logger.info(f"Writing table of contents with {len(expected_entries)} entries from the previous build: {toc_file}")
+    with toc_file.open("w", encoding="utf8") as out_file:
+        out_file.writelines(toc_lines)
+
+    return True
 
 
 def write_latex_file(full_latex: Iterable[str], out_filename: Path, out_directory: Path) -> None:
     """Takes a list of strings and dumps them into a valid latex file.
+
+    out_filename is taken as-is (i.e. it should already include out_directory if it's meant to live there).
     """
-    # TODO: we're using os here, but pathlib probably does all of this.
-    old_working_dir = os.getcwd()
-    os.chdir(out_directory)
-    logger.info(f"CD-ing out of {old_working_dir}")
-    logger.info(f"... and into {out_directory}")
+    logger.info(f"Writing LaTeX file {out_filename} (output directory: {out_directory})")
 
     with out_filename.open("w", encoding="utf8") as out_file:
         for line in full_latex:
             out_file.write(line)
-
-    logger.info(f"CD-ing out of {os.getcwd()}")
-    logger.info(f"... and into {old_working_dir}")
-    os.chdir(old_working_dir)
@@ -1,12 +1,21 @@
 from pathlib import Path
+import asyncio
 
 from . import markdown_exporter_innards as innards
 from ..manuscript import Manuscript
+from ..instrumentation import instrumentation
 
 
+@instrumentation.timed("export.markdown")
 def export(manuscript: Manuscript, out_file: Path) -> None:
     """Exports the given Manuscript into the given out_file.
     """
     output_properties = innards.convert_config_to_md_properties(manuscript.config)
     output_content = innards.convert_content_to_lines(manuscript.content)
     innards.write_to_file(output_properties, output_content, out_file)
+
+
+async def export_async(manuscript: Manuscript, out_file: Path) -> None:
+    """Same as export, but in a thread, so as not to block the event loop.
+    """
+    await asyncio.to_thread(export, manuscript, out_file)
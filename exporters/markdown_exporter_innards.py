@@ -1,6 +1,6 @@
 import dataclasses
 from pathlib import Path
-from collections.abc import Iterable
+from collections.abc import Iterable, Iterator
 
 from ..manuscript import Manuscript
 
@@ -9,6 +9,9 @@ MD_HEADING_2 = "##"
 MD_SCENE_SEPARATOR = "---"
 MD_UNNUMBERED_INDICATOR = "{.unnumbered}"
 
+# Roughly how many characters go into each chunk of chunk_content_lines.
+ENCODED_CHUNK_SIZE = 64 * 1024
+
 
 def convert_config_to_md_properties(config: Manuscript.Config) -> Iterable[str]:
     """Takes a Manuscript.Config and turns it into markdown properties (as understood by Obsidian).
@@ -51,11 +54,12 @@ def convert_content_to_lines(content: Manuscript.Content, ignore_parts: bool = F
     output_lines = []
 
     for line in content:
-        if isinstance(line, Manuscript.StartPart) and not ignore_parts:
-            # TODO: Perhaps a helper function?
-            converted_line = MD_HEADING_1 + " " + convert_config_to_markdown(line.config)
-            output_lines.append(converted_line)
-        if isinstance(line, Manuscript.StartChapter):
+        if isinstance(line, Manuscript.StartPart):
+            if not ignore_parts:
+                # TODO: Perhaps a helper function?
+                converted_line = MD_HEADING_1 + " " + convert_config_to_markdown(line.config)
+                output_lines.append(converted_line)
+        elif isinstance(line, Manuscript.StartChapter):
             # TODO: Perhaps a helper function?
             if ignore_parts:
                 converted_line = MD_HEADING_1 + " " + convert_config_to_markdown(line.config)
@@ -76,11 +80,35 @@ def concatenate_content_lines_into_string(content: Iterable[str]) -> str:
     return "\n\n".join(content)
 
 
+def chunk_content_lines(content: Iterable[str], chunk_size: int = ENCODED_CHUNK_SIZE) -> Iterator[str]:
+    """Same as concatenate_content_lines_into_string, but a chunk (of roughly chunk_size characters) at a time.
+    """
+    pending = []
+    pending_size = 0
+    for index, line in enumerate(content):
+        if index > 0:
+            pending.append("\n\n")
+        pending.append(line)
+        pending_size += len(line)
+
+        if pending_size >= chunk_size:
+            yield "".join(pending)
+            pending = []
+            pending_size = 0
+
+    if pending:
+        yield "".join(pending)
+
+
 def write_to_file(properties: Iterable[str], content: Manuscript.Content, out_file: Path) -> None:
     """Takes the properties and Markdown content, and writes it into the given file.
+
+    The content ends up as concatenate_content_lines_into_string would have it, only written a chunk at a time (see
+    chunk_content_lines), so the whole of it never has to be in memory as a single string (let alone its encoded copy).
     """
     with open(out_file, "w", encoding="utf-8") as out:
         out.write("\n".join(properties))
         out.write("\n\n")
-        out.write(concatenate_content_lines_into_string(content))
+        for chunk in chunk_content_lines(content):
+            out.write(chunk)
         out.write("\n")
@@ -0,0 +1,483 @@
+import collections
+import hashlib
+import html
+import itertools
+import json
+import logging
+import re
+import shutil
+import threading
+from typing import Dict, Iterator, List, Optional
+
+from ..manuscript import Manuscript
+from . import external_tools
+from .epub_exporter_innards import (MD_BLOCKQUOTE_PREFIX, MD_CODE_PATTERN, MD_EMPHASIS_PATTERN, MD_ESCAPE_PATTERN,
+                                    MD_HEADING_PATTERN, MD_IMAGE_PATTERN, MD_LINK_PATTERN, MD_STRONG_PATTERN,
+                                    smarten)
+
+# Builds the document we hand to pandoc (as JSON, i.e. "-f json") straight from the content of a Manuscript, rather
+# than writing markdown for pandoc to parse all over again for every output format. It's the same subset of markdown
+# the EPUB exporter understands, which covers what shows up in prose, plus what pandoc's markdown reader would have
+# taken care of on top of it: "smart" punctuation, lists, footnotes, strikeout, TeX math, raw TeX commands, raw HTML and
+# HTML entities.
+#
+# See https://pandoc.org/filters.html and the pandoc-types package for what the JSON looks like.
+
+logger = logging.getLogger(__name__)
+
+# How we ask pandoc which version of the JSON format it speaks. Documents in any other (major) version are turned away.
+PANDOC_API_VERSION_CMD = ["pandoc", "-f", "markdown", "-t", "json"]
+PANDOC_API_VERSION_KEY = "pandoc-api-version"
+
+# Raw TeX commands (e.g. \newpage, or \textsc{text}) and HTML tags (and comments) go through untouched, as pandoc's
+# markdown reader would do. Each output format only keeps its own, of course.
+MD_RAW_TEX_PATTERN = re.compile(r"\\[a-zA-Z]+(?:\{[^{}]*\})*")
+MD_RAW_HTML_PATTERN = re.compile(r"<!--.*?-->|</?[a-zA-Z][a-zA-Z0-9-]*(?:\s[^<>]*)?/?>")
+MD_HTML_COMMENT_PATTERN = re.compile(r"<!--.*-->")
+
+MD_STRIKEOUT_PATTERN = re.compile(r"~~(?=\S)(.+?)(?<=\S)~~")
+
+# HTML entities (e.g. &mdash; or &#8212;) stand for the character they name, as they do in pandoc's markdown.
+MD_ENTITY_PATTERN = re.compile(r"&(?:[a-zA-Z][a-zA-Z0-9]*|#[0-9]+|#[xX][0-9a-fA-F]+);")
+
+# TeX math, as pandoc's markdown reader understands it: $$display$$, or $inline$ with no space right inside the dollars
+# and no digit right after the closing one (so "$5 and $10" is just money).
+MD_MATH_PATTERN = re.compile(r"\$\$(.+?)\$\$|\$(?=[^\s$])((?:[^$\\]|\\.)*?)(?<=[^\s\\])\$(?!\d)")
+
+# Characters pandoc's markdown reader lets be escaped on top of those the EPUB exporter does (see MD_ESCAPE_PATTERN),
+# which matter for the markup above.
+MD_PANDOC_ESCAPE_PATTERN = re.compile(r"\\([$~^<&])")
+
+# Footnotes are either references ([^label]) to a definition ([^label]: text) on a line of its own, anywhere in the
+# document, or inline (^[text]).
+MD_FOOTNOTE_PATTERN = re.compile(r"\[\^([^\]\s]+)\]")
+MD_INLINE_FOOTNOTE_PATTERN = re.compile(r"\^\[([^\]]+)\]")
+MD_FOOTNOTE_DEFINITION_PATTERN = re.compile(r"^\[\^([^\]\s]+)\]:\s*(.*)$")
+
+# List items, one per line (and so, one per paragraph), as the importers leave them. Neighbouring items of the same
+# kind make up a list.
+MD_BULLET_ITEM_PATTERN = re.compile(r"^[-*+]\s+(.*)$")
+MD_ORDERED_ITEM_PATTERN = re.compile(r"^(\d{1,9})([.)])\s+(.*)$")
+ORDERED_LIST_DELIMITERS = {".": "Period", ")": "OneParen"}
+
+# Every bit of inline markup, in the order in which they get first dibs on the text (code and escapes are taken
+# literally, so they go first).
+INLINE_PATTERNS = {
+    "code": MD_CODE_PATTERN,
+    "escape": MD_ESCAPE_PATTERN,
+    "pandoc_escape": MD_PANDOC_ESCAPE_PATTERN,
+    "math": MD_MATH_PATTERN,
+    "raw_tex": MD_RAW_TEX_PATTERN,
+    "raw_html": MD_RAW_HTML_PATTERN,
+    "entity": MD_ENTITY_PATTERN,
+    "footnote": MD_FOOTNOTE_PATTERN,
+    "inline_footnote": MD_INLINE_FOOTNOTE_PATTERN,
+    "image": MD_IMAGE_PATTERN,
+    "link": MD_LINK_PATTERN,
+    "strong": MD_STRONG_PATTERN,
+    "strikeout": MD_STRIKEOUT_PATTERN,
+    "emphasis": MD_EMPHASIS_PATTERN,
+}
+INLINE_PATTERN = re.compile("|".join(f"(?P<{name}>{pattern.pattern})" for name, pattern in INLINE_PATTERNS.items()))
+
+WHITESPACE_PATTERN = re.compile(r"(\s+)")
+
+# Blocks that aren't numbered carry this class, same as the "{.unnumbered}" in markdown.
+UNNUMBERED_CLASS = "unnumbered"
+
+# Roughly how many bytes go into each chunk of an encoded document (see encode_blocks), and how many bytes of encoded
+# segments (i.e. chapters, see _split_into_segments) are kept around, at most.
+ENCODED_CHUNK_SIZE = 64 * 1024
+SEGMENT_CACHE_SIZE = 16 * 1024 * 1024
+
+# pandoc API versions, keyed on the pandoc they came from.
+_api_versions: Dict[Optional[str], list] = {}
+
+# Encoded segments (as the chunks they were encoded into), keyed on a hash of what they were built from, along with how
+# many bytes they add up to. Exports can run in threads, hence the lock.
+_segments: collections.OrderedDict = collections.OrderedDict()
+_segments_size = 0
+_segments_lock = threading.Lock()
+
+
+def _node(node_type: str, content=None) -> dict:
+    """Creates a node of the given type, with the given content (if it has any).
+    """
+    if content is None:
+        return {"t": node_type}
+
+    return {"t": node_type, "c": content}
+
+
+def _attr(classes: List[str] = None) -> list:
+    """Creates the attributes of a node: an identifier (none), classes and key-value pairs (none).
+    """
+    return ["", classes or [], []]
+
+
+def raw_block(output_format: str, text: str) -> dict:
+    """Creates a block that goes into the output as it is, for the given format only (e.g. "latex").
+    """
+    return _node("RawBlock", [output_format, text])
+
+
+def _convert_text(text: str, previous: str) -> List[dict]:
+    """Converts text without any markup in it into words and the spaces between them.
+    """
+    output = []
+    for index, piece in enumerate(WHITESPACE_PATTERN.split(smarten(text, previous))):
+        if index % 2:
+            output.append(_node("SoftBreak" if "\n" in piece else "Space"))
+        elif piece:
+            output.append(_node("Str", piece))
+
+    return output
+
+
+def _merge_strings(inlines: List[dict]) -> List[dict]:
+    """Glues neighbouring strings together, as pandoc does (e.g. around escaped characters).
+    """
+    output = []
+    for inline in inlines:
+        if inline["t"] == "Str" and output and output[-1]["t"] == "Str":
+            output[-1] = _node("Str", output[-1]["c"] + inline["c"])
+        else:
+            output.append(inline)
+
+    return output
+
+
+def _convert_note(text: str) -> dict:
+    """Converts the text of a footnote into a note (which can't have notes of its own).
+    """
+    return _node("Note", [_node("Para", convert_inline_markdown(text.strip()))])
+
+
+def convert_inline_markdown(text: str, previous: str = "", notes: Optional[Dict[str, str]] = None) -> List[dict]:
+    """Converts the inline markdown in the given text (emphasis, links, etc) into pandoc inlines.
+
+    previous is whatever came right before the text (if anything), for the sake of smart quotes. notes are the footnote
+    definitions footnote references can refer to, keyed on their label (see collect_footnotes). References to anything
+    else are left as they are.
+    """
+    output = []
+    position = 0
+    for match in INLINE_PATTERN.finditer(text):
+        output.extend(_convert_text(text[position:match.start()], text[position - 1] if position else previous))
+        position = match.end()
+
+        # The pattern of the markup that matched, for its groups.
+        kind = match.lastgroup
+        groups = INLINE_PATTERNS[kind].fullmatch(match.group()).groups()
+        before = text[match.start() - 1] if match.start() else previous
+
+        if kind == "code":
+            output.append(_node("Code", [_attr(), groups[0]]))
+        elif kind in ("escape", "pandoc_escape"):
+            output.append(_node("Str", groups[0]))
+        elif kind == "math":
+            if groups[0] is not None:
+                output.append(_node("Math", [_node("DisplayMath"), groups[0]]))
+            else:
+                output.append(_node("Math", [_node("InlineMath"), groups[1]]))
+        elif kind == "entity":
+            output.append(_node("Str", html.unescape(match.group())))
+        elif kind == "raw_tex":
+            output.append(_node("RawInline", ["tex", match.group()]))
+        elif kind == "raw_html":
+            output.append(_node("RawInline", ["html", match.group()]))
+        elif kind == "footnote":
+            if notes is not None and groups[0] in notes:
+                output.append(_convert_note(notes[groups[0]]))
+            else:
+                output.extend(_convert_text(match.group(), before))
+        elif kind == "inline_footnote":
+            output.append(_convert_note(groups[0]))
+        elif kind == "image":
+            output.append(_node("Image", [_attr(), convert_inline_markdown(groups[0]), [groups[1], ""]]))
+        elif kind == "link":
+            output.append(_node("Link", [_attr(), convert_inline_markdown(groups[0], before, notes), [groups[1], ""]]))
+        elif kind == "strong":
+            output.append(_node("Strong", convert_inline_markdown(groups[0] or groups[1], before, notes)))
+        elif kind == "strikeout":
+            output.append(_node("Strikeout", convert_inline_markdown(groups[0], before, notes)))
+        else:
+            output.append(_node("Emph", convert_inline_markdown(groups[0] or groups[1], before, notes)))
+
+    output.extend(_convert_text(text[position:], text[position - 1] if position else previous))
+    return _merge_strings(output)
+
+
+def _convert_separator(config: Manuscript.SeparatorConfig, level: int) -> dict:
+    """Converts a part or chapter separator into a heading of the given level.
+    """
+    classes = [] if config.numbered else [UNNUMBERED_CLASS]
+    return _node("Header", [level, _attr(classes), convert_inline_markdown(config.title)])
+
+
+def collect_footnotes(sections: List[Manuscript.Content]) -> Dict[str, str]:
+    """Finds the footnote definitions in the given sections of content, keyed on their label.
+
+    As in pandoc, the first definition of a label wins.
+    """
+    notes = {}
+    for section in sections:
+        for line in section:
+            if isinstance(line, str) and line.startswith("[^"):
+                match = MD_FOOTNOTE_DEFINITION_PATTERN.match(line)
+                if match:
+                    notes.setdefault(match.group(1), match.group(2))
+
+    return notes
+
+
+def _convert_line(line: str, notes: Optional[Dict[str, str]] = None) -> Optional[dict]:
+    """Converts a line of Manuscript content (which is a paragraph, as far as markdown goes) into a block.
+
+    List items become a list of their own (see _merge_block).
+    """
+    heading = MD_HEADING_PATTERN.match(line)
+    if heading:
+        return _node("Header", [len(heading.group(1)), _attr(), convert_inline_markdown(heading.group(2), "", notes)])
+
+    if line.startswith(MD_BLOCKQUOTE_PREFIX):
+        text = line[len(MD_BLOCKQUOTE_PREFIX):].strip()
+        return _node("BlockQuote", [_node("Para", convert_inline_markdown(text, "", notes))])
+
+    if MD_FOOTNOTE_DEFINITION_PATTERN.match(line):
+        # Definitions end up wherever they're referenced from.
+        return None
+
+    if MD_HTML_COMMENT_PATTERN.fullmatch(line):
+        return raw_block("html", line)
+
+    item = MD_BULLET_ITEM_PATTERN.match(line)
+    if item:
+        return _node("BulletList", [[_node("Para", convert_inline_markdown(item.group(1), "", notes))]])
+
+    item = MD_ORDERED_ITEM_PATTERN.match(line)
+    if item:
+        attributes = [int(item.group(1)), _node("Decimal"), _node(ORDERED_LIST_DELIMITERS[item.group(2)])]
+        return _node("OrderedList", [attributes, [[_node("Para", convert_inline_markdown(item.group(3), "", notes))]]])
+
+    inlines = convert_inline_markdown(line, "", notes)
+    return _node("Para", inlines) if inlines else None
+
+
+def _merge_block(previous: dict, block: dict) -> bool:
+    """Merges the given block into the one right before it, if they're both lists of the same kind.
+
+    Returns whether it did.
+    """
+    if block["t"] != previous["t"]:
+        return False
+
+    if block["t"] == "BulletList":
+        previous["c"].extend(block["c"])
+        return True
+    # Ordered lists keep the number they started with (as pandoc does), as long as the delimiters match.
+    if block["t"] == "OrderedList" and block["c"][0][1:] == previous["c"][0][1:]:
+        previous["c"][1].extend(block["c"][1])
+        return True
+
+    return False
+
+
+def iterate_blocks(content: Manuscript.Content,
+                   ignore_parts: bool = False,
+                   notes: Optional[Dict[str, str]] = None) -> Iterator[dict]:
+    """Same as convert_content_to_blocks, but a block at a time.
+    """
+    if notes is None:
+        notes = collect_footnotes([content])
+
+    # The last block is held back until the next one, in case they're items of the same list.
+    pending = None
+    for line in content:
+        if isinstance(line, Manuscript.StartPart):
+            if ignore_parts:
+                continue
+            block = _convert_separator(line.config, 1)
+        elif isinstance(line, Manuscript.StartChapter):
+            block = _convert_separator(line.config, 1 if ignore_parts else 2)
+        elif isinstance(line, Manuscript.BreakScene):
+            block = _node("HorizontalRule")
+        else:
+            block = _convert_line(line, notes)
+            if block is None or (pending is not None and _merge_block(pending, block)):
+                continue
+
+        if pending is not None:
+            yield pending
+        pending = block
+
+    if pending is not None:
+        yield pending
+
+
+def convert_content_to_blocks(content: Manuscript.Content,
+                              ignore_parts: bool = False,
+                              notes: Optional[Dict[str, str]] = None) -> List[dict]:
+    """Takes the content of a Manuscript and turns it into pandoc blocks.
+
+    Same as markdown_exporter_innards.convert_content_to_lines, but for pandoc: if ignore_parts is set, then StartPart
+    markers will be ignored, and StartChapter markers will become top-level headings instead. notes are the footnote
+    definitions references can refer to (see collect_footnotes), which are the ones in content if not given.
+    """
+    return list(iterate_blocks(content, ignore_parts, notes))
+
+
+def _split_into_segments(content: Manuscript.Content) -> Iterator[Manuscript.Content]:
+    """Splits content up at every part and chapter, which are the pieces encoded documents are cached in.
+
+    Nothing (lists included) carries over from one segment to the next, so they can be converted on their own.
+    """
+    segment = []
+    for line in content:
+        if segment and isinstance(line, (Manuscript.StartPart, Manuscript.StartChapter)):
+            yield segment
+            segment = []
+        segment.append(line)
+
+    if segment:
+        yield segment
+
+
+def _hash_segment(segment: Manuscript.Content, context: str) -> str:
+    """Hashes everything that goes into the blocks of a segment (context standing for everything outside of it).
+    """
+    hasher = hashlib.sha256(context.encode("utf-8"))
+    for line in segment:
+        hasher.update(b"\0")
+        hasher.update(repr(line).encode("utf-8"))
+
+    return hasher.hexdigest()
+
+
+def _cache_segment(key: str, chunks: List[bytes], size: int) -> None:
+    global _segments_size
+
+    with _segments_lock:
+        if key in _segments:
+            return
+        _segments[key] = (chunks, size)
+        _segments_size += size
+        while _segments_size > SEGMENT_CACHE_SIZE:
+            _, (_, evicted_size) = _segments.popitem(last=False)
+            _segments_size -= evicted_size
+
+
+def _encode_segment(segment: Manuscript.Content,
+                    ignore_parts: bool,
+                    notes: Dict[str, str],
+                    context: str) -> Iterator[bytes]:
+    """Encodes the blocks of the given segment as the items of a JSON list (no brackets, no leading or trailing comma),
+    a chunk (of roughly ENCODED_CHUNK_SIZE bytes) at a time.
+
+    Segments are remembered once encoded (unless they're bigger than the whole cache), so the same segment is only
+    ever converted once (as long as it's among the last SEGMENT_CACHE_SIZE bytes of segments).
+    """
+    key = _hash_segment(segment, context)
+    with _segments_lock:
+        cached = _segments.get(key)
+        if cached is not None:
+            _segments.move_to_end(key)
+
+    if cached is not None:
+        yield from cached[0]
+        return
+
+    # What's been encoded so far, for the cache (until it turns out to be too big for it).
+    chunks: Optional[List[bytes]] = []
+    size = 0
+    pending = []
+    pending_size = 0
+
+    def flush() -> bytes:
+        nonlocal chunks, size, pending, pending_size
+        chunk = (b"," if size else b"") + b",".join(pending)
+        size += len(chunk)
+        if chunks is not None:
+            chunks.append(chunk)
+            if size > SEGMENT_CACHE_SIZE:
+                chunks = None
+        pending = []
+        pending_size = 0
+        return chunk
+
+    for block in iterate_blocks(segment, ignore_parts, notes):
+        encoded = json.dumps(block, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        pending.append(encoded)
+        pending_size += len(encoded)
+        if pending_size >= ENCODED_CHUNK_SIZE:
+            yield flush()
+
+    if pending:
+        yield flush()
+
+    if chunks is not None:
+        _cache_segment(key, chunks, size)
+
+
+def encode_blocks(sections: List[Manuscript.Content],
+                  ignore_parts: bool = False,
+                  section_break: Optional[dict] = None) -> Iterator[bytes]:
+    """Converts the given sections of content into pandoc blocks, encoded as a JSON list, with section_break (if given)
+    between each pair of them.
+
+    The list comes a chunk at a time, so the whole document is never in memory at once (and never needs to be, as
+    external_tools.run_tool_async feeds it to pandoc chunk by chunk). Each part or chapter is encoded on its own, and
+    remembered (see _encode_segment), so exporting the same manuscript into several formats, or again after changing
+    it, only converts what's new.
+    """
+    # Footnotes can be defined in any section, as they could anywhere in a markdown document, so they're part of
+    # what goes into every segment.
+    notes = collect_footnotes(sections)
+    context = repr((ignore_parts, sorted(notes.items())))
+    encoded_break = json.dumps(section_break, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    yield b"["
+    is_empty = True
+    for index, section in enumerate(sections):
+        if index > 0 and section_break is not None:
+            yield encoded_break if is_empty else b"," + encoded_break
+            is_empty = False
+
+        for segment in _split_into_segments(section):
+            for chunk_index, chunk in enumerate(_encode_segment(segment, ignore_parts, notes, context)):
+                if chunk_index == 0 and not is_empty:
+                    chunk = b"," + chunk
+                is_empty = False
+                yield chunk
+    yield b"]"
+
+
+async def get_api_version_async() -> list:
+    """Asks pandoc which version of the JSON format it speaks (only once per pandoc).
+    """
+    pandoc = shutil.which(PANDOC_API_VERSION_CMD[0])
+    if pandoc in _api_versions:
+        return _api_versions[pandoc]
+
+    output = await external_tools.run_tool_async(PANDOC_API_VERSION_CMD, input=b"")
+    try:
+        version = json.loads(output.stdout)[PANDOC_API_VERSION_KEY]
+    except (ValueError, KeyError):
+        logger.error(f"Could not make out the pandoc API version from: {output.stdout[:100]!r}")
+        raise ValueError
+
+    _api_versions[pandoc] = version
+    return version
+
+
+async def encode_document_async(sections: List[Manuscript.Content],
+                                ignore_parts: bool = False,
+                                section_break: Optional[dict] = None) -> Iterator[bytes]:
+    """Creates a pandoc (JSON) document out of the given sections of content (see encode_blocks), ready for "-f json".
+
+    The document comes in chunks, and is only encoded as they're taken (see encode_blocks), so it can only be gone
+    through once.
+    """
+    version = await get_api_version_async()
+    header = json.dumps({PANDOC_API_VERSION_KEY: version, "meta": {}})[:-1] + ',"blocks":'
+    return itertools.chain([header.encode("utf-8")], encode_blocks(sections, ignore_parts, section_break), [b"}"])
@@ -0,0 +1 @@
+from .illustrations import *
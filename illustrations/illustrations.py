@@ -0,0 +1,194 @@
+from pathlib import Path
+import concurrent.futures
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from ..manuscript import Manuscript
+
+# Pillow is only needed to actually shrink images. Without it, illustrations still go through the cache, just as they
+# are.
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Markdown images, i.e. ![alt](path), as they may show up in the text of a manuscript.
+MARKDOWN_IMAGE_PATTERN = re.compile(r"!\[[^\]]*\]\(([^)\s]+)\)")
+
+# The cache keeps prepared images in OBJECTS_DIRECTORY_NAME, named after the hash of what went into them. Each profile
+# then gets its own folder that mirrors the illustration folder (as far as the manuscript needs it), pointing at those
+# objects, which is what gets handed to the exporters.
+OBJECTS_DIRECTORY_NAME = "objects"
+
+# Bump this whenever the way images are prepared changes, so the cache doesn't hand out stale images.
+PREPARATION_VERSION = "1"
+
+
+@dataclass(frozen=True)
+class ImageProfile:
+    """How illustrations should be prepared for a given kind of output.
+
+    Images are shrunk (never enlarged) to fit within max_width x max_height pixels, and lossy formats are re-encoded at
+    the given quality. Images keep their format, so their names (and so the references in the text) stay valid.
+    """
+    name: str
+    max_width: int
+    max_height: int
+    quality: int
+
+
+# E-readers don't need much, and every byte counts in an EPUB.
+EPUB_PROFILE = ImageProfile("epub", 1600, 2560, 85)
+
+# A full A4 page at 300 DPI.
+PDF_PROFILE = ImageProfile("pdf", 2480, 3508, 90)
+
+
+def find_illustrations(manuscript: Manuscript, illustration_dir: Path) -> List[str]:
+    """Finds the illustrations (cover included) the given manuscript uses, as names relative to illustration_dir.
+
+    Only illustrations that exist are returned, in the order they are first used, without repeats.
+    """
+    names = []
+    if manuscript.config is not None and manuscript.config.cover:
+        names.append(manuscript.config.cover)
+
+    for line in manuscript.content:
+        if Manuscript.is_control_type(line):
+            continue
+        names.extend(match.group(1) for match in MARKDOWN_IMAGE_PATTERN.finditer(line))
+
+    output = []
+    for name in dict.fromkeys(names):
+        if (illustration_dir / name).is_file():
+            output.append(name)
+        else:
+            logger.warning(f"Could not find illustration {name} in {illustration_dir}, so leaving it be.")
+
+    return output
+
+
+def hash_illustration(source: Path, profile: ImageProfile) -> str:
+    """Hashes everything that goes into preparing the given image with the given profile.
+    """
+    hasher = hashlib.sha256()
+    hasher.update(f"{PREPARATION_VERSION}\n{profile}\n".encode("utf-8"))
+    with open(source, "rb") as in_file:
+        for block in iter(lambda: in_file.read(1 << 20), b""):
+            hasher.update(block)
+
+    return hasher.hexdigest()
+
+
+def _shrink_image(source: Path, destination: Path, profile: ImageProfile) -> None:
+    """Writes a version of the source image that fits the given profile into destination.
+
+    If Pillow can't make the image any smaller (or can't read it at all, e.g. a PDF), the original is copied instead.
+    """
+    if Image is not None:
+        try:
+            with Image.open(source) as image:
+                image_format = image.format
+                image.thumbnail((profile.max_width, profile.max_height))
+
+                if image_format == "JPEG":
+                    if image.mode not in ("RGB", "L", "CMYK"):
+                        image = image.convert("RGB")
+                    image.save(destination, format=image_format, quality=profile.quality, optimize=True)
+                else:
+                    image.save(destination, format=image_format, optimize=True)
+
+            if destination.stat().st_size < source.stat().st_size:
+                return
+        except OSError as e:
+            logger.debug(f"Could not shrink {source} ({e}), so using it as it is.")
+
+    shutil.copyfile(source, destination)
+
+
+def prepare_illustration(source: Path, profile: ImageProfile, cache_dir: Path) -> Path:
+    """Prepares the given image for the given profile, returning where the prepared version lives in the cache.
+
+    Images that were prepared before (same contents, same profile) are not prepared again.
+    """
+    objects_dir = cache_dir / OBJECTS_DIRECTORY_NAME
+    objects_dir.mkdir(parents=True, exist_ok=True)
+
+    prepared = objects_dir / (hash_illustration(source, profile) + source.suffix.lower())
+    if prepared.exists():
+        logger.debug(f"Found {source} in the cache: {prepared}")
+        return prepared
+
+    # Prepare into a temporary file and move it into place, so nobody ever sees half an image.
+    file_descriptor, temp_name = tempfile.mkstemp(suffix=prepared.suffix, dir=objects_dir)
+    os.close(file_descriptor)
+    try:
+        _shrink_image(source, Path(temp_name), profile)
+        os.replace(temp_name, prepared)
+    except BaseException:
+        Path(temp_name).unlink(missing_ok=True)
+        raise
+
+    logger.debug(f"Prepared {source} for {profile.name}: {prepared}")
+    return prepared
+
+
+def _link_into_place(prepared: Path, destination: Path) -> None:
+    """Makes destination point at the prepared image, with a hard link where possible, or a copy where not.
+    """
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    destination.unlink(missing_ok=True)
+    try:
+        os.link(prepared, destination)
+    except OSError:
+        shutil.copyfile(prepared, destination)
+
+
+def prepare_illustrations(manuscript: Manuscript,
+                          illustration_dir: Path,
+                          cache_dir: Path,
+                          profiles: List[ImageProfile],
+                          max_workers: Optional[int] = None,
+                          names: Optional[List[str]] = None) -> Dict[str, Path]:
+    """Prepares every illustration the given manuscript uses for each of the given profiles, all in parallel.
+
+    Returns, for each profile name, a folder laid out like illustration_dir (as far as the manuscript needs it) with
+    the prepared images, which can be passed to the exporters in place of illustration_dir.
+
+    Note:
+    * Prepared images live in a content-addressed cache in cache_dir, so unchanged images are only prepared once, no
+      matter how often (or for how many books) this is called.
+    * Shrinking images requires Pillow. Without it, images are passed along as they are (with a warning).
+    * names, if given, are the illustrations to prepare, for when they've been found already (see find_illustrations).
+    """
+    if Image is None:
+        logger.warning("Pillow is not installed, so illustrations will be used as they are.")
+
+    if names is None:
+        names = find_illustrations(manuscript, illustration_dir)
+    logger.info(f"Preparing {len(names)} illustrations for {[profile.name for profile in profiles]}.")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {(profile.name, name): executor.submit(prepare_illustration,
+                                                          illustration_dir / name,
+                                                          profile,
+                                                          cache_dir)
+                   for profile in profiles
+                   for name in names}
+
+        output = {}
+        for profile in profiles:
+            profile_dir = cache_dir / profile.name
+            for name in names:
+                _link_into_place(futures[(profile.name, name)].result(), profile_dir / name)
+            output[profile.name] = profile_dir
+
+    return output
@@ -0,0 +1,58 @@
+from pathlib import Path
+import logging
+from typing import Optional
+
+from . import markdown_importer_innards as innards
+from ..manuscript import Manuscript
+from ..instrumentation import instrumentation
+
+logger = logging.getLogger(__name__)
+
+DelimiterMode = innards.DelimiterMode
+
+
+@instrumentation.timed("import.guide_file")
+def load_manuscript_from_guide_file(guide_file: Path,
+                                    heading: str,
+                                    root_folder: Path,
+                                    delimiter_mode: DelimiterMode = DelimiterMode.EMOJI,
+                                    vault: Optional[innards.Vault] = None) -> Manuscript:
+    """Loads a manuscript from a heading in a guide file, i.e. a (potentially huge) planning document where every
+    manuscript has a heading of its own.
+
+    Everything under the heading, up to the next heading of the same or a higher level, follows the same structure as an
+    index file (see markdown_index_file_importer), and only that section of the file is read (see
+    innards.find_heading_section). Files are read through the given vault (of the root folder), if any.
+    """
+    logger.info("Loading Manuscript from Guide File.")
+    logger.info(f"Guide file: {guide_file}")
+    logger.info(f"Heading: {heading}")
+    logger.info(f"Root folder: {root_folder}")
+
+    # Check whether file exists
+    if not guide_file.exists():
+        logger.error("File does not exist!")
+        return None
+
+    logger.info("Reading lines from the heading.")
+    with instrumentation.stage("import.read_guide"):
+        raw_lines = innards.extract_relevant_lines_from_guide_file(guide_file, heading, delimiter_mode)
+    logger.info(f"Extracted index with {len(raw_lines)} lines.")
+
+    logger.info("Extracting text from files.")
+    if vault is None:
+        vault = innards.Vault(root_folder)
+    with instrumentation.stage("import.read_files"):
+        lines_with_text = innards.extract_text_from_files(raw_lines, root_folder, delimiter_mode, vault)
+
+    logger.info("Replacing text indicators with Manuscript indicators.")
+    with instrumentation.stage("import.replace_indicators"):
+        lines_with_correct_indicators = innards.replace_indicators(lines_with_text)
+
+    logger.info("Extracting config.")
+    with instrumentation.stage("import.extract_config"):
+        parsed_lines, config = innards.extract_global_config(lines_with_correct_indicators, delimiter_mode)
+
+    logger.info("Constructing Manuscript object.")
+    manuscript = innards.construct_manuscript(parsed_lines, config, [guide_file] + vault.dependencies)
+    return manuscript
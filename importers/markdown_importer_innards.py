@@ -2,10 +2,17 @@ from pathlib import Path
 import logging
 import datetime
 from collections.abc import Iterable
+import concurrent.futures
 import copy
+import os
+import re
+import threading
+from dataclasses import dataclass, field
 from enum import Enum
+from typing import Dict, List, Optional, Tuple
 
 from ..manuscript import Manuscript
+from ..instrumentation import instrumentation
 
 logger = logging.getLogger(__name__)
 
@@ -66,6 +73,43 @@ AUTHOR_KEY = "Author"
 TITLE_KEY = "Title"
 COVER_KEY = "Cover"
 
+# Obsidian embeds: ![[Note]], ![[Note#Heading]], and either of them with an alias (![[Note|alias]]), which doesn't
+# matter here. Notes are markdown files, whose extension can be left out; anything else (e.g. ![[image.png]]) is left
+# alone.
+EMBED_PATTERN = re.compile(r"!\[\[([^\]#|]+)(?:#([^\]|]+))?(?:\|[^\]]*)?\]\]")
+MARKDOWN_SUFFIX = ".md"
+HEADING_PATTERN = re.compile(r"(#{1,6})\s+(.*)")
+PROPERTIES_DELIMITER = "---"
+
+# Fenced code blocks in guide files, where lines starting with # aren't headings.
+CODE_FENCES = (b"```", b"~~~")
+
+# What vault scanning leaves out by default (see IgnorePatterns): Obsidian's settings and trash, version control, and
+# output folders. More patterns can go into an ignore file at the top of the vault.
+DEFAULT_IGNORE_PATTERNS = (".obsidian/", ".trash/", ".git/", "output/", "__pycache__/")
+IGNORE_FILE_NAME = ".manuscriptignore"
+
+# How many threads scan the folders of a vault at the same time.
+SCAN_WORKERS = 8
+
+# How deep embeds can go (a note embedding a note embedding a note...) before we give up.
+MAX_EMBED_DEPTH = 10
+
+
+def _extract_relevant_lines(lines: Iterable[str], delimiter_mode: DelimiterMode) -> List[str]:
+    """Keeps the relevant lines of an index (see extract_relevant_lines_from_index_file), stripped.
+    """
+    output = []
+    for line in lines:
+        if line.strip() == "":
+            # Disregard empty lines
+            continue
+        # We only pull in lines that either contain config or file name to include.
+        elif CONFIG_START[delimiter_mode] in line or FILENAME_START[delimiter_mode] in line:
+            output.append(line.strip())
+
+    return output
+
 
 def extract_relevant_lines_from_index_file(index_file: Path, delimiter_mode: DelimiterMode) -> Iterable[str]:
     """Extracts the relevant text from the given markdown index file.
@@ -74,74 +118,548 @@ def extract_relevant_lines_from_index_file(index_file: Path, delimiter_mode: Del
 
     Returns the text verbatim as a list of lines, to be post-processed later.
     """
-    lines = []
     with open(index_file, "r", encoding="utf-8") as in_file:
-        for line in in_file:
-            if line.strip() == "":
-                # Disregard empty lines
+        lines = in_file.readlines()
+
+    _count_file_read(index_file, len(lines))
+    return _extract_relevant_lines(lines, delimiter_mode)
+
+
+@dataclass
+class Heading:
+    """A heading in a guide file: its level (1 for #, 2 for ##...), its title, and the byte offsets where its line
+    starts and where the line after it starts.
+    """
+    level: int
+    title: str
+    offset: int
+    end_offset: int
+
+
+@dataclass
+class _GuideFileHeadings:
+    """The headings of a guide file, as far as it's been scanned so far (see find_heading_section).
+
+    size and modified are those of the file when it was first scanned, which tell whether it's still the same file.
+    """
+    size: int
+    modified: int
+    headings: List[Heading] = field(default_factory=list)
+    scanned: int = 0
+    complete: bool = False
+    # The fence of the code block the scan left off in, if any.
+    fence: Optional[bytes] = None
+
+
+# Headings of every guide file looked into so far, keyed on the file.
+_guide_file_headings: Dict[Path, _GuideFileHeadings] = {}
+_guide_file_headings_lock = threading.Lock()
+
+
+def _scan_headings(guide_file: Path, headings: _GuideFileHeadings, until) -> None:
+    """Carries on scanning the given guide file for headings where the last scan left off, until one of them makes
+    until return True (or the file ends).
+    """
+    line_count = 0
+    with open(guide_file, "rb") as in_file:
+        in_file.seek(headings.scanned)
+        position = headings.scanned
+        for line_count, line in enumerate(in_file, 1):
+            line_start = position
+            position += len(line)
+
+            stripped = line.lstrip()
+            if headings.fence is not None:
+                if stripped.startswith(headings.fence):
+                    headings.fence = None
+                continue
+            elif stripped.startswith(CODE_FENCES):
+                headings.fence = stripped[:3]
+                continue
+            elif not line.startswith(b"#"):
                 continue
-            # We only pull in lines that either contain config or file name to include.
-            elif CONFIG_START[delimiter_mode] in line or FILENAME_START[delimiter_mode] in line:
-                lines.append(line.strip())
 
-    return lines
+            match = HEADING_PATTERN.fullmatch(line.decode("utf-8", errors="replace").strip())
+            if match:
+                heading = Heading(len(match.group(1)), match.group(2).strip(), line_start, position)
+                headings.headings.append(heading)
+                if until(heading):
+                    break
+        else:
+            headings.complete = True
 
+    if line_count:
+        _count_file_read(guide_file, line_count, position - headings.scanned)
+    headings.scanned = position
 
-def _list_markdown_files_in_folder(folder: Path):
-    files = []
-    for path, _, filenames in folder.walk():
-        for filename in filenames:
-            if ".md" in filename:
-                full_path = path / filename
-                files.append(full_path)
 
-    return files
+def find_heading_section(guide_file: Path, title: str) -> Tuple[int, Optional[int]]:
+    """Finds the section of the given guide file under the heading with the given title: everything from the line
+    after the heading up to the next heading of the same or a higher level.
 
+    Returns the byte offsets where the section starts and ends (None if it runs to the end of the file).
 
-def _extract_text_from_file(filename: Path, root_folder: Path) -> Iterable[str]:
-    """Finds the given file in the given folder (or subfolders) and returns its contents as a list of strings.
+    Note:
+    * Headings are remembered (by where they are in the file) for as long as the file doesn't change, so looking for
+      a section more than once only ever reads the file once. The file is only read as far as need be, too: up to the
+      end of the section, the first time round.
+    * Titles are compared case-insensitively, and the first heading with the given title is the one. Headings in fenced
+      code blocks don't count.
     """
-    # TODO: bit wasteful to walk the directory for every single call to this function
-    known_files = _list_markdown_files_in_folder(root_folder)
+    stat = guide_file.stat()
+    wanted = title.strip().casefold()
+
+    with _guide_file_headings_lock:
+        headings = _guide_file_headings.get(guide_file)
+        if headings is None or (headings.size, headings.modified) != (stat.st_size, stat.st_mtime_ns):
+            headings = _GuideFileHeadings(stat.st_size, stat.st_mtime_ns)
+            _guide_file_headings[guide_file] = headings
+
+        def find(start: int, matches) -> Optional[int]:
+            """Finds the first heading from start on that matches, scanning further into the file if need be.
+            """
+            for index in range(start, len(headings.headings)):
+                if matches(headings.headings[index]):
+                    return index
+            if not headings.complete:
+                scanned = len(headings.headings)
+                _scan_headings(guide_file, headings, matches)
+                if len(headings.headings) > scanned and matches(headings.headings[-1]):
+                    return len(headings.headings) - 1
+
+            return None
+
+        index = find(0, lambda heading: heading.title.casefold() == wanted)
+        if index is None:
+            logger.error(f"Could not find a heading called {title!r} in {guide_file}!")
+            raise ValueError
+
+        section = headings.headings[index]
+        end = find(index + 1, lambda heading: heading.level <= section.level)
+
+        return section.end_offset, headings.headings[end].offset if end is not None else None
+
+
+def extract_relevant_lines_from_guide_file(guide_file: Path,
+                                           title: str,
+                                           delimiter_mode: DelimiterMode) -> Iterable[str]:
+    """Same as extract_relevant_lines_from_index_file, but only from the section under the heading with the given title
+    (see find_heading_section), which is the only part of the file that gets read.
+    """
+    start, end = find_heading_section(guide_file, title)
+    with open(guide_file, "rb") as in_file:
+        in_file.seek(start)
+        section = in_file.read(-1 if end is None else end - start)
 
-    # Extract the complete path from the known files
-    # TODO: going from a pathlib object to string is a bit meh, surely pathlib has a cooler way of doing this.
-    full_path = [f for f in known_files if filename in str(f)]
+    lines = section.decode("utf-8").splitlines()
+    _count_file_read(guide_file, len(lines), len(section))
+    return _extract_relevant_lines(lines, delimiter_mode)
 
-    if len(full_path) != 1:
-        logger.error(f"Found an unexpected amount of full paths for filename {filename}!")
-        logger.error(f"Found: {full_path}")
-        raise ValueError
 
-    full_path = full_path[0]
+def _count_file_read(file: Path, line_count: int, byte_count: Optional[int] = None) -> None:
+    """Keeps track of files read, for instrumentation. Files are counted as read whole unless byte_count says otherwise.
+    """
+    if instrumentation.is_enabled():
+        instrumentation.count("files_read")
+        instrumentation.count("bytes_read", file.stat().st_size if byte_count is None else byte_count)
+        instrumentation.count("lines_read", line_count)
 
-    # TODO: possibly not the best way to go from text file to list of lines.
-    output = []
-    with open(full_path, "r", encoding="utf-8") as in_file:
-        for line in in_file:
-            stripped = line.strip()
-            if stripped == "":
-                # Disregard empty lines
+
+class IgnorePatterns:
+    """Which files and folders of a vault to leave out, as patterns in the style of .gitignore files.
+
+    Note:
+    * A pattern without a slash (other than at the end) matches names at any depth; any other pattern matches paths
+      relative to the root folder. * and ? never match a slash, ** matches any number of folders.
+    * A pattern ending with a slash only matches folders, and a pattern starting with ! brings back what an earlier
+      one left out. As with git, nothing in a folder that was left out can be brought back.
+    * Empty lines and lines starting with # are ignored.
+    """
+    def __init__(self, patterns: Iterable[str] = ()):
+        # (regex, negated, folders only), in order, as the last matching pattern wins.
+        self._rules: List[Tuple[re.Pattern, bool, bool]] = []
+        for pattern in patterns:
+            self.add(pattern)
+
+    def add(self, pattern: str) -> None:
+        pattern = pattern.strip()
+        if not pattern or pattern.startswith("#"):
+            return
+
+        negated = pattern.startswith("!")
+        pattern = pattern.removeprefix("!")
+        folders_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        if not pattern:
+            return
+
+        anchored = "/" in pattern
+        regex = _translate_ignore_pattern(pattern.lstrip("/"))
+        if not anchored:
+            regex = f"(?:.*/)?{regex}"
+        self._rules.append((re.compile(regex), negated, folders_only))
+
+    def read_file(self, ignore_file: Path) -> None:
+        """Adds the patterns in the given file (one per line), if there is one.
+        """
+        try:
+            with open(ignore_file, "r", encoding="utf-8") as in_file:
+                for line in in_file:
+                    self.add(line)
+        except FileNotFoundError:
+            return
+
+    def applies_to_files(self) -> bool:
+        """Returns whether any of the patterns can match files (rather than just folders).
+        """
+        return any(not folders_only for _, _, folders_only in self._rules)
+
+    def is_ignored(self, relative_path: str, is_folder: bool) -> bool:
+        """Returns whether the given path (relative to the root folder, with forward slashes) is to be left out.
+        """
+        for regex, negated, folders_only in reversed(self._rules):
+            if folders_only and not is_folder:
                 continue
+            if regex.fullmatch(relative_path):
+                return not negated
+
+        return False
+
 
-            output.append(stripped)
+def _translate_ignore_pattern(pattern: str) -> str:
+    """Turns an ignore pattern (see IgnorePatterns) into a regex.
+    """
+    output = ""
+    index = 0
+    while index < len(pattern):
+        if pattern.startswith("**/", index):
+            output += "(?:.*/)?"
+            index += 3
+        elif pattern.startswith("**", index):
+            output += ".*"
+            index += 2
+        elif pattern[index] == "*":
+            output += "[^/]*"
+            index += 1
+        elif pattern[index] == "?":
+            output += "[^/]"
+            index += 1
+        elif pattern[index] == "[" and "]" in pattern[index + 2:]:
+            end = pattern.index("]", index + 2)
+            output += "[" + pattern[index + 1:end].replace("!", "^", 1).replace("\\", "\\\\") + "]"
+            index = end + 1
+        else:
+            output += re.escape(pattern[index])
+            index += 1
 
     return output
 
 
-def extract_text_from_files(lines: Iterable[str], root_folder: Path, delimiter_mode: DelimiterMode) -> Iterable[str]:
+def _scan_folder(folder: str, relative_folder: str, ignore: IgnorePatterns) -> Tuple[List[str], List[Tuple[str, str]]]:
+    """Lists the markdown files in the given folder, and the folders in it to look into next (full and relative path).
+    """
+    files = []
+    folders = []
+    check_files = ignore.applies_to_files()
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                relative_path = f"{relative_folder}{entry.name}"
+                if not ignore.is_ignored(relative_path, True):
+                    folders.append((entry.path, f"{relative_path}/"))
+            elif entry.name.endswith(MARKDOWN_SUFFIX) and entry.is_file():
+                if not check_files or not ignore.is_ignored(f"{relative_folder}{entry.name}", False):
+                    files.append(entry.path)
+
+    return files, folders
+
+
+def scan_markdown_folder(root_folder: Path,
+                         ignore_patterns: Iterable[str] = DEFAULT_IGNORE_PATTERNS,
+                         ignore_file_name: Optional[str] = IGNORE_FILE_NAME,
+                         max_workers: int = SCAN_WORKERS) -> Tuple[List[Path], List[Path]]:
+    """Lists every markdown file in the given folder (and its subfolders), along with every folder looked into (the
+    root folder included), both sorted.
+
+    Files and folders matching ignore_patterns, or the patterns in the ignore file at the top of the root folder (if
+    there is one), are left out, ignored folders without even looking into them (see IgnorePatterns). Only files with
+    the markdown extension count, and symlinked folders aren't followed.
+
+    Folders are looked into by up to max_workers threads at the same time, which pays off for large vaults (and slow
+    disks), as os.scandir lets go of the GIL while it waits for the file system.
+
+    Note:
+    * Files showing up in (or going away from) a folder change its modification time, so the folders are all there is
+      to look at to tell whether the files listed are still the files there are (see cli.ManuscriptCache).
+    """
+    ignore = IgnorePatterns(ignore_patterns)
+    if ignore_file_name is not None:
+        ignore.read_file(root_folder / ignore_file_name)
+
+    scanned = [str(root_folder)]
+    files, pending = _scan_folder(str(root_folder), "", ignore)
+
+    # Small vaults (well, vaults without subfolders) aren't worth the threads.
+    if pending:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            scanned.extend(folder for folder, _ in pending)
+            running = {executor.submit(_scan_folder, folder, relative_folder, ignore)
+                       for folder, relative_folder in pending}
+            while running:
+                done, running = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    folder_files, folders = future.result()
+                    files.extend(folder_files)
+                    scanned.extend(folder for folder, _ in folders)
+                    running.update(executor.submit(_scan_folder, folder, relative_folder, ignore)
+                                   for folder, relative_folder in folders)
+
+    # Sorting strings is a lot cheaper than sorting paths.
+    files.sort()
+    scanned.sort()
+    return [Path(file) for file in files], [Path(folder) for folder in scanned]
+
+
+def list_markdown_files(root_folder: Path,
+                        ignore_patterns: Iterable[str] = DEFAULT_IGNORE_PATTERNS,
+                        ignore_file_name: Optional[str] = IGNORE_FILE_NAME,
+                        max_workers: int = SCAN_WORKERS) -> List[Path]:
+    """Lists every markdown file in the given folder (and its subfolders), sorted (see scan_markdown_folder).
+    """
+    return scan_markdown_folder(root_folder, ignore_patterns, ignore_file_name, max_workers)[0]
+
+
+class Vault:
+    """The markdown files in a root folder, which scene files (and notes embedded in them) are read from.
+
+    The folder is only scanned once, every file is only read once, and every embed is only resolved once, however many
+    times it shows up. Every file read is recorded in dependencies, in the order in which they were first needed.
+
+    Note:
+    * Embeds (see EMBED_PATTERN) are resolved recursively: on a line of their own, they become the lines of what they
+      embed, and in the middle of a line, those lines joined together.
+    * ![[Note#Heading]] embeds the heading and everything under it, up to the next heading of the same or a higher
+      level, as Obsidian does. Properties at the top of an embedded note are left out.
+    * A note embedding itself (however indirectly), or embeds going deeper than max_embed_depth, are errors. Embeds of
+      notes (or headings) that aren't there are only warned about, and left as they are.
+    * files, if given, are the markdown files in the root folder (see list_markdown_files), for when they've been listed
+      already (say, once for several manuscripts in the same vault) or with other ignore patterns. They're never
+      modified.
+    """
+    def __init__(self, root_folder: Path, max_embed_depth: int = MAX_EMBED_DEPTH, files: Optional[List[Path]] = None):
+        self.root_folder = root_folder
+        self.max_embed_depth = max_embed_depth
+        self.dependencies: List[Path] = []
+
+        if files is None:
+            with instrumentation.stage("import.scan_vault"):
+                files = list_markdown_files(root_folder)
+        self.files = files
+
+        # Non-empty lines of every file read so far.
+        self._lines: Dict[Path, List[str]] = {}
+        # Resolved embeds, keyed on the note and heading (if any) they embed.
+        self._embeds: Dict[Tuple[Path, Optional[str]], List[str]] = {}
+
+    def find_file(self, filename: str) -> Path:
+        """Finds the file with the given name (or part of its path) in the vault.
+        """
+        # TODO: going from a pathlib object to string is a bit meh, surely pathlib has a cooler way of doing this.
+        full_path = [f for f in self.files if filename in str(f)]
+
+        if len(full_path) != 1:
+            logger.error(f"Found an unexpected amount of full paths for filename {filename}!")
+            logger.error(f"Found: {full_path}")
+            raise ValueError
+
+        return full_path[0]
+
+    def find_note(self, name: str) -> Path:
+        """Finds the note an embed refers to, which is either its name or its path (from the root folder), with or
+        without the extension.
+        """
+        full_path = self._find_notes(name)
+
+        if len(full_path) != 1:
+            logger.error(f"Found an unexpected amount of notes called {name}!")
+            logger.error(f"Found: {full_path}")
+            raise ValueError
+
+        return full_path[0]
+
+    def _find_notes(self, name: str) -> List[Path]:
+        if not name.endswith(MARKDOWN_SUFFIX):
+            name += MARKDOWN_SUFFIX
+
+        return [f for f in self.files if f.name == name or f.as_posix().endswith(f"/{name}")]
+
+    def _read(self, full_path: Path) -> List[str]:
+        """Returns the non-empty lines of the given file (stripped), only reading it the first time round.
+        """
+        if full_path in self._lines:
+            return self._lines[full_path]
+
+        # TODO: possibly not the best way to go from text file to list of lines.
+        output = []
+        line_count = 0
+        with open(full_path, "r", encoding="utf-8") as in_file:
+            for line_count, line in enumerate(in_file, 1):
+                stripped = line.strip()
+                if stripped == "":
+                    # Disregard empty lines
+                    continue
+
+                output.append(stripped)
+
+        _count_file_read(full_path, line_count)
+        self._lines[full_path] = output
+        self.dependencies.append(full_path)
+        return output
+
+    def read_file(self, filename: str) -> List[str]:
+        """Returns the lines of the given file (see find_file), with every embed in them resolved.
+        """
+        full_path = self.find_file(filename)
+        return self._resolve_embeds(self._read(full_path), [(full_path, None)])
+
+    def _resolve_embeds(self, lines: List[str], stack: List[Tuple[Path, Optional[str]]]) -> List[str]:
+        """Replaces every embed in the given lines with what it embeds.
+
+        stack holds the notes (and headings) being embedded, outermost first, to tell cycles apart.
+        """
+        def embed_inline(match: re.Match) -> str:
+            lines = self._embed(match.group(1), match.group(2), stack) if self._is_note(match.group(1)) else None
+            return " ".join(lines) if lines is not None else match.group()
+
+        output = []
+        for line in lines:
+            if "![[" not in line:
+                output.append(line)
+                continue
+
+            match = EMBED_PATTERN.fullmatch(line)
+            if not match:
+                output.append(EMBED_PATTERN.sub(embed_inline, line))
+                continue
+
+            lines = self._embed(match.group(1), match.group(2), stack) if self._is_note(match.group(1)) else None
+            if lines is not None:
+                output.extend(lines)
+            else:
+                output.append(line)
+
+        return output
+
+    @staticmethod
+    def _is_note(name: str) -> bool:
+        suffix = Path(name).suffix
+        return suffix == "" or suffix == MARKDOWN_SUFFIX
+
+    def _embed(self,
+               name: str,
+               heading: Optional[str],
+               stack: List[Tuple[Path, Optional[str]]]) -> Optional[List[str]]:
+        """Returns the lines the given embed stands for, embeds in them resolved.
+
+        Returns None if there's no (single) note, or heading in it, for the embed to stand for.
+        """
+        full_path = self._find_notes(name.strip())
+        if len(full_path) != 1:
+            logger.warning(f"Found {len(full_path)} notes called {name.strip()} to embed, so leaving the embed be.")
+            return None
+
+        key = (full_path[0], heading.strip() if heading else None)
+        if key in self._embeds:
+            return self._embeds[key]
+
+        if key in stack:
+            logger.error(f"Found a cycle of embeds: {' -> '.join(_describe_embed(*embed) for embed in stack + [key])}")
+            raise ValueError
+
+        if len(stack) > self.max_embed_depth:
+            logger.error(f"Embeds go deeper than {self.max_embed_depth} levels at {_describe_embed(*key)}!")
+            raise ValueError
+
+        logger.debug(f"Embedding {_describe_embed(*key)}")
+        instrumentation.count("embeds_resolved")
+
+        lines = _strip_properties(self._read(key[0]))
+        if key[1] is not None:
+            lines = _extract_heading_section(lines, key[1])
+            if lines is None:
+                logger.warning(f"Could not find the heading embedded as {_describe_embed(*key)}, so leaving it be.")
+                return None
+
+        output = self._resolve_embeds(lines, stack + [key])
+        self._embeds[key] = output
+        return output
+
+
+def _describe_embed(full_path: Path, heading: Optional[str]) -> str:
+    return f"{full_path.stem}#{heading}" if heading else full_path.stem
+
+
+def _strip_properties(lines: List[str]) -> List[str]:
+    """Leaves out the properties at the top of a note, if it has any (see extract_properties).
+    """
+    if not lines or lines[0] != PROPERTIES_DELIMITER or PROPERTIES_DELIMITER not in lines[1:]:
+        return lines
+
+    return lines[lines.index(PROPERTIES_DELIMITER, 1) + 1:]
+
+
+def _extract_heading_section(lines: List[str], heading: str) -> Optional[List[str]]:
+    """Returns the given heading, and every line after it up to the next heading of the same or a higher level.
+
+    Returns None if there's no such heading.
+    """
+    for start, line in enumerate(lines):
+        match = HEADING_PATTERN.fullmatch(line)
+        if match and match.group(2).strip().casefold() == heading.casefold():
+            level = len(match.group(1))
+            break
+    else:
+        return None
+
+    for end in range(start + 1, len(lines)):
+        match = HEADING_PATTERN.fullmatch(lines[end])
+        if match and len(match.group(1)) <= level:
+            return lines[start:end]
+
+    return lines[start:]
+
+
+def _extract_text_from_file(filename: Path, root_folder: Path, vault: Optional[Vault] = None) -> Iterable[str]:
+    """Finds the given file in the given folder (or subfolders) and returns its contents as a list of strings, with any
+    embedded notes in place (see Vault).
+
+    If a vault is given, files are looked for (and read) through it.
+    """
+    if vault is None:
+        vault = Vault(root_folder)
+
+    return vault.read_file(filename)
+
+
+def extract_text_from_files(lines: Iterable[str],
+                            root_folder: Path,
+                            delimiter_mode: DelimiterMode,
+                            vault: Optional[Vault] = None) -> Iterable[str]:
     """Given a sequence of lines as extracted by extract_relevant_section, pull text out of the given filenames.
 
     This replaces (not in place) every reference to a filename in the lines with a sequence of lines that contain the
-    text.
+    text. Files are read through the given vault, if any (see Vault).
     """
+    if vault is None:
+        vault = Vault(root_folder)
+
     output = []
     for line in lines:
         if FILENAME_START[delimiter_mode] in line and FILENAME_END in line:
             filename = line.split(FILENAME_START[delimiter_mode])[-1].split(FILENAME_END)[0]
             logger.debug(f"Loading file: {filename}")
 
-            text = _extract_text_from_file(filename, root_folder)
+            text = _extract_text_from_file(filename, root_folder, vault)
 
             logger.debug(f"Loaded {len(text)} lines.")
 
@@ -313,10 +831,10 @@ def _convert_config_dict_to_object(config: dict) -> Manuscript.Config:
     return Manuscript.Config(title, author, cover, time)
 
 
-def construct_manuscript(parsed_lines: Iterable[str], config: dict) -> Manuscript:
+def construct_manuscript(parsed_lines: Iterable[str], config: dict, sources: List[Path] = None) -> Manuscript:
     """Takes a list of parsed lines and a config dict and constructs a Manuscript object.
 
     The lines MUST have been stripped of config, had any indicators replaced, etc.
-    config should be in the format returned by extract_config.
+    config should be in the format returned by extract_config, and sources are the files it all came from.
     """
-    return Manuscript(parsed_lines, _convert_config_dict_to_object(config))
+    return Manuscript(parsed_lines, _convert_config_dict_to_object(config), list(sources or []))
@@ -1,20 +1,25 @@
 from pathlib import Path
 import logging
+from typing import Optional
 
 from . import markdown_importer_innards as innards
 from ..manuscript import Manuscript
+from ..instrumentation import instrumentation
 
 logger = logging.getLogger(__name__)
 
 
-def load_manuscript_from_file(filename: Path, root_folder: Path) -> Manuscript:
+@instrumentation.timed("import.single_file")
+def load_manuscript_from_file(filename: Path, root_folder: Path, vault: Optional[innards.Vault] = None) -> Manuscript:
     # TODO: logging
 
     # The order actually matters, here, because if we replace the indicators before pulling the properties, the property
     # indicators and scene breaks get confused as Obsidian uses the same sequence of chars for both.
-    lines_with_text = innards._extract_text_from_file(filename, root_folder)
+    if vault is None:
+        vault = innards.Vault(root_folder)
+    lines_with_text = innards._extract_text_from_file(filename, root_folder, vault)
     parsed_lines, config = innards.extract_properties(lines_with_text)
     lines_with_correct_indicators = innards.replace_indicators(parsed_lines)
-    manuscript = innards.construct_manuscript(lines_with_correct_indicators, config)
+    manuscript = innards.construct_manuscript(lines_with_correct_indicators, config, vault.dependencies)
 
     return manuscript
\ No newline at end of file
@@ -0,0 +1,322 @@
+from pathlib import Path
+import contextlib
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StageRecord:
+    """One run of a stage: what it was, when it started (in seconds, since recording started) and how long it took.
+
+    thread is the thread it ran in, and args anything else worth knowing about it (e.g. the file it read).
+
+    If memory was being tracked (see enable), python_peak is the most memory (in bytes) Python had allocated while the
+    stage ran on top of what was already allocated when it started (i.e. what the stage itself needed, and what it
+    would need all over again if it ran again), and child_peak_rss the largest resident set size (in bytes) of any
+    external tool that ran during it (0 if none did). Otherwise, both are None.
+    """
+    name: str
+    category: str
+    start: float
+    duration: float
+    thread: int
+    args: dict = field(default_factory=dict)
+    python_peak: Optional[int] = None
+    child_peak_rss: Optional[int] = None
+
+
+class Recorder:
+    """Collects stages and counters, from any thread.
+
+    If track_memory is set, stages also keep track of how much memory they needed (see StageRecord).
+    """
+    def __init__(self, track_memory: bool = False):
+        self.origin = time.perf_counter()
+        self.stages: List[StageRecord] = []
+        self.counters: Dict[str, float] = {}
+        self.track_memory = track_memory
+        self._lock = threading.Lock()
+        # Memory allocated when every stage running right now started, and its peaks so far (Python, external tools),
+        # keyed on a token per stage.
+        self._open_stages: Dict[int, List[int]] = {}
+        self._next_token = 0
+        self._started_tracemalloc = False
+
+    def add_stage(self, record: StageRecord) -> None:
+        with self._lock:
+            self.stages.append(record)
+
+    def count(self, name: str, amount: float) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def _sample_python_memory(self) -> int:
+        """Hands the peak of memory allocated since the last sample to every stage running right now, and starts over.
+
+        Returns how much is allocated right now. Must be called with the lock held.
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for memory in self._open_stages.values():
+            memory[1] = max(memory[1], peak)
+
+        return current
+
+    def open_stage(self) -> int:
+        """Starts tracking the memory of a stage, returning the token to close it with.
+        """
+        with self._lock:
+            current = self._sample_python_memory()
+            token = self._next_token
+            self._next_token += 1
+            self._open_stages[token] = [current, current, 0]
+
+        return token
+
+    def close_stage(self, token: int) -> Tuple[int, int]:
+        """Stops tracking the memory of a stage, returning its peaks: Python's and that of external tools.
+        """
+        with self._lock:
+            self._sample_python_memory()
+            start, python_peak, child_peak_rss = self._open_stages.pop(token)
+
+        return python_peak - start, child_peak_rss
+
+    def record_child_rss(self, rss: int) -> None:
+        """Records the resident set size of an external tool, for every stage running right now.
+        """
+        with self._lock:
+            for memory in self._open_stages.values():
+                memory[2] = max(memory[2], rss)
+
+    def snapshot(self) -> Tuple[List[StageRecord], Dict[str, float]]:
+        """Returns copies of the stages and counters recorded so far.
+        """
+        with self._lock:
+            return list(self.stages), dict(self.counters)
+
+    def summarize(self) -> Dict[str, dict]:
+        """Sums up the stages by name: how often each ran, and for how long in total.
+
+        If memory was tracked, also the highest peaks of any of the runs (see StageRecord).
+        """
+        summary = {}
+        stages, _ = self.snapshot()
+        for record in stages:
+            entry = summary.setdefault(record.name, {"count": 0, "seconds": 0.0})
+            entry["count"] += 1
+            entry["seconds"] += record.duration
+            if record.python_peak is not None:
+                entry["python_peak"] = max(entry.get("python_peak", 0), record.python_peak)
+                entry["child_peak_rss"] = max(entry.get("child_peak_rss", 0), record.child_peak_rss)
+
+        return summary
+
+
+# Recording is off unless someone turns it on, in which case this holds the Recorder.
+_recorder: Optional[Recorder] = None
+
+# What stage() hands out when recording is off. It does nothing, and is the same object every time, so that
+# instrumented code costs next to nothing when nobody is looking.
+_NO_STAGE = contextlib.nullcontext()
+
+
+def enable(track_memory: bool = False) -> Recorder:
+    """Starts recording stages and counters (from scratch), returning the Recorder they go into.
+
+    If track_memory is set, the memory every stage needed is recorded too (see StageRecord). That means tracing every
+    allocation Python makes (with tracemalloc), which makes everything quite a bit slower, so it's best left for when
+    memory is what's being looked at.
+    """
+    global _recorder
+    disable()
+
+    recorder = Recorder(track_memory)
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        recorder._started_tracemalloc = True
+
+    _recorder = recorder
+    return recorder
+
+
+def disable() -> Optional[Recorder]:
+    """Stops recording, returning the Recorder that was in use (if any).
+    """
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is not None and recorder._started_tracemalloc:
+        tracemalloc.stop()
+
+    return recorder
+
+
+def is_enabled() -> bool:
+    return _recorder is not None
+
+
+def is_tracking_memory() -> bool:
+    recorder = _recorder
+    return recorder is not None and recorder.track_memory
+
+
+@contextlib.contextmanager
+def _record_stage(recorder: Recorder, name: str, category: str, args: dict) -> Iterator[None]:
+    token = recorder.open_stage() if recorder.track_memory else None
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        python_peak, child_peak_rss = recorder.close_stage(token) if token is not None else (None, None)
+        recorder.add_stage(StageRecord(name,
+                                       category,
+                                       start - recorder.origin,
+                                       duration,
+                                       threading.get_ident(),
+                                       args,
+                                       python_peak,
+                                       child_peak_rss))
+
+
+def stage(name: str, category: str = "stage", **args):
+    """Times whatever runs inside the returned context manager as the given stage, if recording is on.
+
+    Stages can nest (and usually do, e.g. import > reading files).
+    """
+    recorder = _recorder
+    if recorder is None:
+        return _NO_STAGE
+
+    return _record_stage(recorder, name, category, args)
+
+
+def timed(name: str, category: str = "stage"):
+    """Decorates a function (or coroutine function) so that every call to it is timed as the given stage.
+    """
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name, category):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name, category):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, amount: float = 1) -> None:
+    """Adds the given amount to the given counter, if recording is on.
+    """
+    recorder = _recorder
+    if recorder is not None:
+        recorder.count(name, amount)
+
+
+def record_child_rss(rss: int) -> None:
+    """Records the resident set size (in bytes) of an external tool, if memory is being tracked.
+    """
+    recorder = _recorder
+    if recorder is not None and recorder.track_memory:
+        recorder.record_child_rss(rss)
+
+
+def exceeded_memory_budgets(recorder: Recorder, budgets: Dict[str, int]) -> List[str]:
+    """Checks the memory stages needed against the given budgets (in bytes, by stage name), which count against the
+    higher of the Python peak and the external tools' peak of any run of the stage.
+
+    Returns what went over budget, one line per stage. Stages that never ran go over any budget, as a budget for them is
+    most likely a mistake.
+    """
+    summary = recorder.summarize()
+    output = []
+    for name, budget in budgets.items():
+        if name not in summary:
+            output.append(f"{name}: never ran")
+            continue
+
+        peak = max(summary[name].get("python_peak", 0), summary[name].get("child_peak_rss", 0))
+        if peak > budget:
+            output.append(f"{name}: needed {peak / 2**20:.1f}MiB, over its budget of {budget / 2**20:.1f}MiB")
+
+    return output
+
+
+def to_json(recorder: Recorder) -> dict:
+    """Puts everything the given recorder saw into a JSON-friendly dictionary.
+    """
+    stages, counters = recorder.snapshot()
+    return {"stages": [asdict(record) for record in stages],
+            "counters": counters,
+            "summary": recorder.summarize()}
+
+
+def write_json(recorder: Recorder, out_file: Path) -> None:
+    """Writes everything the given recorder saw into the given file, as JSON.
+    """
+    with open(out_file, "w", encoding="utf-8") as out:
+        json.dump(to_json(recorder), out, indent=2, default=str)
+
+    logger.info(f"Wrote stats: {out_file}")
+
+
+def _trace_args(record: StageRecord) -> dict:
+    """What goes into the args of a stage's trace event: its own, and its memory peaks (if tracked).
+    """
+    if record.python_peak is None:
+        return record.args
+
+    return {**record.args, "python_peak": record.python_peak, "child_peak_rss": record.child_peak_rss}
+
+
+def to_chrome_trace(recorder: Recorder) -> dict:
+    """Converts everything the given recorder saw into the Chrome trace event format (as in chrome://tracing, Perfetto).
+
+    Stages become complete ("X") events, and counters a counter ("C") event with their totals at the very end.
+    """
+    pid = os.getpid()
+    events = []
+    end = 0.0
+    stages, counters = recorder.snapshot()
+    for record in stages:
+        events.append({"name": record.name,
+                       "cat": record.category,
+                       "ph": "X",
+                       "ts": record.start * 1e6,
+                       "dur": record.duration * 1e6,
+                       "pid": pid,
+                       "tid": record.thread,
+                       "args": {key: str(value) for key, value in _trace_args(record).items()}})
+        end = max(end, record.start + record.duration)
+
+    if counters:
+        events.append({"name": "counters", "ph": "C", "ts": end * 1e6, "pid": pid, "args": counters})
+
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_chrome_trace(recorder: Recorder, out_file: Path) -> None:
+    """Writes everything the given recorder saw into the given file, in the Chrome trace event format.
+    """
+    with open(out_file, "w", encoding="utf-8") as out:
+        json.dump(to_chrome_trace(recorder), out)
+
+    logger.info(f"Wrote trace: {out_file}")
@@ -2,7 +2,7 @@
 from __future__ import annotations
 
 from pathlib import Path
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import datetime
 from typing import List, Union
 
@@ -91,3 +91,6 @@ class Manuscript:
     # Lastly, the things that this actually contains.
     content: Content
     config: Config
+    # The files the manuscript was imported from (notes embedded in them included), for whoever needs to know when it
+    # has to be imported again.
+    sources: List[Path] = field(default_factory=list)
@@ -0,0 +1 @@
+from .page_count import *
\ No newline at end of file
@@ -0,0 +1,442 @@
+from pathlib import Path
+import logging
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from ..manuscript import Manuscript
+from ..instrumentation import instrumentation
+from ..exporters import latex_pdf_exporter_innards as latex_innards
+
+logger = logging.getLogger(__name__)
+
+# TeX points in every unit a template might use.
+POINTS_PER_UNIT = {"pt": 1.0, "bp": 72.27 / 72, "pc": 12.0, "in": 72.27, "cm": 72.27 / 2.54, "mm": 72.27 / 25.4}
+
+# Paper sizes (width, height) by their LaTeX (and geometry) option, in points.
+PAPER_SIZES = {
+    "a4paper": (210 * POINTS_PER_UNIT["mm"], 297 * POINTS_PER_UNIT["mm"]),
+    "a5paper": (148 * POINTS_PER_UNIT["mm"], 210 * POINTS_PER_UNIT["mm"]),
+    "a6paper": (105 * POINTS_PER_UNIT["mm"], 148 * POINTS_PER_UNIT["mm"]),
+    "b5paper": (176 * POINTS_PER_UNIT["mm"], 250 * POINTS_PER_UNIT["mm"]),
+    "letterpaper": (8.5 * POINTS_PER_UNIT["in"], 11 * POINTS_PER_UNIT["in"]),
+    "legalpaper": (8.5 * POINTS_PER_UNIT["in"], 14 * POINTS_PER_UNIT["in"]),
+    "executivepaper": (7.25 * POINTS_PER_UNIT["in"], 10.5 * POINTS_PER_UNIT["in"]),
+}
+DEFAULT_PAPER = "letterpaper"
+
+# The \baselineskip of the standard classes, by font size (in points).
+BASELINE_SKIPS = {10: 12.0, 11: 13.6, 12: 14.5}
+DEFAULT_FONT_SIZE = 10
+
+# How much of the paper geometry leaves to the text, in either direction, when it isn't told otherwise.
+DEFAULT_TEXT_SCALE = 0.7
+
+# Classes whose chapters start on a new page, and those whose chapters (and parts) start on a right-hand page unless
+# told otherwise (with "openany").
+NEW_PAGE_CLASSES = {"book", "report", "memoir", "scrbook", "scrreprt"}
+OPEN_RIGHT_CLASSES = {"book", "memoir", "scrbook"}
+TWO_SIDE_CLASSES = {"book", "memoir", "scrbook"}
+
+# How tall the book class makes chapter headings (numbered or not) at 10pt, blank space included, in points.
+NUMBERED_CHAPTER_HEAD_HEIGHT = 165.0
+UNNUMBERED_CHAPTER_HEAD_HEIGHT = 120.0
+
+# How many lines a scene break (a horizontal rule, centred) takes up.
+SCENE_BREAK_LINES = 2
+
+# The average width of a character of prose (spaces included), in ems. Calibrating (see calibrate) takes care of fonts
+# that are wider or narrower than that.
+AVERAGE_CHARACTER_WIDTH = 0.5
+
+# Calibrations that would make the text more than this many times denser (or sparser) than the template says are more
+# likely to come from a build of a very different manuscript than from the fonts, so they're left alone.
+MAX_CALIBRATION_SCALE = 4.0
+
+LATEX_COMMENT_PATTERN = re.compile(r"(?<!\\)%.*")
+DOCUMENT_CLASS_PATTERN = re.compile(r"\\documentclass\s*(?:\[([^\]]*)\])?\s*\{(\w+)\}")
+GEOMETRY_PATTERN = re.compile(r"\\geometry\s*\{([^}]*)\}|\\usepackage\s*\[([^\]]*)\]\s*\{geometry\}")
+SPACING_PATTERN = re.compile(r"\\begin\{spacing\}\{([\d.]+)\}|\\(onehalfspacing|doublespacing)")
+SPACING_COMMANDS = {"onehalfspacing": 1.25, "doublespacing": 1.667}
+PARSKIP_PATTERN = re.compile(r"\\usepackage\s*(?:\[[^\]]*\])?\s*\{[^}]*\bparskip\b[^}]*\}")
+TITLE_PAGE_PATTERN = re.compile(r"\\begin\{titlepage\}")
+LENGTH_PATTERN = re.compile(r"\s*(-?[\d.]+)\s*(pt|bp|pc|in|cm|mm)\s*")
+
+# Where the page numbers are in what a build leaves behind: the page a table of contents entry is on, the page counter
+# at the end of an \include-d file, and how many pages the PDF ended up with.
+TOC_PAGE_PATTERN = re.compile(r"\{(\d+)\}(?:\{[^{}]*\})?$")
+CHECKPOINT_PAGE_PATTERN = re.compile(r"\\setcounter\{page\}\{(\d+)\}")
+LOG_PAGES_PATTERN = re.compile(r"Output written on .*?\((\d+) pages?")
+
+
+@dataclass
+class PageLayout:
+    """What a LaTeX template does with the pages of a book, as far as counting them goes. Lengths are in points.
+
+    Note:
+    * line_spread stretches the lines (as setspace does), but not the space between paragraphs (paragraph_skip).
+    * If chapters_open_right is set, chapters (and parts) start on a right-hand (odd) page, with a blank page before
+      them if need be, and parts are followed by a blank page.
+    * The body of the book starts on first_page (as numbered in the book), and extra_pages are any other pages of the
+      PDF that aren't numbered along with it (like the title page of a one-sided book). If ends_on_even_page is set, a
+      blank page follows the body if need be.
+    """
+    paper_width: float
+    paper_height: float
+    top: float
+    bottom: float
+    left: float
+    right: float
+    font_size: int = DEFAULT_FONT_SIZE
+    line_spread: float = 1.0
+    paragraph_skip: float = 0.0
+    chapters_new_page: bool = True
+    chapters_open_right: bool = True
+    two_side: bool = True
+    first_page: int = 1
+    extra_pages: int = 0
+    ends_on_even_page: bool = False
+
+    @property
+    def text_width(self) -> float:
+        return self.paper_width - self.left - self.right
+
+    @property
+    def text_height(self) -> float:
+        return self.paper_height - self.top - self.bottom
+
+    @property
+    def baseline_skip(self) -> float:
+        return BASELINE_SKIPS.get(self.font_size, 1.2 * self.font_size) * self.line_spread
+
+    @property
+    def characters_per_line(self) -> float:
+        return self.text_width / (self.font_size * AVERAGE_CHARACTER_WIDTH)
+
+
+@dataclass
+class Calibration:
+    """How a previous build differed from what the layout says (see calibrate).
+
+    scale is how many times more room the text of the manuscript took up than estimated, and extra_pages how many pages
+    the PDF had besides the body of the book.
+    """
+    scale: float = 1.0
+    extra_pages: Optional[int] = None
+
+
+@dataclass
+class SectionEstimate:
+    """How many pages a section of the book (see latex_pdf_exporter_innards.split_content_into_chapters) takes up.
+
+    start_page is the page it starts on (its heading, for chapters and parts), as numbered in the book, and pages counts
+    every page from there to the end of the section. blank_pages are the blank pages right before it, if any.
+    """
+    index: int
+    title: Optional[str]
+    start_page: int
+    pages: int
+    blank_pages: int = 0
+
+
+@dataclass
+class PageEstimate:
+    """How many pages a manuscript would take up, all in all and section by section.
+    """
+    sections: List[SectionEstimate] = field(default_factory=list)
+    total_pages: int = 0
+    scale: float = 1.0
+
+
+def _to_points(length: str) -> Optional[float]:
+    match = LENGTH_PATTERN.fullmatch(length)
+    if not match:
+        return None
+
+    return float(match.group(1)) * POINTS_PER_UNIT[match.group(2)]
+
+
+def _parse_options(options: str) -> Dict[str, Optional[str]]:
+    """Splits LaTeX options ("a5paper, margin=2cm") into a dictionary, flags having None as their value.
+    """
+    output = {}
+    for option in options.split(","):
+        key, _, value = option.partition("=")
+        if key.strip():
+            output[key.strip()] = value.strip() if value else None
+
+    return output
+
+
+def read_layout(template: Path) -> PageLayout:
+    """Works out the page layout of the given template: paper size, margins, font size, line spacing, and how chapters
+    start.
+
+    Note:
+    * This understands the options of \\documentclass, geometry (paper sizes, margins, and paperwidth/paperheight),
+      setspace (\\begin{spacing}, \\onehalfspacing and \\doublespacing) and parskip. Anything else is taken to be as
+      LaTeX would have it by default.
+    * Every titlepage environment is taken to be a page before the body of the book. Title pages only reset the page
+      counter in one-sided books, so in two-sided ones, the body starts on the page after them.
+    """
+    text = LATEX_COMMENT_PATTERN.sub("", template.read_text(encoding="utf8"))
+
+    document_class = DOCUMENT_CLASS_PATTERN.search(text)
+    class_options = _parse_options(document_class.group(1) or "") if document_class else {}
+    class_name = document_class.group(2) if document_class else "book"
+
+    geometry = {}
+    for match in GEOMETRY_PATTERN.finditer(text):
+        geometry.update(_parse_options(match.group(1) or match.group(2)))
+
+    paper = next((option for option in list(geometry) + list(class_options) if option in PAPER_SIZES), DEFAULT_PAPER)
+    paper_width, paper_height = PAPER_SIZES[paper]
+    paper_width = _to_points(geometry.get("paperwidth") or "") or paper_width
+    paper_height = _to_points(geometry.get("paperheight") or "") or paper_height
+    if "landscape" in geometry or "landscape" in class_options:
+        paper_width, paper_height = paper_height, paper_width
+
+    def margin(*keys: str, default: float) -> float:
+        for key in keys:
+            length = _to_points(geometry.get(key) or "")
+            if length is not None:
+                return length
+
+        return default
+
+    horizontal = paper_width * (1 - DEFAULT_TEXT_SCALE) / 2
+    vertical = paper_height * (1 - DEFAULT_TEXT_SCALE) / 2
+    font_size = next((int(option[:-2]) for option in class_options if option in ("10pt", "11pt", "12pt")),
+                     DEFAULT_FONT_SIZE)
+
+    line_spread = 1.0
+    spacing = SPACING_PATTERN.search(text)
+    if spacing:
+        line_spread = float(spacing.group(1)) if spacing.group(1) else SPACING_COMMANDS[spacing.group(2)]
+
+    two_side = "twoside" in class_options or (class_name in TWO_SIDE_CLASSES and "oneside" not in class_options)
+    open_right = "openright" in class_options or (class_name in OPEN_RIGHT_CLASSES and "openany" not in class_options)
+    title_pages = len(TITLE_PAGE_PATTERN.findall(text))
+    _, _, after_body = text.partition(latex_innards.LATEX_FILE_LOCATION)
+
+    return PageLayout(paper_width=paper_width,
+                      paper_height=paper_height,
+                      top=margin("top", "tmargin", "vmargin", "margin", default=vertical),
+                      bottom=margin("bottom", "bmargin", "vmargin", "margin", default=vertical),
+                      left=margin("left", "lmargin", "inner", "hmargin", "margin", default=horizontal),
+                      right=margin("right", "rmargin", "outer", "hmargin", "margin", default=horizontal),
+                      font_size=font_size,
+                      line_spread=line_spread,
+                      paragraph_skip=BASELINE_SKIPS.get(font_size, 1.2 * font_size) / 2
+                      if PARSKIP_PATTERN.search(text) else 0.0,
+                      chapters_new_page=class_name in NEW_PAGE_CLASSES,
+                      # \cleardoublepage is just \clearpage in one-sided books.
+                      chapters_open_right=open_right and two_side and class_name in NEW_PAGE_CLASSES,
+                      two_side=two_side,
+                      first_page=1 + title_pages if two_side else 1,
+                      extra_pages=0 if two_side else title_pages,
+                      ends_on_even_page=two_side and "\\cleardoublepage" in after_body)
+
+
+def _measure_section(section: Manuscript.Content, layout: PageLayout) -> Tuple[float, float, int]:
+    """Measures a section of the book, in points: how tall its text is and how tall its chapter heading is.
+
+    Also returns how many pages its part (if it starts with one) takes up.
+    """
+    text = 0.0
+    heading = 0.0
+    part_pages = 0
+    characters_per_line = layout.characters_per_line
+    font_scale = layout.font_size / DEFAULT_FONT_SIZE
+
+    for line in section:
+        if isinstance(line, Manuscript.StartPart):
+            part_pages += 2 if layout.chapters_open_right and layout.two_side else 1
+        elif isinstance(line, Manuscript.StartChapter):
+            if line.config.numbered:
+                heading += NUMBERED_CHAPTER_HEAD_HEIGHT * font_scale
+            else:
+                heading += UNNUMBERED_CHAPTER_HEAD_HEIGHT * font_scale
+        elif isinstance(line, Manuscript.BreakScene):
+            text += SCENE_BREAK_LINES * layout.baseline_skip + layout.paragraph_skip
+        else:
+            lines = max(1, math.ceil(len(line) / characters_per_line))
+            text += lines * layout.baseline_skip + layout.paragraph_skip
+
+    return text, heading, part_pages
+
+
+def _section_title(section: Manuscript.Content) -> Optional[str]:
+    for line in section:
+        if isinstance(line, (Manuscript.StartPart, Manuscript.StartChapter)):
+            return line.config.title
+
+    return None
+
+
+def _starts_new_page(section: Manuscript.Content, layout: PageLayout) -> bool:
+    return bool(section) and (isinstance(section[0], Manuscript.StartPart)
+                              or (isinstance(section[0], Manuscript.StartChapter) and layout.chapters_new_page))
+
+
+@instrumentation.timed("page_count")
+def estimate_pages(manuscript: Manuscript,
+                   layout: PageLayout,
+                   calibration: Optional[Calibration] = None) -> PageEstimate:
+    """Estimates how many pages the given manuscript would take up with the given layout (see read_layout), without
+    running LaTeX, section by section (see latex_pdf_exporter_innards.split_content_into_chapters).
+
+    Note:
+    * Text is laid out a line at a time, with a set number of characters per line (from the width of the text and the
+      size of the font), so the estimate is only as good as the average width of a character. A calibration (see
+      calibrate) makes up for that.
+    * Sections starting with a part or a chapter start on a new page, as the template would have them, blank page and
+      all. Any other section carries on from the one before.
+    """
+    calibration = calibration or Calibration()
+    estimate = PageEstimate(scale=calibration.scale)
+    # Where the last section left off: the page it ended on, and how far down that page.
+    page = layout.first_page
+    position = 0.0
+
+    for index, section in enumerate(latex_innards.split_content_into_chapters(manuscript.content)):
+        text, heading, part_pages = _measure_section(section, layout)
+        new_page = _starts_new_page(section, layout)
+        if position >= layout.text_height or (new_page and position > 0):
+            page += 1
+            position = 0.0
+
+        blank_pages = 0
+        if new_page and layout.chapters_open_right and page % 2 == 0:
+            page += 1
+            blank_pages = 1
+
+        start_page = page
+        page += part_pages
+        position += heading + text * calibration.scale
+        overflow = math.ceil(position / layout.text_height) - 1 if position > 0 else 0
+        page += overflow
+        position -= overflow * layout.text_height
+
+        if part_pages and not text and not heading:
+            # A part on its own: whatever comes next starts on a page of its own anyway.
+            page -= 1
+            position = layout.text_height
+
+        estimate.sections.append(SectionEstimate(index,
+                                                 _section_title(section),
+                                                 start_page,
+                                                 page - start_page + 1,
+                                                 blank_pages))
+
+    if layout.ends_on_even_page and page % 2:
+        page += 1
+
+    extra_pages = calibration.extra_pages if calibration.extra_pages is not None else layout.extra_pages
+    estimate.total_pages = (page if estimate.sections else 0) + extra_pages
+    return estimate
+
+
+def read_build_pages(out_directory: Path,
+                     section_count: int,
+                     latex_filename: str) -> Tuple[Dict[int, Tuple[Optional[int], int]], Optional[int]]:
+    """Reads the page numbers a previous build (into out_directory) left behind in its .aux and .log files.
+
+    Returns, for every section that has an .aux file, the page its first table of contents entry was on (if it has
+    any) and the page it ended on. Also returns how many pages the PDF had, if the .log file says.
+    """
+    sections = {}
+    for index in range(section_count):
+        aux_file = (out_directory / latex_innards.get_chapter_include_name(index)).with_suffix(".aux")
+        try:
+            aux = aux_file.read_text(encoding="utf8", errors="replace")
+        except FileNotFoundError:
+            continue
+
+        toc_page = None
+        for line in aux.splitlines():
+            toc_line = latex_innards.AUX_TOC_LINE_PATTERN.match(line)
+            page = TOC_PAGE_PATTERN.search(toc_line.group(1)) if toc_line else None
+            if page:
+                toc_page = int(page.group(1))
+                break
+
+        # The page counter is saved at the end of the section, after a \clearpage, so it's already on the next page.
+        checkpoint = CHECKPOINT_PAGE_PATTERN.search(aux)
+        if checkpoint is not None:
+            sections[index] = (toc_page, int(checkpoint.group(1)) - 1)
+
+    total_pages = None
+    log_file = (out_directory / Path(latex_filename).stem).with_suffix(".log")
+    if log_file.exists():
+        # TeX wraps the lines of its log, so they're glued back together first.
+        log = log_file.read_text(encoding="utf8", errors="replace").replace("\n", "")
+        match = LOG_PAGES_PATTERN.search(log)
+        if match:
+            total_pages = int(match.group(1))
+
+    return sections, total_pages
+
+
+def calibrate(manuscript: Manuscript,
+              layout: PageLayout,
+              out_directory: Path,
+              latex_filename: str = "output.tex") -> Calibration:
+    """Works out how far off the estimates (see estimate_pages) were for a previous build of the manuscript into
+    out_directory, from the page numbers LaTeX left in its .aux and .log files, so later estimates can make up for it.
+
+    Note:
+    * The scale is the one that best fits the pages of every section (that starts with a part or a chapter) to the
+      pages they took up in the build, in the least squares sense.
+    * Sections are matched up by their position in the book, so the closer the manuscript is to the one that was built,
+      the better. If nothing can be matched up, the calibration changes nothing.
+    """
+    sections = latex_innards.split_content_into_chapters(manuscript.content)
+    build_pages, total_pages = read_build_pages(out_directory, len(sections), latex_filename)
+
+    products = 0.0
+    squares = 0.0
+    for index, (toc_page, end_page) in build_pages.items():
+        if toc_page is None or not _starts_new_page(sections[index], layout):
+            continue
+
+        text, heading, part_pages = _measure_section(sections[index], layout)
+        # Pages from the heading onwards, less what doesn't depend on the text (rounding up to a whole page included).
+        measured = text / layout.text_height
+        pages = end_page - toc_page + 1 - part_pages - heading / layout.text_height - 0.5
+        products += measured * pages
+        squares += measured * measured
+
+    calibration = Calibration()
+    if squares > 0:
+        scale = products / squares
+        if 1 / MAX_CALIBRATION_SCALE <= scale <= MAX_CALIBRATION_SCALE:
+            calibration.scale = scale
+        else:
+            logger.warning(f"Ignoring a calibration scale of {scale:.2f}, as the build in {out_directory} doesn't look "
+                           f"like it's of this manuscript.")
+
+    if total_pages is not None and build_pages:
+        last_page = max(end_page for _, end_page in build_pages.values())
+        if layout.ends_on_even_page and last_page % 2:
+            last_page += 1
+        calibration.extra_pages = total_pages - last_page
+
+    logger.info(f"Calibrated against {len(build_pages)} section(s) of the build in {out_directory}: scale "
+                f"{calibration.scale:.2f}, {calibration.extra_pages} extra page(s).")
+    return calibration
+
+
+def describe_estimate(estimate: PageEstimate) -> List[str]:
+    """Sums up an estimate: where every section starts and how many pages it takes up, and the total.
+    """
+    lines = []
+    for section in estimate.sections:
+        blank = f" (after {section.blank_pages} blank)" if section.blank_pages else ""
+        lines.append(f"{section.index}: {section.title or '(untitled)'}: {section.pages} page(s) from page "
+                     f"{section.start_page}{blank}")
+
+    calibrated = f" (calibrated, scale {estimate.scale:.2f})" if estimate.scale != 1.0 else ""
+    lines.append(f"About {estimate.total_pages} pages in all{calibrated}.")
+    return lines
@@ -0,0 +1 @@
+from .preview import *
\ No newline at end of file
@@ -0,0 +1,331 @@
+from pathlib import Path
+import hashlib
+import html
+import http.server
+import json
+import logging
+import queue
+import threading
+import urllib.parse
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from ..manuscript import Manuscript
+from ..instrumentation import instrumentation
+from ..exporters import epub_exporter_innards as innards
+
+logger = logging.getLogger(__name__)
+
+HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+
+# How often (in seconds) the manuscript is checked for changes, and how long an idle event stream goes without a
+# keepalive (so streams of browsers that went away get noticed, and closed).
+POLL_INTERVAL = 0.25
+KEEPALIVE_INTERVAL = 15.0
+
+# Where everything is served. Chapters go one level down, as the EPUB renderer points them at ../stylesheet.css and
+# ../media/..., which is where the stylesheet and the media are.
+INDEX_PATH = "/"
+CHAPTER_PATH = "/text/chapter_{index:03d}.html"
+STYLESHEET_PATH = "/" + innards.STYLESHEET_FILE
+EVENTS_PATH = "/events"
+
+STYLESHEET = innards.STYLESHEET + """nav.preview { margin: 2em 0; text-align: center; font-family: sans-serif; }
+nav.preview a { margin: 0 1em; }
+"""
+
+# Every page listens to the events, which are lists of the pages that changed, and reloads itself if it's one of them.
+# Browsers keep the scroll position when reloading, so writers stay where they were.
+RELOAD_SCRIPT = f"""<script>
+new EventSource("{EVENTS_PATH}").onmessage = function (event) {{
+  if (JSON.parse(event.data).indexOf(location.pathname) >= 0) {{
+    location.reload();
+  }}
+}};
+</script>
+"""
+
+UNTITLED = "(Untitled)"
+
+# Loads the current version of the manuscript. Returning the very same object as last time means nothing changed.
+ManuscriptLoader = Callable[[], Manuscript]
+
+
+@dataclass
+class _Page:
+    """A rendered page, along with a hash of everything that went into it (so it's only rendered again if that
+    changes).
+    """
+    content_hash: str
+    content: bytes
+
+
+class Preview:
+    """Keeps every chapter of a manuscript rendered into an HTML page, rendering them again as the manuscript changes.
+
+    Note:
+    * Chapters are rendered as they would be in an EPUB (see epub_exporter_innards.render_chapter), which is nowhere near
+      as long as a PDF takes, and only the chapters that changed are rendered again (see refresh).
+    * Pages can be read from any thread, but only one thread should refresh (see watch).
+    """
+    def __init__(self, load: ManuscriptLoader, illustration_dir: Path, language: str = "en"):
+        self._load = load
+        self.illustration_dir = illustration_dir
+        self.language = language
+
+        self._manuscript: Optional[Manuscript] = None
+        self._pages: Dict[str, _Page] = {}
+        self._media: Dict[str, innards.EpubMedia] = {}
+        self._listeners: List[queue.Queue] = []
+        self._lock = threading.Lock()
+
+    def _render_chapter(self,
+                        chapter: Manuscript.Content,
+                        index: int,
+                        number: Optional[int],
+                        is_last: bool,
+                        media: Dict[str, innards.EpubMedia]) -> str:
+        document = "".join(innards.render_chapter(chapter, number, self.language, self.illustration_dir, media))
+
+        links = [f'<a href="{CHAPTER_PATH.format(index=index - 1)}">Previous</a>'] if index > 0 else []
+        links.append(f'<a href="{INDEX_PATH}">Contents</a>')
+        if not is_last:
+            links.append(f'<a href="{CHAPTER_PATH.format(index=index + 1)}">Next</a>')
+
+        body, end, rest = document.rpartition("</body>")
+        return f'{body}<nav class="preview">{"".join(links)}</nav>\n{RELOAD_SCRIPT}{end}{rest}'
+
+    def _render_index(self, title: str, entries: List[Tuple[Optional[str], Optional[int]]]) -> str:
+        items = []
+        for index, (chapter_title, number) in enumerate(entries):
+            if chapter_title:
+                text = innards.convert_inline_markdown_to_xhtml(chapter_title)
+                if number is not None:
+                    text = f"{number}. {text}"
+            else:
+                text = f"Chapter {number}" if number is not None else UNTITLED
+            items.append(f'<li><a href="{CHAPTER_PATH.format(index=index)}">{text}</a></li>\n')
+
+        return (innards.XHTML_HEADER.format(language=self.language,
+                                            title=html.escape(title),
+                                            stylesheet=STYLESHEET_PATH,
+                                            body_attributes="")
+                + f"<h1>{html.escape(title)}</h1>\n<ol>\n{''.join(items)}</ol>\n"
+                + RELOAD_SCRIPT
+                + innards.XHTML_FOOTER)
+
+    @instrumentation.timed("preview.render")
+    def _render(self, manuscript: Manuscript) -> Tuple[Dict[str, _Page], Dict[str, innards.EpubMedia], List[str]]:
+        """Renders the pages of the given manuscript, reusing the ones (rendered before) that haven't changed.
+
+        Returns the pages, the media they use (keyed on where they're served) and the pages that changed, removed ones
+        included.
+        """
+        with self._lock:
+            previous = self._pages
+
+        pages = {}
+        media: Dict[str, innards.EpubMedia] = {}
+        entries = []
+        chapters = list(innards.split_content_into_chapters(manuscript.content))
+        chapter_count = 0
+        rendered = 0
+
+        for index, chapter in enumerate(chapters):
+            title = None
+            number = None
+            if isinstance(chapter[0], Manuscript.StartChapter):
+                title = chapter[0].config.title
+                if chapter[0].config.numbered:
+                    chapter_count += 1
+                    number = chapter_count
+            entries.append((title, number))
+
+            # The links at the bottom of the page depend on whether there's a next chapter.
+            is_last = index == len(chapters) - 1
+            media_names = innards.collect_chapter_media(chapter, self.illustration_dir, media)
+            content_hash = f"{innards.hash_chapter(chapter, number, self.language, media_names)}:{is_last}"
+
+            path = CHAPTER_PATH.format(index=index)
+            page = previous.get(path)
+            if page is None or page.content_hash != content_hash:
+                page = _Page(content_hash,
+                             self._render_chapter(chapter, index, number, is_last, media).encode("utf-8"))
+                rendered += 1
+            pages[path] = page
+
+        title = manuscript.config.title if manuscript.config is not None else ""
+        index_hash = hashlib.sha256(repr((title, self.language, entries)).encode("utf-8")).hexdigest()
+        page = previous.get(INDEX_PATH)
+        if page is None or page.content_hash != index_hash:
+            page = _Page(index_hash, self._render_index(title, entries).encode("utf-8"))
+        pages[INDEX_PATH] = page
+
+        changed = [path for path in dict.fromkeys([*pages, *previous]) if pages.get(path) is not previous.get(path)]
+        instrumentation.count("chapters_rendered", rendered)
+        logger.info(f"Rendered {rendered} out of {len(chapters)} chapters.")
+        return pages, {"/" + entry.file_name: entry for entry in media.values()}, changed
+
+    def refresh(self) -> List[str]:
+        """Loads the manuscript again and renders whatever changed in it, telling listeners (see listen) about it.
+
+        Returns the paths of the pages that changed (including the ones that went away), if any.
+        """
+        manuscript = self._load()
+        if manuscript is self._manuscript:
+            return []
+
+        pages, media, changed = self._render(manuscript)
+        with self._lock:
+            self._manuscript = manuscript
+            self._pages = pages
+            self._media = media
+            if changed:
+                for listener in self._listeners:
+                    listener.put(changed)
+
+        return changed
+
+    def watch(self, stop: threading.Event, interval: float = POLL_INTERVAL) -> None:
+        """Refreshes every interval seconds until stop is set.
+
+        The manuscript failing to import (e.g. because it's halfway through being edited) keeps the last version that
+        did around.
+        """
+        while not stop.wait(interval):
+            try:
+                self.refresh()
+            except (ValueError, OSError) as e:
+                logger.warning(f"Could not load the manuscript, so keeping the last version: {e!r}")
+
+    def get_page(self, path: str) -> Optional[bytes]:
+        with self._lock:
+            page = self._pages.get(path)
+
+        return page.content if page is not None else None
+
+    def get_media(self, path: str) -> Optional[innards.EpubMedia]:
+        """Finds the image served at the given path, if a chapter uses it.
+        """
+        with self._lock:
+            return self._media.get(path)
+
+    def listen(self) -> queue.Queue:
+        """Starts listening to changes. The paths of the pages that changed show up in the queue after every refresh
+        that changed anything, and None once the preview closes.
+        """
+        listener = queue.Queue()
+        with self._lock:
+            self._listeners.append(listener)
+
+        return listener
+
+    def stop_listening(self, listener: queue.Queue) -> None:
+        with self._lock:
+            self._listeners.remove(listener)
+
+    def close(self) -> None:
+        """Lets every listener know there won't be anything else coming.
+        """
+        with self._lock:
+            for listener in self._listeners:
+                listener.put(None)
+
+
+class PreviewServer(http.server.ThreadingHTTPServer):
+    """Serves a Preview over HTTP, on localhost only. Change events are streamed to browsers as server-sent events.
+    """
+    daemon_threads = True
+
+    def __init__(self, preview: Preview, port: int = DEFAULT_PORT):
+        self.preview = preview
+        super().__init__((HOST, port), _RequestHandler)
+
+    @property
+    def url(self) -> str:
+        return f"http://{HOST}:{self.server_address[1]}{INDEX_PATH}"
+
+
+class _RequestHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(f"{self.address_string()}: {format % args}")
+
+    def _send(self, content: bytes, content_type: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _send_events(self) -> None:
+        preview = self.server.preview
+        # Listening before anything is sent means nothing that happens once the browser is connected gets lost.
+        listener = preview.listen()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            self.wfile.flush()
+
+            while True:
+                try:
+                    changed = listener.get(timeout=KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+                    continue
+
+                if changed is None:
+                    break
+                self.wfile.write(f"data: {json.dumps(changed)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            logger.debug("A browser stopped listening.")
+        finally:
+            preview.stop_listening(listener)
+
+    def do_GET(self) -> None:
+        path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        preview = self.server.preview
+
+        if path == EVENTS_PATH:
+            self._send_events()
+            return
+
+        if path == STYLESHEET_PATH:
+            self._send(STYLESHEET.encode("utf-8"), "text/css; charset=utf-8")
+            return
+
+        page = preview.get_page(path)
+        if page is not None:
+            self._send(page, "text/html; charset=utf-8")
+            return
+
+        media = preview.get_media(path)
+        if media is not None and media.source.is_file():
+            self._send(media.source.read_bytes(), media.media_type)
+            return
+
+        self.send_error(404)
+
+
+def serve(server: PreviewServer, interval: float = POLL_INTERVAL) -> None:
+    """Serves the preview of the given server until interrupted, refreshing it every interval seconds meanwhile.
+    """
+    stop = threading.Event()
+    watcher = threading.Thread(target=server.preview.watch, args=(stop, interval), name="preview-watcher", daemon=True)
+
+    server.preview.refresh()
+    watcher.start()
+    logger.info(f"Serving a preview at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down.")
+    finally:
+        stop.set()
+        watcher.join()
+        server.preview.close()
@@ -0,0 +1,287 @@
+from pathlib import Path
+import bisect
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from ..manuscript import Manuscript
+from ..instrumentation import instrumentation
+
+logger = logging.getLogger(__name__)
+
+# Words, as far as searching goes: runs of letters and digits, with apostrophes allowed inside them ("don't", curly
+# apostrophes being straightened first). Everything else (markdown included) is just what words are separated by.
+TOKEN_PATTERN = re.compile(r"\w+(?:'\w+)*")
+
+# Bump this whenever what goes into a saved index changes, so old ones are ignored rather than misread.
+INDEX_VERSION = 1
+VERSION_KEY = "version"
+SCENES_KEY = "scenes"
+
+# Where a term shows up in a scene: (paragraph, word), both counted from 0.
+ScenePosition = Tuple[int, int]
+
+
+@dataclass(order=True)
+class Hit:
+    """Where a term (or the first word of a phrase) shows up in the manuscript.
+
+    chapter counts the chapters of the manuscript from 0 (any text before the first chapter counting as a chapter of its
+    own), scene the scenes of that chapter, paragraph the paragraphs of that scene and word the words of that paragraph.
+    """
+    chapter: int
+    scene: int
+    paragraph: int
+    word: int
+
+
+def tokenize(text: str) -> List[str]:
+    """Splits the given text into the terms it's indexed (and searched) by.
+    """
+    return TOKEN_PATTERN.findall(text.casefold().replace("’", "'"))
+
+
+def split_content_into_scenes(content: Manuscript.Content) -> Iterator[Tuple[int, int, Optional[str], List[str]]]:
+    """Goes through the content of a Manuscript one scene at a time.
+
+    Yields the chapter and scene numbers (see Hit), the title of the chapter and the paragraphs of the scene.
+    """
+    chapter = 0
+    scene = 0
+    title = None
+    paragraphs = []
+    started = False
+
+    for line in content:
+        if isinstance(line, Manuscript.StartChapter):
+            if started:
+                yield chapter, scene, title, paragraphs
+                chapter += 1
+            scene = 0
+            title = line.config.title
+            paragraphs = []
+
+        elif isinstance(line, Manuscript.BreakScene):
+            yield chapter, scene, title, paragraphs
+            scene += 1
+            paragraphs = []
+
+        elif not Manuscript.is_control_type(line):
+            paragraphs.append(line)
+
+        else:
+            # Parts don't count for anything here.
+            continue
+
+        started = True
+
+    if started:
+        yield chapter, scene, title, paragraphs
+
+
+def hash_scene(paragraphs: List[str]) -> str:
+    """Hashes the paragraphs of a scene, which is what tells whether it needs indexing again.
+    """
+    hasher = hashlib.sha256()
+    for paragraph in paragraphs:
+        hasher.update(paragraph.encode("utf-8"))
+        hasher.update(b"\0")
+
+    return hasher.hexdigest()
+
+
+def index_scene(paragraphs: List[str]) -> Dict[str, List[ScenePosition]]:
+    """Works out where every term of a scene shows up in it.
+    """
+    postings = {}
+    for paragraph_number, paragraph in enumerate(paragraphs):
+        for word_number, term in enumerate(tokenize(paragraph)):
+            postings.setdefault(term, []).append((paragraph_number, word_number))
+
+    return postings
+
+
+class ManuscriptIndex:
+    """An inverted index of the words of a manuscript: for every term, where it shows up (see Hit).
+
+    Scenes are indexed on their own, and only again when their text changes (see update), so keeping the index up to
+    date with a manuscript that's being worked on is cheap. Indexed scenes can be saved to and loaded from a file, too.
+
+    Note:
+    * Terms are compared case-insensitively, and only words count (see tokenize), so "Don't!" is found as "don't".
+    * Scenes are told apart by their text, so if a file of the vault changes, only its scenes are indexed again.
+    """
+    def __init__(self):
+        # Indexed scenes, keyed on their hash.
+        self._scenes: Dict[str, Dict[str, List[ScenePosition]]] = {}
+        # Every scene of the manuscript, in order: (chapter, scene, hash).
+        self._locations: List[Tuple[int, int, str]] = []
+        # Which scenes (as indices into _locations) every term shows up in.
+        self._terms: Dict[str, List[int]] = {}
+        self._sorted_terms: Optional[List[str]] = None
+        self.chapter_titles: Dict[int, Optional[str]] = {}
+
+    @instrumentation.timed("search.update")
+    def update(self, manuscript: Manuscript) -> int:
+        """Brings the index up to date with the given manuscript, only indexing scenes it hasn't seen before.
+
+        Returns how many scenes were indexed.
+        """
+        scenes = {}
+        locations = []
+        chapter_titles = {}
+        indexed = 0
+
+        for chapter, scene, title, paragraphs in split_content_into_scenes(manuscript.content):
+            scene_hash = hash_scene(paragraphs)
+            if scene_hash not in scenes:
+                if scene_hash in self._scenes:
+                    scenes[scene_hash] = self._scenes[scene_hash]
+                else:
+                    scenes[scene_hash] = index_scene(paragraphs)
+                    indexed += 1
+
+            locations.append((chapter, scene, scene_hash))
+            chapter_titles[chapter] = title
+
+        terms = {}
+        for location, (_, _, scene_hash) in enumerate(locations):
+            for term in scenes[scene_hash]:
+                terms.setdefault(term, []).append(location)
+
+        self._scenes = scenes
+        self._locations = locations
+        self._terms = terms
+        self._sorted_terms = None
+        self.chapter_titles = chapter_titles
+
+        logger.info(f"Indexed {indexed} out of {len(locations)} scenes.")
+        return indexed
+
+    def _hits(self, term: str) -> Iterator[Tuple[int, List[ScenePosition]]]:
+        """Goes through the scenes the given term shows up in, with where it shows up in each.
+        """
+        for location in self._terms.get(term, []):
+            yield location, self._scenes[self._locations[location][2]][term]
+
+    def _to_hit(self, location: int, position: ScenePosition) -> Hit:
+        chapter, scene, _ = self._locations[location]
+        return Hit(chapter, scene, position[0], position[1])
+
+    def find(self, term: str) -> List[Hit]:
+        """Finds every place the given term shows up, in order.
+        """
+        tokens = tokenize(term)
+        if len(tokens) != 1:
+            logger.error(f"Can only find single terms, not {term!r} (see find_phrase).")
+            raise ValueError
+
+        return [self._to_hit(location, position)
+                for location, positions in self._hits(tokens[0])
+                for position in positions]
+
+    def find_phrase(self, phrase: str) -> List[Hit]:
+        """Finds every place the given words show up one right after the other (in the same paragraph), in order.
+
+        Hits are where the first word of the phrase is.
+        """
+        tokens = tokenize(phrase)
+        if not tokens:
+            return []
+
+        # Only scenes with every word of the phrase in them are worth looking at, and the rarest word narrows them down
+        # the most.
+        candidates = set(self._terms.get(tokens[0], []))
+        for token in sorted(set(tokens[1:]), key=lambda token: len(self._terms.get(token, []))):
+            candidates.intersection_update(self._terms.get(token, []))
+            if not candidates:
+                return []
+
+        output = []
+        for location in sorted(candidates):
+            postings = self._scenes[self._locations[location][2]]
+            following = [set(postings[token]) for token in tokens[1:]]
+            for paragraph, word in postings[tokens[0]]:
+                if all((paragraph, word + offset) in positions for offset, positions in enumerate(following, 1)):
+                    output.append(self._to_hit(location, (paragraph, word)))
+
+        return output
+
+    def terms_with_prefix(self, prefix: str) -> List[str]:
+        """Lists every (indexed) term that starts with the given prefix, in alphabetical order.
+        """
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self._terms)
+
+        prefix = prefix.casefold()
+        start = bisect.bisect_left(self._sorted_terms, prefix)
+        end = start
+        while end < len(self._sorted_terms) and self._sorted_terms[end].startswith(prefix):
+            end += 1
+
+        return self._sorted_terms[start:end]
+
+    def find_prefix(self, prefix: str) -> List[Hit]:
+        """Finds every place a term starting with the given prefix shows up, in order.
+        """
+        return sorted(self._to_hit(location, position)
+                      for term in self.terms_with_prefix(prefix)
+                      for location, positions in self._hits(term)
+                      for position in positions)
+
+    def save(self, index_file: Path) -> None:
+        """Writes the indexed scenes into the given file (atomically, so it's never half-written), for load.
+        """
+        index_file.parent.mkdir(parents=True, exist_ok=True)
+        file_descriptor, temp_name = tempfile.mkstemp(suffix=".json", dir=index_file.parent)
+        try:
+            with os.fdopen(file_descriptor, "w", encoding="utf-8") as out_file:
+                json.dump({VERSION_KEY: INDEX_VERSION, SCENES_KEY: self._scenes}, out_file, ensure_ascii=False)
+            os.replace(temp_name, index_file)
+        except BaseException:
+            Path(temp_name).unlink(missing_ok=True)
+            raise
+
+    @classmethod
+    def load(cls, index_file: Path) -> "ManuscriptIndex":
+        """Creates an index with the scenes saved in the given file, ready to update with a manuscript.
+
+        A missing, broken or outdated file just means starting from scratch.
+        """
+        index = cls()
+        try:
+            with open(index_file, "r", encoding="utf-8") as in_file:
+                saved = json.load(in_file)
+        except FileNotFoundError:
+            return index
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read index {index_file} ({e}), so starting from scratch.")
+            return index
+
+        if not isinstance(saved, dict) or saved.get(VERSION_KEY) != INDEX_VERSION:
+            logger.info(f"Index {index_file} is from another version, so starting from scratch.")
+            return index
+
+        index._scenes = {scene_hash: {term: [tuple(position) for position in positions]
+                                      for term, positions in postings.items()}
+                         for scene_hash, postings in saved[SCENES_KEY].items()}
+        return index
+
+
+def build_index(manuscript: Manuscript, index_file: Optional[Path] = None) -> ManuscriptIndex:
+    """Indexes the given manuscript.
+
+    If index_file is given, the scenes saved in it are reused (if they haven't changed), and the index is saved back
+    into it afterwards.
+    """
+    index = ManuscriptIndex.load(index_file) if index_file is not None else ManuscriptIndex()
+    indexed = index.update(manuscript)
+    if index_file is not None and indexed:
+        index.save(index_file)
+
+    return index
@@ -0,0 +1,66 @@
+import unittest
+import tempfile
+from pathlib import Path
+
+# We need to start by adding the packages we're testing into the path, which is an unfortunate reality of not wanting to
+# install the package just to run unit tests.
+import test_utils
+test_utils.finagle_dependencies()
+
+from manuscript_generator_3000.builder import batch
+from manuscript_generator_3000.builder import builder
+from manuscript_generator_3000.exporters import markdown_exporter
+
+EXAMPLE_PATH = Path(__file__).parents[1] / "example"
+INDEX_FILE = EXAMPLE_PATH / "The Unimaginative Software Engineer.md"
+
+
+class TestBuildBatch(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_path = Path(self.temp_dir.name)
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.temp_dir.cleanup()
+
+    def spec(self, name: str, source: Path = INDEX_FILE) -> batch.BuildSpec:
+        """Creates a spec that builds the given manuscript into markdown, into a file named after the book.
+        """
+        out_file = self.temp_path / f"{name}.md"
+        target = builder.ExportTarget("markdown", markdown_exporter.export, (out_file,), outputs=[out_file])
+        return batch.BuildSpec(name, source, EXAMPLE_PATH, [target], manifest_file=self.temp_path / f"{name}.json")
+
+    def test_batch(self):
+        """Every book should be built, a failing one not getting in the way of the others, with what they logged
+        making it back here.
+        """
+        specs = [self.spec("first"), self.spec("missing", EXAMPLE_PATH / "Nowhere.md"), self.spec("second")]
+
+        with self.assertLogs(level="INFO") as logs:
+            results = batch.build_batch(specs, max_workers=2)
+
+        self.assertEqual([result.name for result in results], ["first", "missing", "second"])
+        self.assertEqual([result.succeeded for result in results], [True, False, True])
+        self.assertIsInstance(results[1].error, ValueError)
+        self.assertIn("Once upon a time", (self.temp_path / "first.md").read_text(encoding="utf-8"))
+        self.assertIn("Once upon a time", (self.temp_path / "second.md").read_text(encoding="utf-8"))
+        self.assertTrue(any(line.startswith("INFO:") and "[first] Building markdown." in line for line in logs.output))
+        self.assertTrue(any("[missing] File does not exist!" in line for line in logs.output))
+
+        # Nothing changed, so the second time round there's nothing to build.
+        results = batch.build_batch(specs[::2], max_workers=2)
+        self.assertTrue(all(target.skipped for result in results for target in result.targets))
+
+        lines = batch.describe_results(results)
+        self.assertTrue(lines[0].startswith("first: 0 target(s) built, 1 up to date"))
+        self.assertTrue(lines[-1].startswith("2 out of 2 book(s) built"))
+
+    def test_duplicate_names(self):
+        with self.assertRaises(ValueError), self.assertLogs(batch.logger, "ERROR"):
+            batch.build_batch([self.spec("same"), self.spec("same")])
+
+
+if __name__ == '__main__':
+    unittest.main()
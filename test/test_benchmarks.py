@@ -0,0 +1,53 @@
+import unittest
+import tempfile
+from pathlib import Path
+
+# We need to start by adding the packages we're testing into the path, which is an unfortunate reality of not wanting to
+# install the package just to run unit tests.
+import test_utils
+test_utils.finagle_dependencies()
+
+from manuscript_generator_3000.benchmarks import benchmarks
+from manuscript_generator_3000.benchmarks import synthetic_vault
+from manuscript_generator_3000.importers import markdown_index_file_importer
+from manuscript_generator_3000.importers import markdown_single_file_importer
+from manuscript_generator_3000.manuscript import Manuscript
+
+
+class TestSyntheticVault(unittest.TestCase):
+    def test_generate_vault(self):
+        """Both files of a generated vault should import into the same manuscript, of the shape that was asked for.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for mode in synthetic_vault.DelimiterMode:
+                vault = synthetic_vault.generate_vault(Path(temp_dir) / mode.name, 2, 3, 2, 130, mode)
+                from_index = markdown_index_file_importer.load_manuscript_from_index_file(vault.index_file,
+                                                                                         vault.root_folder,
+                                                                                         mode)
+                from_single_file = markdown_single_file_importer.load_manuscript_from_file(vault.single_file.name,
+                                                                                           vault.root_folder)
+
+                self.assertEqual(len(vault.scene_files), 12)
+                self.assertEqual(from_index.content, from_single_file.content)
+                self.assertEqual(from_index.config.title, "Synthetic Manuscript")
+                self.assertEqual(sum(isinstance(line, Manuscript.StartPart) for line in from_index.content), 2)
+                self.assertEqual(sum(isinstance(line, Manuscript.StartChapter) for line in from_index.content), 6)
+                self.assertEqual(sum(isinstance(line, Manuscript.BreakScene) for line in from_index.content), 6)
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_compare(self):
+        results = [benchmarks.BenchmarkResult("same", 1.0, 1.0, 1),
+                   benchmarks.BenchmarkResult("slower", 2.0, 2.0, 1),
+                   benchmarks.BenchmarkResult("new", 1.0, 1.0, 1)]
+        baseline = {"results": {"same": {"best": 1.0}, "slower": {"best": 1.0}}}
+
+        same, slower, new = benchmarks.compare(results, baseline, 0.25)
+
+        self.assertFalse(same.startswith("REGRESSION"))
+        self.assertTrue(slower.startswith("REGRESSION"))
+        self.assertTrue(new.endswith("no baseline"))
+
+
+if __name__ == '__main__':
+    unittest.main()
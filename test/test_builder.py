@@ -0,0 +1,230 @@
+import unittest
+from unittest import mock
+import datetime
+import json
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import test_utils
+test_utils.finagle_dependencies()
+import manuscript_generator_3000.builder as builder
+from manuscript_generator_3000.builder import manifest
+from manuscript_generator_3000.exporters import external_tools
+from manuscript_generator_3000.manuscript import Manuscript
+
+
+class TestBuild(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.manuscript = Manuscript(["Some text."], None)
+
+    def test_targets_run_concurrently(self):
+        """All targets should be running at the same time (or this would never get past the barrier).
+        """
+        barrier = threading.Barrier(3, timeout=5)
+
+        def export(manuscript, suffix):
+            barrier.wait()
+            return manuscript.content[0] + suffix
+
+        targets = [builder.ExportTarget(f"target {index}", export, (f" {index}",)) for index in range(3)]
+
+        results = builder.build(self.manuscript, targets)
+
+        self.assertEqual([result.name for result in results], ["target 0", "target 1", "target 2"])
+        self.assertEqual([result.result for result in results], ["Some text. 0", "Some text. 1", "Some text. 2"])
+        self.assertTrue(all(result.succeeded for result in results))
+
+    def test_errors_are_collected(self):
+        """A failing target should not take the others down with it.
+        """
+        def fail(manuscript):
+            raise RuntimeError("Nope.")
+
+        def succeed(manuscript, value=None):
+            time.sleep(0.01)
+            return value
+
+        targets = [builder.ExportTarget("failure", fail),
+                   builder.ExportTarget("success", succeed, kwargs={"value": 42})]
+
+        with self.assertLogs(builder.logger, "ERROR"):
+            failure, success = builder.build(self.manuscript, targets)
+
+        self.assertFalse(failure.succeeded)
+        self.assertIsInstance(failure.error, RuntimeError)
+        self.assertTrue(success.succeeded)
+        self.assertEqual(success.result, 42)
+        self.assertGreater(success.seconds, 0)
+
+    def test_duplicate_names(self):
+        """Results are told apart by name, so names have to be unique.
+        """
+        targets = [builder.ExportTarget("same", lambda manuscript: None),
+                   builder.ExportTarget("same", lambda manuscript: None)]
+
+        with self.assertRaises(ValueError), self.assertLogs(builder.logger, "ERROR"):
+            builder.build(self.manuscript, targets)
+
+
+class TestBuildWithManifest(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_path = Path(self.temp_dir.name)
+        self.manifest_file = self.temp_path / "build_manifest.json"
+        self.template = self.temp_path / "template.txt"
+        self.template.write_text("TEMPLATE", encoding="utf8")
+        self.output = self.temp_path / "output.txt"
+        self.exports = 0
+        self.export_fails = False
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.temp_dir.cleanup()
+
+    def export(self, manuscript, template, out_file, language="english"):
+        if self.export_fails:
+            raise RuntimeError("Nope.")
+
+        self.exports += 1
+        out_file.write_text(template.read_text(encoding="utf8") + "".join(manuscript.content), encoding="utf8")
+
+    def build(self, content, language="english"):
+        """Builds a manuscript with the given content with the manifest, returning the result.
+        """
+        config = Manuscript.Config(title="title", author="author", cover="", time=datetime.datetime.now())
+        target = builder.ExportTarget("text",
+                                      self.export,
+                                      (self.template, self.output),
+                                      {"language": language} if language != "english" else {},
+                                      outputs=[self.output],
+                                      input_files=[self.template])
+
+        return builder.build(Manuscript(content, config), [target], manifest_file=self.manifest_file)[0]
+
+    def test_unchanged_inputs_are_skipped(self):
+        """Building the same thing twice should only build it once, even if the manuscript was imported again.
+        """
+        first = self.build(["Some text."])
+        second = self.build(["Some text."])
+
+        self.assertFalse(first.skipped)
+        self.assertTrue(second.skipped)
+        self.assertEqual(self.exports, 1)
+
+        entries = json.loads(self.manifest_file.read_text(encoding="utf8"))[manifest.TARGETS_KEY]
+        self.assertIn(f"file:{self.template}", entries["text"][manifest.INPUTS_KEY])
+
+    def test_changed_inputs_are_built(self):
+        """Changing the manuscript, an input file or the arguments should all lead to a rebuild.
+        """
+        self.build(["Some text."])
+
+        self.assertFalse(self.build(["Some other text."]).skipped)
+
+        self.template.write_text("A NEW TEMPLATE", encoding="utf8")
+        self.assertFalse(self.build(["Some other text."]).skipped)
+
+        self.assertFalse(self.build(["Some other text."], language="portuguese").skipped)
+        self.assertEqual(self.exports, 4)
+
+    def test_missing_output_is_built(self):
+        """An output that went missing should be built again, even if nothing else changed.
+        """
+        self.build(["Some text."])
+        self.output.unlink()
+
+        self.assertFalse(self.build(["Some text."]).skipped)
+        self.assertTrue(self.output.exists())
+
+    def test_failures_are_not_recorded(self):
+        """A target that failed should be built again next time around.
+        """
+        self.export_fails = True
+        with self.assertLogs(builder.logger, "ERROR"):
+            self.assertFalse(self.build(["Some text."]).succeeded)
+
+        self.export_fails = False
+        self.assertFalse(self.build(["Some text."]).skipped)
+
+    def test_broken_manifest(self):
+        """A broken manifest should just mean building everything.
+        """
+        self.manifest_file.write_text("{ not really json", encoding="utf8")
+
+        with self.assertLogs(manifest.logger, "WARNING"):
+            result = self.build(["Some text."])
+
+        self.assertFalse(result.skipped)
+        self.assertTrue(self.build(["Some text."]).skipped)
+
+
+class TestExternalTools(unittest.TestCase):
+    def tearDown(self) -> None:
+        super().tearDown()
+        external_tools.set_max_processes(external_tools.DEFAULT_MAX_PROCESSES)
+
+    def test_max_processes(self):
+        """No more than the allowed number of tools should ever run at the same time.
+        """
+        running = 0
+        most_running = 0
+        lock = threading.Lock()
+
+        def fake_run(cmd, **kwargs):
+            nonlocal running, most_running
+            with lock:
+                running += 1
+                most_running = max(most_running, running)
+            time.sleep(0.02)
+            with lock:
+                running -= 1
+            return subprocess.CompletedProcess(cmd, 0)
+
+        def export(manuscript):
+            external_tools.run_tool(["pandoc"])
+
+        # The build's limit is the one that matters here, not the one for the whole process.
+        external_tools.set_max_processes(6)
+        targets = [builder.ExportTarget(f"target {index}", export) for index in range(6)]
+        with mock.patch.object(external_tools.subprocess, "run", fake_run):
+            results = builder.build(Manuscript([], None), targets, max_processes=2)
+
+        self.assertTrue(all(result.succeeded for result in results))
+        self.assertEqual(most_running, 2)
+
+    def test_max_processes_per_build(self):
+        """A build's max_processes shouldn't stick around after it, or get in the way of anything else.
+        """
+        external_tools.set_max_processes(4)
+
+        def export(manuscript):
+            external_tools.run_tool(["pandoc"])
+
+        targets = [builder.ExportTarget(f"target {index}", export) for index in range(2)]
+        with mock.patch.object(external_tools.subprocess, "run", return_value=subprocess.CompletedProcess([], 0)):
+            results = builder.build(Manuscript([], None), targets, max_processes=1)
+        self.assertTrue(all(result.succeeded for result in results))
+
+        # Only gets past the barrier if all four tools get to run at the same time.
+        barrier = threading.Barrier(4, timeout=5)
+        threads = [threading.Thread(target=export, args=(None,)) for _ in range(4)]
+        with mock.patch.object(external_tools.subprocess, "run", lambda cmd, **kwargs: barrier.wait()):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertFalse(barrier.broken)
+
+    def test_invalid_max_processes(self):
+        with self.assertRaises(ValueError), self.assertLogs(external_tools.logger, "ERROR"):
+            external_tools.set_max_processes(0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+import unittest
+from unittest import mock
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# We need to start by adding the packages we're testing into the path, which is an unfortunate reality of not wanting to
+# install the package just to run unit tests.
+import test_utils
+test_utils.finagle_dependencies()
+
+from manuscript_generator_3000.cli import cli
+from manuscript_generator_3000.cli import daemon
+from manuscript_generator_3000.manuscript import Manuscript
+
+EXAMPLE_PATH = Path(__file__).parents[1] / "example"
+INDEX_FILE = EXAMPLE_PATH / "The Unimaginative Software Engineer.md"
+
+
+class TestCli(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_path = Path(self.temp_dir.name)
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.temp_dir.cleanup()
+
+    def run_command(self, argv, cache=None):
+        """Runs the given command, returning its exit code and output.
+        """
+        out = io.StringIO()
+        exit_code = cli.run_command(cli.create_parser().parse_args(argv), Path.cwd(), out, cache)
+        return exit_code, out.getvalue()
+
+    def test_import(self):
+        exit_code, output = self.run_command(["import", str(INDEX_FILE)])
+
+        self.assertEqual(exit_code, 0)
+        self.assertIn("Title: The Unimaginative Software Engineer", output)
+        self.assertIn("Chapters: 4", output)
+
+    def test_count(self):
+        exit_code, output = self.run_command(["count", str(INDEX_FILE)])
+
+        self.assertEqual(exit_code, 0)
+        self.assertGreater(int(output), 0)
+
+    def test_search(self):
+        """Searching through a daemon's cache should give the same answers as searching without one.
+        """
+        exit_code, output = self.run_command(["search", str(INDEX_FILE), "--phrase", "the code"])
+        self.assertEqual(exit_code, 0)
+        self.assertIn("chapter 3 (Epilogue)", output)
+        self.assertTrue(output.endswith("1 hit(s).\n"))
+
+        cache = cli.ManuscriptCache()
+        for _ in range(2):
+            self.assertEqual(self.run_command(["search", str(INDEX_FILE), "--phrase", "the code"], cache), (0, output))
+
+    def test_diff(self):
+        """The first diff should save a snapshot, and the next ones compare with it.
+        """
+        snapshot = self.temp_path / "snapshot.json"
+        notes = self.temp_path / "notes.md"
+
+        exit_code, output = self.run_command(["diff", str(INDEX_FILE), str(snapshot)])
+        self.assertEqual(exit_code, 0)
+        self.assertIn("No snapshot", output)
+
+        exit_code, output = self.run_command(["diff", str(INDEX_FILE), str(snapshot), "--notes", str(notes)])
+        self.assertEqual(exit_code, 0)
+        self.assertEqual(output, "0 chapter(s) added, 0 removed, 0 modified and 0 moved.\n")
+        self.assertIn("# Revision notes", notes.read_text(encoding="utf-8"))
+
+    def test_build(self):
+        """Building twice should only build once, and relative paths should be taken from the given working directory.
+        """
+        argv = ["build", str(INDEX_FILE), "--out-dir", "output", "--formats", "epub", "markdown"]
+        out = io.StringIO()
+
+        exit_code = cli.run_command(cli.create_parser().parse_args(argv), self.temp_path, out)
+        self.assertEqual(exit_code, 0)
+        self.assertTrue((self.temp_path / "output" / "output.epub").exists())
+        self.assertTrue((self.temp_path / "output" / "output.md").exists())
+
+        exit_code = cli.run_command(cli.create_parser().parse_args(argv), self.temp_path, out)
+        self.assertEqual(exit_code, 0)
+        self.assertIn("epub: up to date", out.getvalue())
+
+    def test_batch(self):
+        """Every manuscript in a batch file should be built, as the build command would.
+        """
+        batch_file = self.temp_path / "batch.json"
+        batch_file.write_text(json.dumps([
+            {"name": name, "args": [str(INDEX_FILE), "--out-dir", name, "--formats", "markdown"]}
+            for name in ["first", "second"]
+        ]), encoding="utf-8")
+
+        out = io.StringIO()
+        exit_code = cli.run_command(cli.create_parser().parse_args(["batch", str(batch_file)]), self.temp_path, out)
+
+        self.assertEqual(exit_code, 0, out.getvalue())
+        self.assertTrue((self.temp_path / "first" / "output.md").exists())
+        self.assertTrue((self.temp_path / "second" / "output.md").exists())
+        self.assertIn("2 out of 2 book(s) built", out.getvalue())
+
+    def test_cache(self):
+        """The daemon's cache should hand back the same manuscript until one of its files changes.
+        """
+        cache = cli.ManuscriptCache()
+
+        first = cache.load(INDEX_FILE, EXAMPLE_PATH, False, "emoji")
+        second = cache.load(INDEX_FILE, EXAMPLE_PATH, False, "emoji")
+        self.assertIs(first, second)
+        self.assertEqual(first.sources[0], INDEX_FILE)
+
+        with mock.patch.object(cli.ManuscriptCache, "_fingerprint", return_value=("something else",)):
+            third = cache.load(INDEX_FILE, EXAMPLE_PATH, False, "emoji")
+        self.assertIsNot(first, third)
+
+    def test_cache_folders(self):
+        """Files showing up in the vault should be noticed, without the files in it being listed every time.
+        """
+        (self.temp_path / "notes").mkdir()
+        index_file = self.temp_path / "index.md"
+        index_file.write_text("- \U0001F4DA -- Chapter\n- \U0001F4DA [[scene]]\n", encoding="utf-8")
+        (self.temp_path / "notes" / "scene.md").write_text("Once.\n", encoding="utf-8")
+        cache = cli.ManuscriptCache()
+
+        first = cache.load(index_file, self.temp_path, False, "emoji")
+        self.assertIn("Once.", first.content)
+        with mock.patch.object(cli.markdown_importer_innards, "scan_markdown_folder",
+                               wraps=cli.markdown_importer_innards.scan_markdown_folder) as scan:
+            self.assertIs(cache.load(index_file, self.temp_path, False, "emoji"), first)
+            self.assertEqual(scan.call_count, 0)
+
+        # Another note with the same name makes the embed ambiguous, which only importing again can tell.
+        (self.temp_path / "scene.md").write_text("Twice.\n", encoding="utf-8")
+        # (Just in case the file system's clock is too coarse to tell.)
+        os.utime(self.temp_path, ns=(0, 0))
+        with self.assertRaises(ValueError), self.assertLogs(level="ERROR"):
+            cache.load(index_file, self.temp_path, False, "emoji")
+
+    def test_illustration_inputs(self):
+        """Targets should export with the illustrations prepared for them, and be out of date when the ones they use
+        change (and not the ones they don't).
+        """
+        out_dir = self.temp_path / "output"
+        illustration_dir = self.temp_path / "vault"
+        illustration_dir.mkdir()
+        args = cli.create_parser().parse_args(["build", str(INDEX_FILE), "--out-dir", str(out_dir),
+                                               "--illustrations", str(illustration_dir)])
+        manuscript = Manuscript(["![A cat](cat.png)", "No dog."],
+                                Manuscript.Config("Title", "Someone", "cover.png", None))
+        for name in ["cat.png", "dog.png", "cover.png"]:
+            (illustration_dir / name).write_bytes(name.encode("utf-8"))
+
+        epub = cli.create_target("epub", manuscript, args)
+        pdf = cli.create_target("pdf", manuscript, args)
+
+        epub_dir = out_dir / cli.ILLUSTRATIONS_DIRECTORY_NAME / "epub"
+        pdf_dir = out_dir / cli.ILLUSTRATIONS_DIRECTORY_NAME / "pdf"
+        self.assertEqual(epub.args[0], epub_dir)
+        self.assertEqual(epub.input_files, [epub_dir / "cover.png", epub_dir / "cat.png"])
+        self.assertEqual(pdf.args[1], pdf_dir)
+        self.assertEqual(pdf.input_files, [args.template, pdf_dir / "cover.png", pdf_dir / "cat.png"])
+        self.assertEqual((pdf_dir / "cat.png").read_bytes(), b"cat.png")
+        self.assertFalse((pdf_dir / "dog.png").exists())
+
+
+class TestDaemon(unittest.TestCase):
+    def test_find_socket(self):
+        with mock.patch.dict(os.environ, {daemon.SOCKET_ENVIRONMENT_VARIABLE: ""}):
+            self.assertEqual(daemon.find_socket(["--socket", "a.sock", "count", "index.md"]), Path("a.sock"))
+            self.assertEqual(daemon.find_socket(["-v", "--socket=a.sock", "count"]), Path("a.sock"))
+            self.assertIsNone(daemon.find_socket(["serve", "--socket", "a.sock"]))
+
+        with mock.patch.dict(os.environ, {daemon.SOCKET_ENVIRONMENT_VARIABLE: "b.sock"}):
+            self.assertEqual(daemon.find_socket(["count", "index.md"]), Path("b.sock"))
+
+    def test_round_trip(self):
+        """Commands sent to a daemon should run there, with their output and exit code making it back.
+        """
+        def run(argv, cwd, out):
+            out.write(f"{' '.join(argv)} in {cwd}\n")
+            return 3
+
+        # Unix sockets have pretty short path limits, so this goes somewhere short.
+        with tempfile.TemporaryDirectory(dir="/tmp") as temp_dir:
+            socket_path = Path(temp_dir) / "daemon.sock"
+            self.assertIsNone(daemon.send_command(socket_path, ["count"], Path("/somewhere"), io.StringIO()))
+
+            threading.Thread(target=daemon.serve, args=(socket_path, run), daemon=True).start()
+            for _ in range(100):
+                if socket_path.exists():
+                    break
+                time.sleep(0.01)
+
+            out = io.StringIO()
+            exit_code = daemon.send_command(socket_path, ["count", "index.md"], Path("/somewhere"), out)
+
+            self.assertEqual(exit_code, 3)
+            self.assertEqual(out.getvalue(), "count index.md in /somewhere\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
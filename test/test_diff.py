@@ -0,0 +1,104 @@
+import unittest
+import datetime
+import tempfile
+from pathlib import Path
+
+# We need to start by adding the packages we're testing into the path, which is an unfortunate reality of not wanting to
+# install the package just to run unit tests.
+import test_utils
+test_utils.finagle_dependencies()
+
+from manuscript_generator_3000.diff import diff
+from manuscript_generator_3000.manuscript import Manuscript
+from test_utils import chapter
+
+CONFIG = Manuscript.Config("Title", "Author", "", datetime.datetime(2024, 1, 1))
+
+
+def manuscript(*chapters) -> Manuscript:
+    """Creates a manuscript with the given chapters, each a title followed by its paragraphs.
+    """
+    content = []
+    for title, *paragraphs in chapters:
+        content.append(chapter(title))
+        content.extend(paragraphs)
+    return Manuscript(content, CONFIG)
+
+
+ONE = ("One", "First paragraph.", "Second paragraph.")
+TWO = ("Two", "Something happens.", Manuscript.BreakScene(), "Something else happens.")
+THREE = ("Three", "The end.")
+
+
+class TestDiffManuscripts(unittest.TestCase):
+    def test_identical(self):
+        output = diff.diff_manuscripts(manuscript(ONE, TWO), manuscript(ONE, TWO))
+
+        self.assertFalse(output.has_changes)
+        self.assertEqual([chapter.status for chapter in output.chapters], [diff.UNCHANGED, diff.UNCHANGED])
+
+    def test_added_and_removed(self):
+        output = diff.diff_manuscripts(manuscript(ONE, TWO), manuscript(ONE, THREE))
+
+        self.assertEqual([(chapter.status, chapter.title) for chapter in output.chapters],
+                         [(diff.UNCHANGED, "One"), (diff.ADDED, "Three"), (diff.REMOVED, "Two")])
+        self.assertEqual(output.moved, 0)
+
+    def test_moved(self):
+        """Swapping two chapters around should only count one of them as moved.
+        """
+        output = diff.diff_manuscripts(manuscript(ONE, TWO, THREE), manuscript(ONE, THREE, TWO))
+
+        self.assertEqual([(chapter.title, chapter.moved) for chapter in output.chapters],
+                         [("One", False), ("Three", True), ("Two", False)])
+        self.assertTrue(output.has_changes)
+
+    def test_modified(self):
+        """Changed chapters should be diffed paragraph by paragraph, even if they were renamed.
+        """
+        revised = ("Two, revised", "Something happens.", "Something new.", Manuscript.BreakScene(),
+                   "Something else happens.", "And one more thing.")
+        output = diff.diff_manuscripts(manuscript(ONE, TWO), manuscript(ONE, revised))
+
+        modified = output.chapters[1]
+        self.assertEqual((modified.status, modified.old_title), (diff.MODIFIED, "Two"))
+        self.assertEqual([(change.kind, change.new_start, change.new_lines) for change in modified.changes],
+                         [(diff.ADDED, 1, ["Something new."]), (diff.ADDED, 4, ["And one more thing."])])
+
+        edited = ("One", "First paragraph.", "Second paragraph, edited.")
+        change, = diff.diff_manuscripts(manuscript(ONE), manuscript(edited)).chapters[0].changes
+        self.assertEqual((change.kind, change.old_lines, change.new_lines),
+                         (diff.CHANGED, ["Second paragraph."], ["Second paragraph, edited."]))
+
+    def test_revision_notes(self):
+        edited = ("One", "First paragraph.", "Second paragraph, edited.")
+        output = diff.diff_manuscripts(manuscript(ONE, TWO), manuscript(edited, THREE))
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            notes_file = Path(temp_dir) / "notes.md"
+            diff.write_revision_notes(output, notes_file, "Title")
+            notes = notes_file.read_text(encoding="utf-8")
+
+        self.assertIn("title: Revision notes for Title", notes)
+        self.assertIn("1 chapter(s) added, 1 removed, 1 modified and 0 moved.", notes)
+        self.assertIn("## Chapter 1: One (modified)", notes)
+        self.assertIn("> Second paragraph.\n\nNow:\n\n> Second paragraph, edited.", notes)
+        self.assertIn("## Chapter 2: Three (added)", notes)
+        self.assertIn("## Chapter 2: Two (removed)", notes)
+
+
+class TestSnapshots(unittest.TestCase):
+    def test_round_trip(self):
+        original = manuscript(ONE, TWO)
+        original.content.insert(0, Manuscript.StartPart(Manuscript.SeparatorConfig("Part", False)))
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            snapshot_file = Path(temp_dir) / "snapshot.json"
+            diff.write_snapshot(original, snapshot_file)
+            output = diff.read_snapshot(snapshot_file)
+
+        self.assertEqual(output, original)
+
+
+if __name__ == '__main__':
+    unittest.main()
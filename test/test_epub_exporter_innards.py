@@ -0,0 +1,137 @@
+import unittest
+import tempfile
+import zipfile
+import zlib
+from pathlib import Path
+
+# We need to start by adding the packages we're testing into the path, which is an unfortunate reality of not wanting to
+# install the package just to run unit tests.
+import test_utils
+test_utils.finagle_dependencies()
+
+from manuscript_generator_3000.exporters import epub_exporter_innards as innards
+from manuscript_generator_3000.manuscript import Manuscript
+
+
+class TestConvertInlineMarkdownToXhtml(unittest.TestCase):
+    def test_plain_text(self):
+        """Plain text should come out the same, save for escaping.
+        """
+        output = innards.convert_inline_markdown_to_xhtml("Fish & chips <3")
+
+        self.assertEqual(output, "Fish &amp; chips &lt;3")
+
+    def test_emphasis(self):
+        """Both flavours of emphasis (and strong emphasis) should be converted.
+        """
+        output = innards.convert_inline_markdown_to_xhtml("*one* _two_ **three** __four__")
+
+        self.assertEqual(output, "<em>one</em> <em>two</em> <strong>three</strong> <strong>four</strong>")
+
+    def test_underscores_in_words(self):
+        """Underscores inside words are not emphasis.
+        """
+        output = innards.convert_inline_markdown_to_xhtml("snake_case_name")
+
+        self.assertEqual(output, "snake_case_name")
+
+    def test_code_and_escapes(self):
+        """Code spans and escaped characters should be taken literally.
+        """
+        output = innards.convert_inline_markdown_to_xhtml("`*not emphasis*` and \\*neither\\*")
+
+        self.assertEqual(output, "<code>*not emphasis*</code> and *neither*")
+
+    def test_link(self):
+        """Links should become anchors.
+        """
+        output = innards.convert_inline_markdown_to_xhtml("[a *link*](https://example.com/?a=1&b=2)")
+
+        self.assertEqual(output, '<a href="https://example.com/?a=1&amp;b=2">a <em>link</em></a>')
+
+    def test_smart_punctuation(self):
+        """Quotes, dashes and dots should come out as pandoc would have them, but not where links point to.
+        """
+        output = innards.convert_inline_markdown_to_xhtml("\"Don't\" -- she said... *\"Really\"* --- "
+                                                          "[see \"this\"](https://example.com/a--b) `'code'`")
+
+        self.assertEqual(output, "\u201cDon\u2019t\u201d \u2013 she said\u2026 <em>\u201cReally\u201d</em> \u2014 "
+                                 "<a href=\"https://example.com/a--b\">see \u201cthis\u201d</a> <code>'code'</code>")
+
+
+class TestSplitContentIntoChapters(unittest.TestCase):
+    def test_split(self):
+        """Chapters start at each StartChapter, text before the first one is its own chapter, and parts are dropped.
+        """
+        part = Manuscript.StartPart(Manuscript.SeparatorConfig("Part", True))
+        chapter = Manuscript.StartChapter(Manuscript.SeparatorConfig("Chapter", True))
+        content = ["preamble", part, chapter, "text", Manuscript.BreakScene(), "more text", chapter, "even more text"]
+
+        output = list(innards.split_content_into_chapters(content))
+
+        self.assertEqual(output, [["preamble"],
+                                  [chapter, "text", Manuscript.BreakScene(), "more text"],
+                                  [chapter, "even more text"]])
+
+
+class TestRenderChapter(unittest.TestCase):
+    def test_render(self):
+        """A chapter should come out as a heading (with its number) followed by its paragraphs.
+        """
+        chapter = [Manuscript.StartChapter(Manuscript.SeparatorConfig("The *Title*", True)),
+                   "First paragraph.",
+                   Manuscript.BreakScene(),
+                   "Second paragraph."]
+
+        output = "".join(innards.render_chapter(chapter, 3, "en"))
+
+        self.assertIn('<h1><span class="header-section-number">3</span> The <em>Title</em></h1>', output)
+        self.assertIn("<p>First paragraph.</p>\n<hr class=\"scene-break\"/>\n<p>Second paragraph.</p>", output)
+
+
+
+class TestZipWriter(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.out_file = Path(self.temp_dir.name) / "out.zip"
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.temp_dir.cleanup()
+
+    def test_write(self):
+        """What gets written should read back with zipfile, compressed as asked, in order.
+        """
+        text = "Lorem ipsum dolor sit amet. " * 100
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+        compressed = compressor.compress(b"copied") + compressor.flush()
+
+        with innards.ZipWriter(self.out_file) as archive:
+            archive.write("mimetype", [b"application/epub+zip"], zipfile.ZIP_STORED)
+            archive.write("text/deflated.txt", [text[:1000].encode("utf-8"), text[1000:].encode("utf-8")])
+            archive.write("text/ünïcödé.txt", [b"unicode"])
+            archive.write_compressed("copied.txt", compressed, zipfile.ZIP_DEFLATED, zlib.crc32(b"copied"), 6)
+
+        with zipfile.ZipFile(self.out_file) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), ["mimetype", "text/deflated.txt", "text/ünïcödé.txt", "copied.txt"])
+            self.assertEqual(archive.getinfo("mimetype").compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(archive.getinfo("mimetype").date_time, (1980, 1, 1, 0, 0, 0))
+            self.assertEqual(archive.read("text/deflated.txt").decode("utf-8"), text)
+            self.assertLess(archive.getinfo("text/deflated.txt").compress_size, len(text))
+            self.assertEqual(archive.read("text/ünïcödé.txt"), b"unicode")
+            self.assertEqual(archive.read("copied.txt"), b"copied")
+
+        # The mimetype comes first, uncompressed, with nothing between its header and its data.
+        self.assertEqual(self.out_file.read_bytes()[30:58], b"mimetypeapplication/epub+zip")
+
+    def test_duplicate(self):
+        with innards.ZipWriter(self.out_file) as archive:
+            archive.write("a.txt", [b"a"])
+            with self.assertLogs(innards.logger, "ERROR"), self.assertRaises(ValueError):
+                archive.write("a.txt", [b"b"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,16 @@
 import unittest
+from unittest import mock
+import asyncio
+import concurrent.futures
+import datetime
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import xml.dom.minidom
+import zipfile
+from pathlib import Path
 
 # We need to start by adding the packages we're testing into the path, which is an unfortunate reality of not wanting to
 # install the package just to run unit tests.
@@ -7,6 +19,72 @@ test_utils.finagle_dependencies()
 
 from manuscript_generator_3000.exporters import latex_pdf_exporter
 from manuscript_generator_3000.exporters import markdown_exporter
+from manuscript_generator_3000.exporters import epub_exporter
+from manuscript_generator_3000.exporters import epub_exporter_innards
+from manuscript_generator_3000.exporters import external_tools
+from manuscript_generator_3000.manuscript import Manuscript
+
+# Stand-ins for the external tools the exporters call, so we can exercise the exporters without pandoc or a LaTeX
+# installation. "pandoc" writes out the text of the document it's given (along with any raw blocks), and "pdflatex"
+# copies the LaTeX file it was given (with any included files spliced in) into <jobname>.pdf in its working directory,
+# along with the artifacts the real thing leaves behind.
+FAKE_PANDOC = """
+import json
+import sys
+if sys.argv[sys.argv.index("-t") + 1] == "json":
+    sys.stdout.write('{"pandoc-api-version":[1,23,1],"meta":{},"blocks":[]}')
+    sys.exit()
+
+def text(node):
+    if isinstance(node, list):
+        return "".join(text(child) for child in node)
+    if not isinstance(node, dict):
+        return ""
+    if node["t"] == "Str":
+        return node["c"]
+    if node["t"] in ["Space", "SoftBreak"]:
+        return " "
+    if node["t"] == "RawBlock":
+        return node["c"][1] + "\\n"
+    return text(node.get("c", [])) + ("\\n\\n" if node["t"] in ["Para", "Header"] else "")
+
+sys.stdout.write(text(json.load(sys.stdin)["blocks"]))
+"""
+
+FAKE_PDFLATEX = r"""
+import re
+import sys
+from pathlib import Path
+jobname = [arg for arg in sys.argv if arg.startswith("-jobname=")][0].split("=", 1)[1]
+latex = Path(sys.argv[-1]).read_text(encoding="utf8")
+
+# Pull in \include-d files (the ones \includeonly allows, at least) the same way LaTeX would.
+only = re.search(r"\\includeonly\{([^}]*)\}", latex)
+only = only.group(1).split(",") if only else None
+
+def include(match):
+    name = match.group(1)
+    if only is not None and name not in only:
+        return ""
+    Path(name + ".aux").write_text("", encoding="utf8")
+    return Path(name + ".tex").read_text(encoding="utf8")
+
+Path(jobname + ".pdf").write_text(re.sub(r"\\include\{([^}]*)\}", include, latex), encoding="utf8")
+for ext in [".aux", ".log", ".out"]:
+    Path(jobname + ext).write_text("", encoding="utf8")
+
+# Keep track of how many passes we've been asked for.
+with (Path(__file__).parent / "pdflatex_passes").open("a") as passes:
+    passes.write(jobname + "\n")
+"""
+
+
+def write_fake_tool(folder: Path, name: str, source: str) -> None:
+    """Writes a little Python script that pretends to be the given tool into the given folder.
+    """
+    tool = folder / name
+    tool.write_text(f"#!{sys.executable}\n" + textwrap.dedent(source), encoding="utf8")
+    tool.chmod(0o755)
 
 
 class TestExporters(unittest.TestCase):
@@ -15,5 +93,311 @@ class TestExporters(unittest.TestCase):
         pass
 
 
+class FakeToolsTestCase(unittest.TestCase):
+    """Runs each test in a temporary folder, with the fake tools above first in the PATH.
+    """
+    def setUp(self) -> None:
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_path = Path(self.temp_dir.name)
+
+        tools_dir = self.temp_path / "tools"
+        tools_dir.mkdir()
+        self.pdflatex_passes_file = tools_dir / "pdflatex_passes"
+        write_fake_tool(tools_dir, "pandoc", FAKE_PANDOC)
+        write_fake_tool(tools_dir, "pdflatex", FAKE_PDFLATEX)
+
+        path_patcher = mock.patch.dict(os.environ, {"PATH": str(tools_dir) + os.pathsep + os.environ["PATH"]})
+        path_patcher.start()
+        self.addCleanup(path_patcher.stop)
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.temp_dir.cleanup()
+
+    def count_pdflatex_passes(self) -> int:
+        """Returns how many times the fake pdflatex has been run so far.
+        """
+        if not self.pdflatex_passes_file.exists():
+            return 0
+        return len(self.pdflatex_passes_file.read_text().splitlines())
+
+
+class TestLatexPdfExporterConcurrency(FakeToolsTestCase):
+    def export(self, index: int) -> Path:
+        """Exports a small manuscript that can be told apart from the others by its index.
+        """
+        config = Manuscript.Config(title=f"Title {index}",
+                                   author="author",
+                                   cover="",
+                                   time=datetime.datetime.now())
+        content = [Manuscript.StartChapter(Manuscript.SeparatorConfig(f"Chapter {index}", True)),
+                   f"The text of manuscript number {index}."]
+
+        out_directory = self.temp_path / f"output_{index}"
+        template = Path(latex_pdf_exporter.__file__).parent / "template.tex"
+        latex_pdf_exporter.export(Manuscript(content, config),
+                                  template,
+                                  self.temp_path,
+                                  out_directory,
+                                  "output.tex",
+                                  "english",
+                                  True)
+
+        return out_directory
+
+    def test_concurrent_exports(self):
+        """Several exports running at the same time in threads should not step on each other's toes.
+        """
+        working_dir = os.getcwd()
+        exports = 8
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=exports) as executor:
+            out_directories = list(executor.map(self.export, range(exports)))
+
+        # Nobody should have moved us.
+        self.assertEqual(os.getcwd(), working_dir)
+
+        for index, out_directory in enumerate(out_directories):
+            pdf = (out_directory / "output.pdf").read_text(encoding="utf8")
+            self.assertIn(f"The text of manuscript number {index}.", pdf)
+            self.assertIn(f"Title {index}", pdf)
+
+            # Each build should only contain its own manuscript
+            for other in range(exports):
+                if other != index:
+                    self.assertNotIn(f"The text of manuscript number {other}.", pdf)
+
+            # And the artifacts should have been cleaned up
+            self.assertEqual(sorted(path.name for path in out_directory.iterdir()),
+                             ["chapters", "output.out", "output.pdf"])
+            self.assertEqual(list((out_directory / "chapters").glob("*.tex")), [])
+
+
+class TestLatexPdfExporterDrafts(FakeToolsTestCase):
+    def export(self, chapter_texts, draft_chapters=None) -> str:
+        """Exports a manuscript with one chapter per given text into the same place every time, returning the "PDF".
+        """
+        config = Manuscript.Config(title="title",
+                                   author="author",
+                                   cover="",
+                                   time=datetime.datetime.now())
+        content = []
+        for index, text in enumerate(chapter_texts):
+            content.append(Manuscript.StartChapter(Manuscript.SeparatorConfig(f"Chapter {index}", True)))
+            content.append(text)
+
+        out_directory = self.temp_path / "output"
+        template = Path(latex_pdf_exporter.__file__).parent / "template.tex"
+        latex_pdf_exporter.export(Manuscript(content, config),
+                                  template,
+                                  self.temp_path,
+                                  out_directory,
+                                  "output.tex",
+                                  "english",
+                                  True,
+                                  draft_chapters)
+
+        return (out_directory / "output.pdf").read_text(encoding="utf8")
+
+    def test_full_build_includes_every_chapter(self):
+        """Without a selection, every chapter should make it into the output, and leave its .aux file behind.
+        """
+        pdf = self.export(["first text", "second text", "third text"])
+
+        self.assertNotIn("\\includeonly", pdf)
+        for text in ["first text", "second text", "third text"]:
+            self.assertIn(text, pdf)
+
+        chapters_dir = self.temp_path / "output" / "chapters"
+        self.assertEqual(sorted(path.name for path in chapters_dir.iterdir()),
+                         ["chapter_000.aux", "chapter_001.aux", "chapter_002.aux"])
+
+    def test_draft_build_only_includes_selected_chapters(self):
+        """A draft should only typeset the selected chapters, on top of a previous full build.
+        """
+        self.export(["first text", "second text", "third text"])
+        pdf = self.export(["first text", "second text, revised", "third text"], draft_chapters=[1])
+
+        self.assertIn("\\includeonly{chapters/chapter_001}", pdf)
+        self.assertIn("second text, revised", pdf)
+        self.assertNotIn("first text", pdf)
+        self.assertNotIn("third text", pdf)
+
+    def test_rebuild_takes_a_single_pass(self):
+        """The first build needs a second pass to sort out its bookmarks, but rebuilding should only take one.
+        """
+        self.export(["first text", "second text"])
+        self.assertEqual(self.count_pdflatex_passes(), 2)
+
+        self.export(["first text", "second text"])
+        self.assertEqual(self.count_pdflatex_passes(), 3)
+
+    def test_draft_build_out_of_range(self):
+        """Asking for chapters that don't exist should blow up.
+        """
+        with self.assertRaises(ValueError):
+            self.export(["first text"], draft_chapters=[3])
+
+
+class TestRunToolAsync(unittest.TestCase):
+    def run_python(self, source: str, **kwargs) -> subprocess.CompletedProcess:
+        """Runs the given Python source as an external tool.
+        """
+        return asyncio.run(external_tools.run_tool_async([sys.executable, "-c", textwrap.dedent(source)], **kwargs))
+
+    def test_input_and_output(self):
+        """Input should go in through stdin, and stdout should come back out.
+        """
+        output = self.run_python("import sys; sys.stdout.write(sys.stdin.read().upper())", input=b"hello")
+
+        self.assertEqual(output.stdout, b"HELLO")
+
+    def test_chunked_input_and_stdout_sink(self):
+        """Input given in chunks should be fed in as the tool reads it, and stdout handed to the sink as it comes.
+        """
+        chunks = []
+        output = self.run_python("import sys; sys.stdout.write(sys.stdin.read().upper())",
+                                 input=(part.encode("utf-8") for part in ["hel", "lo ", "world"]),
+                                 stdout_sink=chunks.append)
+
+        self.assertIsNone(output.stdout)
+        self.assertEqual(b"".join(chunks), b"HELLO WORLD")
+
+    def test_streaming(self):
+        """Output should go into the logs line by line when streaming, stderr as warnings.
+        """
+        source = """
+            import sys
+            print("first line")
+            print("second line")
+            print("uh oh", file=sys.stderr)
+        """
+        with self.assertLogs(external_tools.logger, "INFO") as logs:
+            output = self.run_python(source, stream_stdout=True)
+
+        self.assertIsNone(output.stdout)
+        self.assertEqual(output.stderr, b"uh oh\n")
+        self.assertIn(f"INFO:{external_tools.logger.name}:{Path(sys.executable).name}: first line", logs.output)
+        self.assertTrue(any(line.startswith("WARNING") and line.endswith("uh oh") for line in logs.output))
+
+    def test_failure(self):
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            self.run_python("import sys; sys.exit(3)")
+
+        self.assertEqual(context.exception.returncode, 3)
+
+    def test_timeout(self):
+        """A tool that takes too long should be killed, rather than waited on.
+        """
+        with self.assertRaises(subprocess.TimeoutExpired), self.assertLogs(external_tools.logger, "ERROR"):
+            self.run_python("import time; time.sleep(30)", timeout=0.2)
+
+    def test_cancellation(self):
+        """Cancelling a call should kill the tool, and give its slot back.
+        """
+        async def cancel():
+            external_tools.set_max_processes(1)
+            sleeper = [sys.executable, "-c", "import time; time.sleep(30)"]
+            task = asyncio.create_task(external_tools.run_tool_async(sleeper))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+            # If the slot wasn't given back, this would never get to run.
+            return await asyncio.wait_for(external_tools.run_tool_async([sys.executable, "-c", "print('done')"]), 10)
+
+        try:
+            self.assertEqual(asyncio.run(cancel()).stdout.strip(), b"done")
+        finally:
+            external_tools.set_max_processes(external_tools.DEFAULT_MAX_PROCESSES)
+
+
+class TestEpubExporter(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.temp_path = Path(self.temp_dir.name)
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.temp_dir.cleanup()
+
+    def test_export(self):
+        """The exporter should produce a well-formed EPUB, with one document per chapter.
+        """
+        config = Manuscript.Config(title="Fish & Chips",
+                                   author="author",
+                                   cover="",
+                                   time=datetime.datetime(2024, 1, 1))
+        content = ["Before the first chapter.",
+                   Manuscript.StartChapter(Manuscript.SeparatorConfig("One", True)),
+                   "The first chapter.",
+                   Manuscript.StartChapter(Manuscript.SeparatorConfig("Two", False)),
+                   "The second chapter."]
+        out_file = self.temp_path / "output.epub"
+
+        epub_exporter.export(Manuscript(content, config), self.temp_path, out_file)
+
+        with zipfile.ZipFile(out_file) as archive:
+            # The mimetype has to come first, uncompressed.
+            first = archive.infolist()[0]
+            self.assertEqual(first.filename, "mimetype")
+            self.assertEqual(first.compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(archive.read(first), b"application/epub+zip")
+
+            names = archive.namelist()
+            for index in range(3):
+                self.assertIn(f"EPUB/text/chapter_{index:03d}.xhtml", names)
+
+            # Everything XML-ish should be well-formed.
+            for name in names:
+                if name.endswith((".xml", ".xhtml", ".opf", ".ncx")):
+                    xml.dom.minidom.parseString(archive.read(name))
+
+            package = archive.read("EPUB/content.opf").decode("utf-8")
+            self.assertIn("<dc:title>Fish &amp; Chips</dc:title>", package)
+
+            nav = archive.read("EPUB/nav.xhtml").decode("utf-8")
+            self.assertIn(">1 One</a>", nav)
+            self.assertIn(">Two</a>", nav)
+
+    def test_incremental_export(self):
+        """An incremental export should copy unchanged chapters over as they are, and render the changed ones again.
+        """
+        config = Manuscript.Config(title="title",
+                                   author="author",
+                                   cover="",
+                                   time=datetime.datetime(2024, 1, 1))
+        content = [Manuscript.StartChapter(Manuscript.SeparatorConfig("One", True)),
+                   "The first chapter.",
+                   Manuscript.StartChapter(Manuscript.SeparatorConfig("Two", True)),
+                   "The second chapter."]
+        out_file = self.temp_path / "output.epub"
+        epub_exporter.export(Manuscript(content, config), self.temp_path, out_file)
+
+        with zipfile.ZipFile(out_file) as archive:
+            first_chapter = archive.getinfo("EPUB/text/chapter_000.xhtml")
+
+        content[-1] = "The second chapter, revised."
+        with self.assertLogs(epub_exporter_innards.logger, "INFO") as logs:
+            epub_exporter.export(Manuscript(content, config), self.temp_path, out_file, incremental=True)
+
+        self.assertIn("Reused 1 out of 2 chapters", "\n".join(logs.output))
+        self.assertEqual(sorted(path.name for path in self.temp_path.iterdir()), ["output.epub"])
+
+        with zipfile.ZipFile(out_file) as archive:
+            self.assertIsNone(archive.testzip())
+            reused = archive.getinfo("EPUB/text/chapter_000.xhtml")
+            self.assertEqual((reused.CRC, reused.compress_size), (first_chapter.CRC, first_chapter.compress_size))
+            self.assertIn("The first chapter.", archive.read(reused).decode("utf-8"))
+            self.assertIn("revised", archive.read("EPUB/text/chapter_001.xhtml").decode("utf-8"))
+
+            for name in archive.namelist():
+                if name.endswith((".xml", ".xhtml", ".opf", ".ncx")):
+                    xml.dom.minidom.parseString(archive.read(name))
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
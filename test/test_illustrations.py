@@ -0,0 +1,104 @@
+import unittest
+import datetime
+import tempfile
+from pathlib import Path
+
+import test_utils
+test_utils.finagle_dependencies()
+import manuscript_generator_3000.illustrations as illustrations
+from manuscript_generator_3000.manuscript import Manuscript
+
+
+class TestIllustrations(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.illustration_dir = Path(self.temp_dir.name) / "illustrations"
+        self.cache_dir = Path(self.temp_dir.name) / "cache"
+
+        (self.illustration_dir / "maps").mkdir(parents=True)
+        (self.illustration_dir / "cover.png").write_bytes(b"not really a cover")
+        (self.illustration_dir / "maps" / "map.png").write_bytes(b"not really a map")
+        (self.illustration_dir / "unused.png").write_bytes(b"not used at all")
+
+        config = Manuscript.Config(title="title",
+                                   author="author",
+                                   cover="cover.png",
+                                   time=datetime.datetime(2024, 1, 1))
+        content = [Manuscript.StartChapter(Manuscript.SeparatorConfig("One", True)),
+                   "Here be dragons: ![The map](maps/map.png)",
+                   "And again, ![](maps/map.png), and ![](missing.png)."]
+        self.manuscript = Manuscript(content, config)
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.temp_dir.cleanup()
+
+    def test_find_illustrations(self):
+        """Only the illustrations the manuscript uses (and that exist) should be found, once each.
+        """
+        with self.assertLogs(illustrations.logger, "WARNING"):
+            output = illustrations.find_illustrations(self.manuscript, self.illustration_dir)
+
+        self.assertEqual(output, ["cover.png", "maps/map.png"])
+
+    def test_prepare_illustrations(self):
+        """Each profile should get a folder laid out like the illustration folder, holding the prepared images.
+        """
+        output = illustrations.prepare_illustrations(self.manuscript,
+                                                     self.illustration_dir,
+                                                     self.cache_dir,
+                                                     [illustrations.EPUB_PROFILE, illustrations.PDF_PROFILE])
+
+        self.assertEqual(sorted(output), ["epub", "pdf"])
+        for profile_dir in output.values():
+            self.assertEqual((profile_dir / "cover.png").read_bytes(), b"not really a cover")
+            self.assertEqual((profile_dir / "maps" / "map.png").read_bytes(), b"not really a map")
+            self.assertFalse((profile_dir / "unused.png").exists())
+
+    def test_cache(self):
+        """Preparing the same image twice should hand back the same cached file, and different profiles shouldn't mix.
+        """
+        source = self.illustration_dir / "cover.png"
+
+        first = illustrations.prepare_illustration(source, illustrations.EPUB_PROFILE, self.cache_dir)
+        first_mtime = first.stat().st_mtime_ns
+        second = illustrations.prepare_illustration(source, illustrations.EPUB_PROFILE, self.cache_dir)
+        other = illustrations.prepare_illustration(source, illustrations.PDF_PROFILE, self.cache_dir)
+
+        self.assertEqual(first, second)
+        self.assertEqual(second.stat().st_mtime_ns, first_mtime)
+        self.assertNotEqual(first, other)
+
+    def test_cache_invalidated_on_change(self):
+        """If an image changes, it should be prepared again.
+        """
+        source = self.illustration_dir / "cover.png"
+
+        first = illustrations.prepare_illustration(source, illustrations.EPUB_PROFILE, self.cache_dir)
+        source.write_bytes(b"a brand new cover")
+        second = illustrations.prepare_illustration(source, illustrations.EPUB_PROFILE, self.cache_dir)
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(second.read_bytes(), b"a brand new cover")
+
+
+@unittest.skipIf(illustrations.Image is None, "Pillow is not installed.")
+class TestIllustrationsWithPillow(unittest.TestCase):
+    def test_shrink(self):
+        """Images bigger than the profile allows should be shrunk to fit, keeping their aspect ratio and format.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source = Path(temp_dir) / "big.png"
+            illustrations.Image.new("RGB", (4000, 2000), "white").save(source)
+            profile = illustrations.ImageProfile("small", 400, 400, 80)
+
+            prepared = illustrations.prepare_illustration(source, profile, Path(temp_dir) / "cache")
+
+            with illustrations.Image.open(prepared) as image:
+                self.assertEqual(image.size, (400, 200))
+                self.assertEqual(image.format, "PNG")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,16 @@
 import unittest
+import tempfile
+from pathlib import Path
 
 # We need to start by adding the packages we're testing into the path, which is an unfortunate reality of not wanting to
 # install the package just to run unit tests.
 import test_utils
 test_utils.finagle_dependencies()
 
+from manuscript_generator_3000.importers import markdown_guide_file_importer
 from manuscript_generator_3000.importers import markdown_index_file_importer
 from manuscript_generator_3000.importers import markdown_single_file_importer
+from manuscript_generator_3000.manuscript import Manuscript
 
 
 class TestImporters(unittest.TestCase):
@@ -15,5 +19,56 @@ class TestImporters(unittest.TestCase):
         pass
 
 
+class TestGuideFileImporter(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root_folder = Path(self.temp_dir.name)
+        self.guide_file = self.root_folder / "Guide.md"
+
+        self.write_file("Guide.md", ["# Planning",
+                                     "Whatever comes to mind.",
+                                     "## First Book",
+                                     "- \U0001F4DA -- Title: First",
+                                     "- \U0001F4DA [[One]]",
+                                     "## Second Book",
+                                     "- \U0001F4DA -- Title: Second",
+                                     "- \U0001F4DA -- Chapter",
+                                     "- \U0001F4DA [[Two]]",
+                                     "- \U0001F4DA [[Three]]",
+                                     "# Elsewhere",
+                                     "- \U0001F4DA [[One]]"])
+        self.write_file("Scenes/One.md", ["First scene."])
+        self.write_file("Scenes/Two.md", ["Second scene.", "![[Shared]]"])
+        self.write_file("Scenes/Three.md", ["Third scene."])
+        self.write_file("Shared.md", ["Shared text."])
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.temp_dir.cleanup()
+
+    def write_file(self, name: str, lines: list) -> None:
+        path = self.root_folder / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    def test_heading(self):
+        """Only what's under the given heading should make it into the manuscript, and only its files into sources.
+        """
+        manuscript = markdown_guide_file_importer.load_manuscript_from_guide_file(self.guide_file,
+                                                                                  "Second Book",
+                                                                                  self.root_folder)
+
+        self.assertEqual(manuscript.config.title, "Second")
+        self.assertEqual(manuscript.content, [Manuscript.StartChapter(Manuscript.SeparatorConfig("", True)),
+                                              "Second scene.",
+                                              "Shared text.",
+                                              "Third scene."])
+        self.assertEqual(manuscript.sources, [self.guide_file,
+                                              self.root_folder / "Scenes" / "Two.md",
+                                              self.root_folder / "Shared.md",
+                                              self.root_folder / "Scenes" / "Three.md"])
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,185 @@
+import unittest
+import asyncio
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import test_utils
+test_utils.finagle_dependencies()
+import manuscript_generator_3000.instrumentation as instrumentation
+from manuscript_generator_3000.importers import markdown_index_file_importer
+from manuscript_generator_3000.exporters import external_tools
+from manuscript_generator_3000.exporters import markdown_exporter
+from manuscript_generator_3000.benchmarks import benchmarks
+from manuscript_generator_3000.benchmarks import synthetic_vault
+
+EXAMPLE_PATH = Path(__file__).parents[1] / "example"
+
+
+class TestInstrumentation(unittest.TestCase):
+    def tearDown(self) -> None:
+        super().tearDown()
+        instrumentation.disable()
+
+    def test_disabled(self):
+        """With recording off, stages should be the same do-nothing object every time, and counters go nowhere.
+        """
+        self.assertIs(instrumentation.stage("one"), instrumentation.stage("two"))
+        instrumentation.count("nothing")
+        self.assertIsNone(instrumentation.disable())
+
+    def test_stages_and_counters(self):
+        recorder = instrumentation.enable()
+
+        with instrumentation.stage("outer"):
+            with instrumentation.stage("inner", "subprocess", file="a.md"):
+                instrumentation.count("files_read")
+                instrumentation.count("bytes_read", 100)
+            instrumentation.count("files_read")
+
+        self.assertIs(instrumentation.disable(), recorder)
+        stages, counters = recorder.snapshot()
+
+        # Stages are recorded as they end, so the inner one comes first.
+        self.assertEqual([record.name for record in stages], ["inner", "outer"])
+        inner, outer = stages
+        self.assertEqual(inner.category, "subprocess")
+        self.assertEqual(inner.args, {"file": "a.md"})
+        self.assertGreaterEqual(inner.start, outer.start)
+        self.assertLessEqual(inner.start + inner.duration, outer.start + outer.duration)
+        self.assertEqual(counters, {"files_read": 2, "bytes_read": 100})
+
+    def test_timed(self):
+        """Decorated functions and coroutine functions should both be timed, and still return what they return.
+        """
+        @instrumentation.timed("function")
+        def function(value):
+            return value * 2
+
+        @instrumentation.timed("coroutine")
+        async def coroutine(value):
+            await asyncio.sleep(0)
+            return value * 3
+
+        recorder = instrumentation.enable()
+        self.assertEqual(function(2), 4)
+        self.assertEqual(asyncio.run(coroutine(2)), 6)
+
+        self.assertEqual(recorder.summarize().keys(), {"function", "coroutine"})
+        self.assertEqual(function.__name__, "function")
+
+    def test_import_is_instrumented(self):
+        """Importing a manuscript should leave a trail of stages and counters behind.
+        """
+        recorder = instrumentation.enable()
+        markdown_index_file_importer.load_manuscript_from_index_file(
+            EXAMPLE_PATH / "The Unimaginative Software Engineer.md", EXAMPLE_PATH)
+
+        summary = recorder.summarize()
+        _, counters = recorder.snapshot()
+        self.assertEqual(summary["import.index_file"]["count"], 1)
+        self.assertIn("import.read_files", summary)
+        self.assertEqual(counters["files_read"], 5)
+        self.assertGreater(counters["bytes_read"], 0)
+        self.assertGreater(counters["lines_read"], 0)
+
+    def test_output_formats(self):
+        recorder = instrumentation.enable()
+        with instrumentation.stage("stage", file=Path("a.md")):
+            instrumentation.count("files_read")
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            stats_file = Path(temp_dir) / "stats.json"
+            trace_file = Path(temp_dir) / "trace.json"
+            instrumentation.write_json(recorder, stats_file)
+            instrumentation.write_chrome_trace(recorder, trace_file)
+
+            stats = json.loads(stats_file.read_text(encoding="utf8"))
+            trace = json.loads(trace_file.read_text(encoding="utf8"))
+
+        self.assertEqual(stats["counters"], {"files_read": 1})
+        self.assertEqual(stats["summary"]["stage"]["count"], 1)
+        self.assertEqual(stats["stages"][0]["name"], "stage")
+
+        complete, counter = trace["traceEvents"]
+        self.assertEqual((complete["name"], complete["ph"]), ("stage", "X"))
+        self.assertEqual(complete["args"], {"file": "a.md"})
+        self.assertEqual((counter["ph"], counter["args"]), ("C", {"files_read": 1}))
+
+
+class TestMemory(unittest.TestCase):
+    def tearDown(self) -> None:
+        super().tearDown()
+        instrumentation.disable()
+
+    def test_stage_peaks(self):
+        """Stages should get the peak of what was allocated while they ran, nested stages included, but not before.
+        """
+        recorder = instrumentation.enable(track_memory=True)
+
+        before = bytearray(4 * 2**20)
+        del before
+        with instrumentation.stage("outer"):
+            with instrumentation.stage("inner"):
+                data = bytearray(2 * 2**20)
+                del data
+            with instrumentation.stage("small"):
+                pass
+
+        stages, _ = recorder.snapshot()
+        inner, small, outer = stages
+        self.assertGreaterEqual(inner.python_peak, 2 * 2**20)
+        self.assertLess(inner.python_peak, 4 * 2**20)
+        self.assertLess(small.python_peak, 2**20)
+        self.assertGreaterEqual(outer.python_peak, inner.python_peak)
+        self.assertEqual(outer.child_peak_rss, 0)
+        self.assertEqual(recorder.summarize()["inner"]["python_peak"], inner.python_peak)
+
+        with instrumentation.stage("untracked"):
+            pass
+        instrumentation.enable()
+        with instrumentation.stage("untracked"):
+            pass
+        self.assertIsNone(instrumentation.disable().snapshot()[0][0].python_peak)
+
+    def test_tools(self):
+        """External tools should count towards the stages they ran in, async or not.
+        """
+        recorder = instrumentation.enable(track_memory=True)
+        allocate = [sys.executable, "-c", "import time; data = bytearray(64 * 2**20); time.sleep(0.2)"]
+
+        with instrumentation.stage("sync"):
+            external_tools.run_tool(allocate, check=True)
+        with instrumentation.stage("async"):
+            asyncio.run(external_tools.run_tool_async(allocate))
+
+        summary = recorder.summarize()
+        self.assertGreaterEqual(summary["sync"]["child_peak_rss"], 64 * 2**20)
+        self.assertGreaterEqual(summary["async"]["child_peak_rss"], 64 * 2**20)
+        self.assertGreaterEqual(summary[f"tool.{Path(sys.executable).name}"]["child_peak_rss"], 64 * 2**20)
+
+    def test_budgets(self):
+        """Importing and exporting a large manuscript should stay within a few times the size of its files.
+        """
+        with tempfile.TemporaryDirectory() as temp_dir:
+            vault = synthetic_vault.generate_vault(Path(temp_dir) / "vault",
+                                                   *benchmarks.SIZES["large"],
+                                                   synthetic_vault.DelimiterMode.EMOJI)
+            vault_size = sum(file.stat().st_size for file in vault.scene_files)
+
+            recorder = instrumentation.enable(track_memory=True)
+            manuscript = markdown_index_file_importer.load_manuscript_from_index_file(vault.index_file,
+                                                                                      vault.root_folder)
+            markdown_exporter.export(manuscript, Path(temp_dir) / "output.md")
+            instrumentation.disable()
+
+        test_utils.assert_within_memory_budgets(self, recorder, {"import.index_file": 4 * vault_size,
+                                                                 "export.markdown": vault_size // 4})
+        with self.assertRaises(AssertionError):
+            test_utils.assert_within_memory_budgets(self, recorder, {"export.markdown": 1, "never": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
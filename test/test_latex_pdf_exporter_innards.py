@@ -0,0 +1,244 @@
+import unittest
+import datetime
+import os
+import tempfile
+from pathlib import Path
+
+# We need to start by adding the packages we're testing into the path, which is an unfortunate reality of not wanting to
+# install the package just to run unit tests.
+import test_utils
+test_utils.finagle_dependencies()
+
+from manuscript_generator_3000.exporters import latex_pdf_exporter_innards as innards
+from manuscript_generator_3000.manuscript import Manuscript
+
+
+class TestCompileTemplate(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.template = Path(self.temp_dir.name) / "template.tex"
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.temp_dir.cleanup()
+
+    def test_placeholders_split_static_chunks(self):
+        """Placeholders should split the template into static chunks, even when several share a line.
+        """
+        self.template.write_text("before TITLE_HERE by AUTHOR_HERE\nafter\n", encoding="utf8")
+
+        compiled = innards.compile_template(self.template)
+
+        self.assertEqual(compiled.placeholders, (innards.TITLE_LOCATION, innards.AUTHOR_LOCATION))
+        self.assertEqual(compiled.static_chunks, ("before ", " by ", "\nafter\n"))
+
+    def test_render(self):
+        """Rendering should put the substitutions in place of the placeholders.
+        """
+        self.template.write_text("TITLE_HERE, TITLE_HERE, by AUTHOR_HERE", encoding="utf8")
+
+        compiled = innards.compile_template(self.template)
+        output = compiled.render({innards.TITLE_LOCATION: "Title", innards.AUTHOR_LOCATION: "Author"})
+
+        self.assertEqual("".join(output), "Title, Title, by Author")
+
+    def test_cache(self):
+        """Compiling the same, unchanged template twice should give us back the very same plan.
+        """
+        self.template.write_text("TITLE_HERE", encoding="utf8")
+
+        first = innards.compile_template(self.template)
+        second = innards.compile_template(self.template)
+
+        self.assertIs(first, second)
+
+    def test_cache_invalidated_on_change(self):
+        """If the template changes on disk, we should get a fresh plan.
+        """
+        self.template.write_text("TITLE_HERE", encoding="utf8")
+        first = innards.compile_template(self.template)
+
+        # Make sure the mtime moves, however coarse the filesystem clock might be.
+        self.template.write_text("AUTHOR_HERE", encoding="utf8")
+        os.utime(self.template, ns=(first.mtime_ns + 1_000_000_000, first.mtime_ns + 1_000_000_000))
+        second = innards.compile_template(self.template)
+
+        self.assertIsNot(first, second)
+        self.assertEqual(second.placeholders, (innards.AUTHOR_LOCATION,))
+
+
+class TestLoadContentsOntoTemplate(unittest.TestCase):
+    def test_package_template(self):
+        """Loading contents onto the template that ships with the package should leave no placeholders behind.
+        """
+        template = Path(innards.__file__).parent / "template.tex"
+        config = Manuscript.Config(title="The Title",
+                                   author="The Author",
+                                   cover="",
+                                   time=datetime.datetime(2024, 1, 1))
+
+        output = "".join(innards.load_contents_onto_template("THE CONTENT",
+                                                             config,
+                                                             template,
+                                                             Path("/illustrations"),
+                                                             "english"))
+
+        for placeholder in innards.TEMPLATE_PLACEHOLDERS:
+            self.assertNotIn(placeholder, output)
+        self.assertIn("THE CONTENT", output)
+        self.assertIn("The Title", output)
+        self.assertIn("The Author", output)
+        self.assertIn("2024-01-01T00:00:00", output)
+        self.assertIn(r"\usepackage[english]{babel}", output)
+        self.assertIn(innards.NO_COVER_FILE_LATEX_COMMAND, output)
+
+
+class TestSplitContentIntoChapters(unittest.TestCase):
+    def test_chapters(self):
+        """Every chapter should get its own section, and any text before the first one gets its own too.
+        """
+        chapter = Manuscript.StartChapter(Manuscript.SeparatorConfig("", True))
+        content = ["preamble", chapter, "text", Manuscript.BreakScene(), "more text", chapter, "even more text"]
+
+        output = innards.split_content_into_chapters(content)
+
+        self.assertEqual(output, [["preamble"],
+                                  [chapter, "text", Manuscript.BreakScene(), "more text"],
+                                  [chapter, "even more text"]])
+
+    def test_parts(self):
+        """A chapter that immediately follows a part should stay with that part.
+        """
+        part = Manuscript.StartPart(Manuscript.SeparatorConfig("", True))
+        chapter = Manuscript.StartChapter(Manuscript.SeparatorConfig("", True))
+        content = [part, chapter, "text", chapter, "more text", part, "part text", chapter, "chapter text"]
+
+        output = innards.split_content_into_chapters(content)
+
+        self.assertEqual(output, [[part, chapter, "text"],
+                                  [chapter, "more text"],
+                                  [part, "part text"],
+                                  [chapter, "chapter text"]])
+
+    def test_empty(self):
+        """No content, no sections.
+        """
+        self.assertEqual(innards.split_content_into_chapters([]), [])
+
+
+class TestChapterFileWriter(unittest.TestCase):
+    def test_split_across_chunks(self):
+        """Sections should end up in their own files, however pandoc's output happens to be chopped up on the way.
+        """
+        sections = ["\\chapter{One}\n\nfirst\n", "\\chapter{Two}\n\nsecond\n", "\\chapter{Three}\n\nthird"]
+        latex = (innards.SECTION_BREAK_MARKER + "\n").join(sections).encode("utf-8")
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for chunk_size in [1, 7, len(latex)]:
+                chapter_files = [Path(temp_dir) / f"{chunk_size}_{index}.tex" for index in range(3)]
+                writer = innards._ChapterFileWriter(chapter_files)
+                for start in range(0, len(latex), chunk_size):
+                    writer(latex[start:start + chunk_size])
+                writer.flush()
+                writer.close()
+
+                self.assertEqual(writer.sections, 3)
+                self.assertEqual([file.read_text(encoding="utf8") for file in chapter_files],
+                                 latex.decode("utf-8").split(innards.SECTION_BREAK_MARKER))
+
+    def test_too_many_sections(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            writer = innards._ChapterFileWriter([Path(temp_dir) / "only.tex"])
+            with self.assertRaises(ValueError), self.assertLogs(innards.logger, "ERROR"):
+                writer(f"one\n{innards.SECTION_BREAK_MARKER}\ntwo\n".encode("utf-8"))
+            writer.close()
+
+
+class TestComputeTocEntries(unittest.TestCase):
+    def test_numbering(self):
+        """Parts get Roman numerals, chapters carry on counting across parts, and unnumbered entries don't count.
+        """
+        content = [
+            Manuscript.StartChapter(Manuscript.SeparatorConfig("Prologue", False)),
+            Manuscript.StartPart(Manuscript.SeparatorConfig("Part One", True)),
+            Manuscript.StartChapter(Manuscript.SeparatorConfig("One", True)),
+            "text",
+            Manuscript.StartChapter(Manuscript.SeparatorConfig("Two", True)),
+            Manuscript.StartPart(Manuscript.SeparatorConfig("Part Two", True)),
+            Manuscript.StartChapter(Manuscript.SeparatorConfig("Three", True)),
+        ]
+
+        output = innards.compute_toc_entries(content)
+
+        self.assertEqual(output, [innards.TocEntry("chapter", None, "Prologue"),
+                                  innards.TocEntry("part", "I", "Part One"),
+                                  innards.TocEntry("chapter", "1", "One"),
+                                  innards.TocEntry("chapter", "2", "Two"),
+                                  innards.TocEntry("part", "II", "Part Two"),
+                                  innards.TocEntry("chapter", "3", "Three")])
+
+
+class TestPrepareTocFile(unittest.TestCase):
+    AUX_CONTENTS = [
+        "\\relax \n"
+        "\\@writefile{toc}{\\contentsline {chapter}{Prologue}{3}{chapter*.1}\\protected@file@percent }\n",
+        "\\relax \n"
+        "\\@writefile{toc}{\\contentsline {chapter}{\\numberline {1}One}{7}{chapter.1}\\protected@file@percent }\n"
+        "\\setcounter{page}{12}\n",
+    ]
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.out_directory = Path(self.temp_dir.name)
+
+        chapters_dir = self.out_directory / innards.CHAPTERS_DIRECTORY_NAME
+        chapters_dir.mkdir()
+        for index, contents in enumerate(self.AUX_CONTENTS):
+            (self.out_directory / innards.get_chapter_include_name(index)).with_suffix(".aux").write_text(contents)
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.temp_dir.cleanup()
+
+    def test_same_structure(self):
+        """If the structure of the book is unchanged, the .toc should be written with the previous page numbers.
+        """
+        content = [Manuscript.StartChapter(Manuscript.SeparatorConfig("Prologue", False)),
+                   "text",
+                   Manuscript.StartChapter(Manuscript.SeparatorConfig("One, renamed", True)),
+                   "more text"]
+
+        written = innards.prepare_toc_file(content, 2, "output.tex", self.out_directory)
+
+        self.assertTrue(written)
+        self.assertEqual((self.out_directory / "output.toc").read_text().splitlines(),
+                         ["\\contentsline {chapter}{Prologue}{3}{chapter*.1}%",
+                          "\\contentsline {chapter}{\\numberline {1}One}{7}{chapter.1}%"])
+
+    def test_changed_structure(self):
+        """If the structure of the book changed, there's nothing we can do up front.
+        """
+        content = [Manuscript.StartChapter(Manuscript.SeparatorConfig("Prologue", True)),
+                   "text",
+                   Manuscript.StartChapter(Manuscript.SeparatorConfig("One", True)),
+                   "more text"]
+
+        written = innards.prepare_toc_file(content, 2, "output.tex", self.out_directory)
+
+        self.assertFalse(written)
+        self.assertFalse((self.out_directory / "output.toc").exists())
+
+    def test_no_previous_build(self):
+        """Without .aux files from a previous build, there's nothing we can do up front either.
+        """
+        content = [Manuscript.StartChapter(Manuscript.SeparatorConfig("Prologue", False))]
+
+        written = innards.prepare_toc_file(content, 3, "output.tex", self.out_directory)
+
+        self.assertFalse(written)
+
+
+if __name__ == '__main__':
+    unittest.main()
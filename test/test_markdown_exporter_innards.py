@@ -27,6 +27,28 @@ class TestConvertContentToLines(unittest.TestCase):
         self.assertEqual(len(output), 3)
         self.assertEqual(output[1], "## Test Title {.unnumbered}")
 
+    def test_part_break(self):
+        """Parts should become top-level headings (and nothing else), or nothing at all when ignoring parts.
+        """
+        start_part = Manuscript.StartPart(Manuscript.SeparatorConfig("Part One", True))
+        start_chapter = Manuscript.StartChapter(Manuscript.SeparatorConfig("Chapter One", True))
+        content = [start_part, start_chapter, "text"]
+
+        self.assertEqual(innards.convert_content_to_lines(content), ["# Part One", "## Chapter One", "text"])
+        self.assertEqual(innards.convert_content_to_lines(content, ignore_parts=True), ["# Chapter One", "text"])
+
+
+class TestChunkContentLines(unittest.TestCase):
+    def test_same_as_concatenating(self):
+        """However small the chunks, gluing them back together should give the concatenated lines.
+        """
+        lines = ["first", "sécond", "", "third"]
+        for chunk_size in [1, 3, 100]:
+            chunks = list(innards.chunk_content_lines(lines, chunk_size))
+            self.assertEqual("".join(chunks), innards.concatenate_content_lines_into_string(lines))
+
+        self.assertEqual(list(innards.chunk_content_lines([])), [])
+
 
 if __name__ == '__main__':
     unittest.main()
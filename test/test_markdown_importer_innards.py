@@ -1,4 +1,6 @@
 import unittest
+import tempfile
+from unittest import mock
 from typing import List
 from pathlib import Path
 
@@ -406,5 +408,205 @@ class TestExtractRelevantLinesFromIndexFileEmojiMode(unittest.TestCase):
         self.assertEqual(relevant_lines, relevant_lines)
 
 
+class TestListMarkdownFiles(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root_folder = Path(self.temp_dir.name)
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.temp_dir.cleanup()
+
+    def list_files(self, *args, **kwargs) -> List[str]:
+        return [path.relative_to(self.root_folder).as_posix()
+                for path in innards.list_markdown_files(self.root_folder, *args, **kwargs)]
+
+    def test_ignored(self):
+        """Only markdown files should be listed, and none of those the default patterns or the ignore file leave out.
+        """
+        for name in ["a.md", "a.md.bak", "a.markdown", ".obsidian/workspace.md", ".trash/old.md", "output/output.md",
+                     "drafts/b.md", "drafts/b.draft.md", "drafts/keep.draft.md", "drafts/old/c.md",
+                     "attachments/d.md", "nested/attachments/e.md", "nested/f.md"]:
+            (self.root_folder / name).parent.mkdir(parents=True, exist_ok=True)
+            (self.root_folder / name).write_text("text", encoding="utf-8")
+
+        (self.root_folder / innards.IGNORE_FILE_NAME).write_text(
+            "# Comments are fine\n/attachments/\n*.draft.md\n!keep.draft.md\ndrafts/**/c.md\n", encoding="utf-8")
+
+        self.assertEqual(self.list_files(),
+                         ["a.md", "drafts/b.md", "drafts/keep.draft.md", "nested/attachments/e.md", "nested/f.md"])
+        self.assertEqual(self.list_files(["nested/"], None, max_workers=1),
+                         [".obsidian/workspace.md", ".trash/old.md", "a.md", "attachments/d.md", "drafts/b.draft.md",
+                          "drafts/b.md", "drafts/keep.draft.md", "drafts/old/c.md", "output/output.md"])
+
+    def test_pruned(self):
+        """Ignored folders shouldn't even be looked into.
+        """
+        (self.root_folder / ".git" / "objects").mkdir(parents=True)
+        (self.root_folder / "a.md").write_text("text", encoding="utf-8")
+
+        with mock.patch.object(innards, "_scan_folder", wraps=innards._scan_folder) as scan:
+            self.assertEqual(self.list_files(), ["a.md"])
+        self.assertEqual(scan.call_count, 1)
+
+
+class TestVault(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root_folder = Path(self.temp_dir.name)
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.temp_dir.cleanup()
+
+    def write_note(self, name: str, content: List[str]) -> Path:
+        """Writes a note with the given lines into the vault.
+        """
+        path = self.root_folder / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("\n".join(content) + "\n", encoding="utf-8")
+        return path
+
+    def test_embeds(self):
+        """Embeds should be replaced with what they embed, headings and nested embeds included.
+        """
+        self.write_note("Scene.md", ["First line", "![[Shared]]", "She said ![[Notes/Motto#Motto]] and left."])
+        self.write_note("Shared.md", ["---", "tags: shared", "---", "Shared text", "![[Motto#Motto|the motto]]"])
+        self.write_note("Notes/Motto.md", ["# Motto", "Never give up", "## Really", "Never", "# Other", "Other text"])
+
+        vault = innards.Vault(self.root_folder)
+        output = vault.read_file("Scene")
+
+        self.assertEqual(output, ["First line",
+                                  "Shared text",
+                                  "# Motto",
+                                  "Never give up",
+                                  "## Really",
+                                  "Never",
+                                  "She said # Motto Never give up ## Really Never and left."])
+        self.assertEqual([path.name for path in vault.dependencies], ["Scene.md", "Shared.md", "Motto.md"])
+
+    def test_not_notes(self):
+        """Embeds of anything other than notes should be left alone.
+        """
+        self.write_note("Scene.md", ["![[picture.png]]", "A ![[picture.png|100]] inline"])
+
+        self.assertEqual(innards.Vault(self.root_folder).read_file("Scene"),
+                         ["![[picture.png]]", "A ![[picture.png|100]] inline"])
+
+    def test_memoized(self):
+        """Notes embedded several times should only be read and resolved once.
+        """
+        self.write_note("Scene.md", ["![[Shared]]", "![[Shared]]", "![[Shared#Heading]]"])
+        self.write_note("Shared.md", ["# Heading", "text"])
+
+        vault = innards.Vault(self.root_folder)
+        with mock.patch.object(innards, "_extract_heading_section", wraps=innards._extract_heading_section) as extract:
+            output = vault.read_file("Scene")
+            vault.read_file("Scene")
+
+        self.assertEqual(output, ["# Heading", "text"] * 3)
+        self.assertEqual(extract.call_count, 1)
+        self.assertEqual(len(vault.dependencies), 2)
+
+    def test_errors(self):
+        """Cycles and embeds going too deep should be errors.
+        """
+        self.write_note("Cycle.md", ["![[Loop]]"])
+        self.write_note("Loop.md", ["text", "![[Cycle]]"])
+        self.write_note("Deep.md", ["![[Deeper]]"])
+        self.write_note("Deeper.md", ["![[Deepest]]"])
+        self.write_note("Deepest.md", ["text"])
+
+        vault = innards.Vault(self.root_folder, max_embed_depth=1)
+        with self.assertLogs(innards.logger, "ERROR"):
+            for filename in ["Cycle", "Deep"]:
+                with self.assertRaises(ValueError):
+                    vault.read_file(filename)
+
+    def test_missing(self):
+        """Embeds of notes or headings that aren't there should be warned about, and left as they are.
+        """
+        self.write_note("Scene.md", ["![[Nowhere]]", "See ![[Deepest#Nowhere]] here", "![[Deepest]]"])
+        self.write_note("Deepest.md", ["text"])
+
+        with self.assertLogs(innards.logger, "WARNING") as logs:
+            output = innards.Vault(self.root_folder).read_file("Scene")
+
+        self.assertEqual(output, ["![[Nowhere]]", "See ![[Deepest#Nowhere]] here", "text"])
+        self.assertEqual(len(logs.records), 2)
+
+
+class TestGuideFile(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.guide_file = Path(self.temp_dir.name) / "Guide.md"
+        self.write_guide(["# Books",
+                          "## First Book",
+                          "- [[Intro]]",
+                          "### Notes",
+                          "- [[Notes]]",
+                          "```",
+                          "## Second Book",
+                          "```",
+                          "## Second Book",
+                          "- 📚 [[Second]]",
+                          "# Appendix",
+                          "- [[Appendix]]"])
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.temp_dir.cleanup()
+        innards._guide_file_headings.clear()
+
+    def write_guide(self, content: List[str]) -> None:
+        self.guide_file.write_text("\n".join(content) + "\n", encoding="utf-8")
+
+    def read_section(self, title: str) -> List[str]:
+        start, end = innards.find_heading_section(self.guide_file, title)
+        return self.guide_file.read_bytes()[start:end].decode("utf-8").splitlines()
+
+    def test_sections(self):
+        """Sections should run up to the next heading of the same or a higher level, ignoring fenced code.
+        """
+        self.assertEqual(self.read_section("first book"), ["- [[Intro]]", "### Notes", "- [[Notes]]",
+                                                           "```", "## Second Book", "```"])
+        self.assertEqual(self.read_section("Second Book"), ["- 📚 [[Second]]"])
+        self.assertEqual(self.read_section("Appendix"), ["- [[Appendix]]"])
+        self.assertEqual(innards.extract_relevant_lines_from_guide_file(self.guide_file,
+                                                                        "Second Book",
+                                                                        innards.DelimiterMode.EMOJI),
+                         ["- 📚 [[Second]]"])
+
+    def test_scanned_once(self):
+        """Headings should be remembered, and the file only scanned again once it changes.
+        """
+        with mock.patch.object(innards, "_scan_headings", wraps=innards._scan_headings) as scan:
+            # Once to find the heading, and once more to find where its section ends.
+            self.read_section("First Book")
+            self.read_section("First Book")
+            self.assertEqual(scan.call_count, 2)
+
+            # Only the rest of the file is left to scan, once (in two goes, again).
+            self.read_section("Appendix")
+            self.read_section("Books")
+            self.read_section("Second Book")
+            self.assertEqual(scan.call_count, 4)
+
+            self.write_guide(["# Third Book", "- [[Third]]", "more text so the size changes"])
+            self.assertEqual(self.read_section("Third Book"), ["- [[Third]]", "more text so the size changes"])
+            self.assertEqual(scan.call_count, 6)
+
+    def test_missing(self):
+        """Headings that aren't there should be errors.
+        """
+        with self.assertLogs(innards.logger, "ERROR"):
+            with self.assertRaises(ValueError):
+                innards.find_heading_section(self.guide_file, "Third Book")
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,156 @@
+import unittest
+import tempfile
+from pathlib import Path
+
+# We need to start by adding the packages we're testing into the path, which is an unfortunate reality of not wanting to
+# install the package just to run unit tests.
+import test_utils
+test_utils.finagle_dependencies()
+
+from manuscript_generator_3000.page_count import page_count
+from manuscript_generator_3000.manuscript import Manuscript
+from manuscript_generator_3000.exporters import latex_pdf_exporter
+from manuscript_generator_3000.exporters import latex_pdf_exporter_innards
+from manuscript_generator_3000.importers import markdown_index_file_importer
+from test_utils import chapter
+
+TEMPLATE = Path(latex_pdf_exporter.__file__).parent / "template.tex"
+EXAMPLE_FOLDER = Path(__file__).parent.parent / "example"
+
+
+def create_content(paragraphs_per_chapter: list) -> Manuscript.Content:
+    content = []
+    for index, paragraphs in enumerate(paragraphs_per_chapter):
+        content.append(chapter(f"Chapter {index}"))
+        content.extend(["word " * 100] * paragraphs)
+
+    return content
+
+
+class TestReadLayout(unittest.TestCase):
+    def test_default_template(self):
+        layout = page_count.read_layout(TEMPLATE)
+
+        self.assertAlmostEqual(layout.text_width, (148 - 40) * page_count.POINTS_PER_UNIT["mm"])
+        self.assertAlmostEqual(layout.text_height, (210 - 40) * page_count.POINTS_PER_UNIT["mm"])
+        self.assertEqual(layout.font_size, 10)
+        self.assertEqual(layout.line_spread, 1.25)
+        self.assertEqual(layout.paragraph_skip, 6.0)
+        self.assertTrue(layout.chapters_open_right)
+        # The title page doesn't reset the page counter in a two-sided book.
+        self.assertEqual((layout.first_page, layout.extra_pages), (2, 0))
+        self.assertTrue(layout.ends_on_even_page)
+
+    def test_other_template(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            template = Path(temp_dir) / "template.tex"
+            template.write_text("\n".join([r"\documentclass[11pt, oneside]{report}",
+                                           r"\usepackage[a4paper, top=3cm, bottom=20mm, hmargin=1in]{geometry}",
+                                           r"% \geometry{margin=5cm}",
+                                           r"\doublespacing",
+                                           r"\begin{document}",
+                                           r"\begin{titlepage}\end{titlepage}",
+                                           r"LATEX_FILE_HERE",
+                                           r"\cleardoublepage",
+                                           r"\end{document}"]),
+                                encoding="utf8")
+            layout = page_count.read_layout(template)
+
+        self.assertAlmostEqual(layout.text_width, 210 * page_count.POINTS_PER_UNIT["mm"] - 2 * 72.27)
+        self.assertAlmostEqual(layout.text_height, 247 * page_count.POINTS_PER_UNIT["mm"])
+        self.assertEqual(layout.font_size, 11)
+        self.assertEqual(layout.line_spread, page_count.SPACING_COMMANDS["doublespacing"])
+        self.assertEqual(layout.paragraph_skip, 0.0)
+        self.assertFalse(layout.chapters_open_right)
+        self.assertEqual((layout.first_page, layout.extra_pages), (1, 1))
+        self.assertFalse(layout.ends_on_even_page)
+
+
+class TestEstimatePages(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.layout = page_count.read_layout(TEMPLATE)
+
+    def test_sections(self):
+        """Chapters should start on right-hand pages, with blank pages before them where need be.
+        """
+        # Paragraphs take up 9 lines (141pt, with the space after them), so the second chapter takes up a bit less than
+        # 12 pages of 483.7pt, heading (165pt) included.
+        content = create_content([1, 39, 1])
+        content[2:2] = [Manuscript.BreakScene(), "A short paragraph."]
+        estimate = page_count.estimate_pages(Manuscript(content, None), self.layout)
+
+        self.assertEqual([(section.start_page, section.blank_pages) for section in estimate.sections],
+                         [(3, 1), (5, 1), (17, 0)])
+        self.assertEqual([section.pages for section in estimate.sections], [1, 12, 1])
+        self.assertEqual(estimate.sections[1].title, "Chapter 1")
+        # The template ends on an even page.
+        self.assertEqual(estimate.total_pages, 18)
+
+    def test_example(self):
+        """The example should come out as long as its actual PDF.
+        """
+        manuscript = markdown_index_file_importer.load_manuscript_from_index_file(
+            EXAMPLE_FOLDER / "The Unimaginative Software Engineer.md", EXAMPLE_FOLDER)
+
+        self.assertEqual(page_count.estimate_pages(manuscript, self.layout).total_pages, 10)
+
+
+class TestCalibrate(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.out_directory = Path(self.temp_dir.name)
+        self.layout = page_count.read_layout(TEMPLATE)
+        self.manuscript = Manuscript(create_content([30, 5, 60, 12]), None)
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.temp_dir.cleanup()
+
+    def write_build(self, estimate: page_count.PageEstimate, extra_pages: int) -> None:
+        """Writes the .aux and .log files a build laid out as the given estimate would leave behind.
+        """
+        (self.out_directory / latex_pdf_exporter_innards.CHAPTERS_DIRECTORY_NAME).mkdir(exist_ok=True)
+        for section in estimate.sections:
+            name = latex_pdf_exporter_innards.get_chapter_include_name(section.index)
+            (self.out_directory / name).with_suffix(".aux").write_text(
+                "\\relax \n"
+                f"\\@writefile{{toc}}{{\\contentsline {{chapter}}{{\\numberline {{{section.index + 1}}}Chapter}}"
+                f"{{{section.start_page}}}{{chapter.{section.index + 1}}}\\protected@file@percent }}\n"
+                f"\\@setckpt{{{name}}}{{\n"
+                f"\\setcounter{{page}}{{{section.start_page + section.pages}}}\n"
+                "\\setcounter{chapter}{1}\n"
+                "}\n",
+                encoding="utf8")
+
+        # TeX wraps its log, so the page count might not be on the same line as the rest.
+        (self.out_directory / "output.log").write_text(
+            "Output written on /somewhere/rather/long/output.pd\n"
+            f"f ({estimate.total_pages + extra_pages} pages, 123456 bytes).\n",
+            encoding="utf8")
+
+    def test_calibrate(self):
+        """Calibrating against a build should make estimates match it.
+        """
+        build = page_count.estimate_pages(self.manuscript, self.layout, page_count.Calibration(scale=1.6))
+        self.write_build(build, 3)
+
+        calibration = page_count.calibrate(self.manuscript, self.layout, self.out_directory)
+        self.assertAlmostEqual(calibration.scale, 1.6, delta=0.1)
+        self.assertEqual(calibration.extra_pages, 3)
+
+        estimate = page_count.estimate_pages(self.manuscript, self.layout, calibration)
+        self.assertEqual([section.pages for section in estimate.sections],
+                         [section.pages for section in build.sections])
+        self.assertEqual(estimate.total_pages, build.total_pages + 3)
+
+    def test_no_build(self):
+        """Without a build to calibrate against, nothing should change.
+        """
+        calibration = page_count.calibrate(self.manuscript, self.layout, self.out_directory)
+        self.assertEqual(calibration, page_count.Calibration())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,234 @@
+import unittest
+from unittest import mock
+import asyncio
+import json
+import subprocess
+
+# We need to start by adding the packages we're testing into the path, which is an unfortunate reality of not wanting to
+# install the package just to run unit tests.
+import test_utils
+test_utils.finagle_dependencies()
+
+from manuscript_generator_3000.exporters import pandoc_ast
+from manuscript_generator_3000.manuscript import Manuscript
+
+
+def text(inlines):
+    """Squashes the given inlines back into plain text, for checking.
+    """
+    output = ""
+    for inline in inlines:
+        if inline["t"] == "Str":
+            output += inline["c"]
+        elif inline["t"] in ["Space", "SoftBreak"]:
+            output += " "
+        elif inline["t"] in ["Emph", "Strong"]:
+            output += text(inline["c"])
+    return output
+
+
+class TestConvertInlineMarkdown(unittest.TestCase):
+    def test_words_and_spaces(self):
+        self.assertEqual(pandoc_ast.convert_inline_markdown("Two words"),
+                         [{"t": "Str", "c": "Two"}, {"t": "Space"}, {"t": "Str", "c": "words"}])
+
+    def test_markup(self):
+        """Emphasis and friends should become nodes of their own, nested where need be.
+        """
+        output = pandoc_ast.convert_inline_markdown("a **bold _and italic_** [link](http://example.com) `co*de`")
+        strong, link, code = [inline for inline in output if inline["t"] not in ["Str", "Space"]]
+
+        self.assertEqual(strong["t"], "Strong")
+        self.assertEqual(strong["c"][-1], {"t": "Emph", "c": [{"t": "Str", "c": "and"},
+                                                                {"t": "Space"},
+                                                                {"t": "Str", "c": "italic"}]})
+        self.assertEqual(link["t"], "Link")
+        self.assertEqual(link["c"][2], ["http://example.com", ""])
+        self.assertEqual(code, {"t": "Code", "c": [["", [], []], "co*de"]})
+
+    def test_escapes_and_raw_tex(self):
+        """Escaped characters are taken literally (no markdown-escaping ambiguity), and TeX commands go through as is.
+        """
+        output = pandoc_ast.convert_inline_markdown(r"not \*emphasis\* \newpage")
+
+        self.assertEqual(text(output), "not *emphasis* ")
+        self.assertEqual(output[-1], {"t": "RawInline", "c": ["tex", r"\newpage"]})
+
+    def test_smart_punctuation(self):
+        output = pandoc_ast.convert_inline_markdown("\"Well--it's *\"fine\"*...\" she said---or not.")
+
+        self.assertEqual(text(output), "“Well–it’s “fine”…” she said—or not.")
+
+    def test_strikeout_and_raw_html(self):
+        """Strikeout should become a node of its own, and HTML tags go through as is (for HTML outputs only).
+        """
+        output = pandoc_ast.convert_inline_markdown("~~gone~~ <span>x</span>")
+
+        self.assertEqual(output, [{"t": "Strikeout", "c": [{"t": "Str", "c": "gone"}]},
+                                  {"t": "Space"},
+                                  {"t": "RawInline", "c": ["html", "<span>"]},
+                                  {"t": "Str", "c": "x"},
+                                  {"t": "RawInline", "c": ["html", "</span>"]}])
+
+    def test_entities_and_math(self):
+        """Entities should stand for their characters, and TeX math become math (unless it's really just money).
+        """
+        output = pandoc_ast.convert_inline_markdown("A &mdash; B &amp; C")
+        self.assertEqual(text(output), "A \u2014 B & C")
+
+        output = pandoc_ast.convert_inline_markdown("$x^2$ is $$\\frac{a}{b}$$, for \\$5 or $10")
+        self.assertEqual(output[0], {"t": "Math", "c": [{"t": "InlineMath"}, "x^2"]})
+        self.assertEqual(output[4], {"t": "Math", "c": [{"t": "DisplayMath"}, "\\frac{a}{b}"]})
+        self.assertEqual(text(output[5:]), ", for $5 or $10")
+
+    def test_footnotes(self):
+        """References should become the notes they refer to, inline notes too, and unknown references left alone.
+        """
+        output = pandoc_ast.convert_inline_markdown("Text[^1] and^[Inline *note*.] [^2]", notes={"1": "A note."})
+
+        self.assertEqual(output[1], {"t": "Note", "c": [{"t": "Para", "c": [{"t": "Str", "c": "A"},
+                                                                           {"t": "Space"},
+                                                                           {"t": "Str", "c": "note."}]}]})
+        self.assertEqual(output[4]["t"], "Note")
+        self.assertEqual(output[4]["c"][0]["c"][-2], {"t": "Emph", "c": [{"t": "Str", "c": "note"}]})
+        self.assertEqual(output[-1], {"t": "Str", "c": "[^2]"})
+
+
+class TestConvertContentToBlocks(unittest.TestCase):
+    def test_separators(self):
+        part = Manuscript.StartPart(Manuscript.SeparatorConfig("Part", True))
+        chapter = Manuscript.StartChapter(Manuscript.SeparatorConfig("Prologue", False))
+        content = [part, chapter, "text", Manuscript.BreakScene(), "", "# heading", "> quote"]
+
+        output = pandoc_ast.convert_content_to_blocks(content)
+
+        self.assertEqual([block["t"] for block in output],
+                         ["Header", "Header", "Para", "HorizontalRule", "Header", "BlockQuote"])
+        self.assertEqual(output[0]["c"][:2], [1, ["", [], []]])
+        self.assertEqual(output[1]["c"][:2], [2, ["", ["unnumbered"], []]])
+
+        output = pandoc_ast.convert_content_to_blocks(content, ignore_parts=True)
+        self.assertEqual(output[0]["c"][:2], [1, ["", ["unnumbered"], []]])
+
+    def test_lists(self):
+        """Neighbouring list items should make up a list, as long as they're of the same kind.
+        """
+        content = ["- apples", "* pears", "text", "1. first", "2. second", "3) third", "<!-- comment -->"]
+
+        output = pandoc_ast.convert_content_to_blocks(content)
+
+        self.assertEqual([block["t"] for block in output],
+                         ["BulletList", "Para", "OrderedList", "OrderedList", "RawBlock"])
+        self.assertEqual(output[0]["c"], [[{"t": "Para", "c": [{"t": "Str", "c": "apples"}]}],
+                                          [{"t": "Para", "c": [{"t": "Str", "c": "pears"}]}]])
+        self.assertEqual(output[2]["c"][0], [1, {"t": "Decimal"}, {"t": "Period"}])
+        self.assertEqual(len(output[2]["c"][1]), 2)
+        self.assertEqual(output[3]["c"][0], [3, {"t": "Decimal"}, {"t": "OneParen"}])
+        self.assertEqual(output[4], pandoc_ast.raw_block("html", "<!-- comment -->"))
+
+    def test_footnotes(self):
+        """Footnote definitions should end up where they're referenced from, whichever section they're in.
+        """
+        blocks = json.loads(b"".join(pandoc_ast.encode_blocks([["Text[^1]"], ["[^1]: The *note*."]])))
+
+        self.assertEqual(len(blocks), 1)
+        note = blocks[0]["c"][1]
+        self.assertEqual(note["t"], "Note")
+        self.assertEqual(text(note["c"][0]["c"]), "The note.")
+
+
+class TestEncodeDocument(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.clear_cache()
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.clear_cache()
+
+    @staticmethod
+    def clear_cache() -> None:
+        pandoc_ast._segments.clear()
+        pandoc_ast._segments_size = 0
+
+    def encode(self, sections, **kwargs) -> bytes:
+        return b"".join(pandoc_ast.encode_blocks(sections, **kwargs))
+
+    def test_chunks(self):
+        """However small the chunks, they should add up to the blocks of every section, with breaks between them.
+        """
+        chapter = Manuscript.StartChapter(Manuscript.SeparatorConfig("Title", True))
+        sections = [[], ["one", "two", chapter, "- three", "- four"], [], [chapter], []]
+        section_break = pandoc_ast.raw_block("latex", "% break")
+        expected = [section_break,
+                    *pandoc_ast.convert_content_to_blocks(sections[1]),
+                    section_break,
+                    section_break,
+                    *pandoc_ast.convert_content_to_blocks(sections[3]),
+                    section_break]
+
+        for chunk_size in [1, 40, 1000]:
+            with mock.patch.object(pandoc_ast, "ENCODED_CHUNK_SIZE", chunk_size):
+                self.clear_cache()
+                chunks = list(pandoc_ast.encode_blocks(sections, section_break=section_break))
+                self.assertEqual(json.loads(b"".join(chunks)), expected)
+                # Once more, from the cache.
+                self.assertEqual(list(pandoc_ast.encode_blocks(sections, section_break=section_break)), chunks)
+
+        self.assertEqual(self.encode([]), b"[]")
+
+    def test_cached(self):
+        """Chapters should only be converted once, and again only if they (or the footnotes they can see) change.
+        """
+        chapter = Manuscript.StartChapter(Manuscript.SeparatorConfig("Title", True))
+        content = [chapter, "some text", chapter, "more text"]
+        self.encode([content])
+
+        with mock.patch.object(pandoc_ast, "iterate_blocks", wraps=pandoc_ast.iterate_blocks) as iterate:
+            self.encode([list(content)])
+            self.assertEqual(iterate.call_count, 0)
+
+            self.encode([content[:3] + ["other text"]])
+            self.assertEqual(iterate.call_count, 1)
+
+            # Both chapters, both times.
+            self.encode([content], ignore_parts=True)
+            self.encode([content + ["[^1]: A note."]])
+            self.assertEqual(iterate.call_count, 5)
+
+    def test_cache_size(self):
+        """The cache should never hold more than its size in bytes, leaving out segments that don't fit at all.
+        """
+        chapter = Manuscript.StartChapter(Manuscript.SeparatorConfig("Title", True))
+        with mock.patch.object(pandoc_ast, "SEGMENT_CACHE_SIZE", 500):
+            self.encode([[chapter, "x" * 600]])
+            self.assertEqual(len(pandoc_ast._segments), 0)
+
+            for index in range(10):
+                self.encode([[chapter, f"text {index}"]])
+                self.assertLessEqual(pandoc_ast._segments_size, 500)
+            self.assertGreater(len(pandoc_ast._segments), 1)
+            self.assertEqual(pandoc_ast._segments_size,
+                             sum(size for _, size in pandoc_ast._segments.values()))
+
+    def test_document(self):
+        """Documents should be valid JSON, in the API version pandoc asked for, with sections broken up as asked.
+        """
+        output = subprocess.CompletedProcess([], 0, b'{"pandoc-api-version":[1,22,2],"meta":{},"blocks":[]}', b"")
+        section_break = pandoc_ast.raw_block("latex", "% break")
+
+        with mock.patch.object(pandoc_ast.external_tools, "run_tool_async", return_value=output) as run_tool, \
+                mock.patch.dict(pandoc_ast._api_versions, clear=True):
+            chunks = asyncio.run(pandoc_ast.encode_document_async([["one"], ["two"]], section_break=section_break))
+            asyncio.run(pandoc_ast.encode_document_async([["one"]]))
+
+        document = json.loads(b"".join(chunks))
+        self.assertEqual(run_tool.call_count, 1)
+        self.assertEqual(document["pandoc-api-version"], [1, 22, 2])
+        self.assertEqual(document["blocks"], [{"t": "Para", "c": [{"t": "Str", "c": "one"}]},
+                                              section_break,
+                                              {"t": "Para", "c": [{"t": "Str", "c": "two"}]}])
+
+
+if __name__ == '__main__':
+    unittest.main()
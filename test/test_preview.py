@@ -0,0 +1,145 @@
+import unittest
+from unittest import mock
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+# We need to start by adding the packages we're testing into the path, which is an unfortunate reality of not wanting to
+# install the package just to run unit tests.
+import test_utils
+test_utils.finagle_dependencies()
+
+from manuscript_generator_3000.preview import preview
+from manuscript_generator_3000.manuscript import Manuscript
+from manuscript_generator_3000.exporters import epub_exporter_innards
+from test_utils import chapter
+
+
+def create_manuscript(content: Manuscript.Content) -> Manuscript:
+    return Manuscript(content, Manuscript.Config("A *Book*", "Someone", None, None))
+
+
+class TestPreview(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.illustration_dir = Path(self.temp_dir.name)
+        self.manuscript = create_manuscript([chapter("One"), "First.", chapter("Two"), "Second.",
+                                             chapter("Afterword", numbered=False), "Last."])
+        self.preview = preview.Preview(lambda: self.manuscript, self.illustration_dir)
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.temp_dir.cleanup()
+
+    def test_pages(self):
+        """Every chapter gets a page, linked from the index and to its neighbours.
+        """
+        self.assertEqual(self.preview.refresh(), ["/text/chapter_000.html", "/text/chapter_001.html",
+                                                  "/text/chapter_002.html", "/"])
+
+        index = self.preview.get_page("/").decode("utf-8")
+        self.assertIn("<title>A *Book*</title>", index)
+        self.assertIn('<a href="/text/chapter_001.html">2. Two</a>', index)
+        self.assertIn('<a href="/text/chapter_002.html">Afterword</a>', index)
+
+        page = self.preview.get_page("/text/chapter_001.html").decode("utf-8")
+        self.assertIn('<span class="header-section-number">2</span> Two', page)
+        self.assertIn("<p>Second.</p>", page)
+        self.assertIn('<a href="/text/chapter_000.html">Previous</a>', page)
+        self.assertIn('<a href="/text/chapter_002.html">Next</a>', page)
+        self.assertIn(preview.RELOAD_SCRIPT, page)
+        self.assertTrue(page.endswith("</body>\n</html>\n"))
+        self.assertNotIn("Next", self.preview.get_page("/text/chapter_002.html").decode("utf-8"))
+
+    def test_incremental(self):
+        """Only chapters that changed should be rendered again, and listeners told about them.
+        """
+        self.preview.refresh()
+        listener = self.preview.listen()
+
+        with mock.patch.object(epub_exporter_innards, "render_chapter",
+                               wraps=epub_exporter_innards.render_chapter) as render_chapter:
+            # Nothing changed, not even the manuscript object.
+            self.assertEqual(self.preview.refresh(), [])
+
+            self.manuscript = create_manuscript(self.manuscript.content[:3] + ["Second, again."]
+                                                + self.manuscript.content[4:])
+            self.assertEqual(self.preview.refresh(), ["/text/chapter_001.html"])
+            self.assertEqual(render_chapter.call_count, 1)
+            self.assertIn("Second, again.", self.preview.get_page("/text/chapter_001.html").decode("utf-8"))
+
+            # Removing the last chapter changes the one before it too (it doesn't have a next one anymore), and the
+            # index.
+            self.manuscript = create_manuscript(self.manuscript.content[:4])
+            self.assertEqual(self.preview.refresh(), ["/text/chapter_001.html", "/", "/text/chapter_002.html"])
+            self.assertEqual(render_chapter.call_count, 2)
+            self.assertIsNone(self.preview.get_page("/text/chapter_002.html"))
+
+        self.assertEqual(listener.get_nowait(), ["/text/chapter_001.html"])
+        self.assertEqual(listener.get_nowait(), ["/text/chapter_001.html", "/", "/text/chapter_002.html"])
+        self.assertTrue(listener.empty())
+
+    def test_media(self):
+        """Images chapters use should be served, but nothing else.
+        """
+        (self.illustration_dir / "cat.png").write_bytes(b"not really a cat")
+        self.manuscript = create_manuscript([chapter("One"), "![A cat](cat.png)"])
+        self.preview.refresh()
+
+        self.assertIn('<img src="../media/cat.png" alt="A cat"/>',
+                      self.preview.get_page("/text/chapter_000.html").decode("utf-8"))
+        self.assertEqual(self.preview.get_media("/media/cat.png").source, self.illustration_dir / "cat.png")
+        self.assertIsNone(self.preview.get_media("/media/dog.png"))
+
+
+class TestPreviewServer(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.manuscript = create_manuscript([chapter("One"), "First.", chapter("Two"), "Second."])
+        self.preview = preview.Preview(lambda: self.manuscript, Path(__file__).parent)
+        self.preview.refresh()
+
+        self.server = preview.PreviewServer(self.preview, 0)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.preview.close()
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+
+    def get(self, path: str):
+        return urllib.request.urlopen(self.server.url.rstrip("/") + path, timeout=5)
+
+    def test_pages(self):
+        with self.get("/text/chapter_000.html") as response:
+            self.assertEqual(response.headers["Content-Type"], "text/html; charset=utf-8")
+            self.assertIn(b"<p>First.</p>", response.read())
+
+        with self.get("/stylesheet.css") as response:
+            self.assertEqual(response.read().decode("utf-8"), preview.STYLESHEET)
+
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            self.get("/text/chapter_002.html")
+        self.assertEqual(context.exception.code, 404)
+
+    def test_events(self):
+        """Browsers listening to events should hear about the pages that changed.
+        """
+        with self.get("/events") as events:
+            self.assertEqual(events.headers["Content-Type"], "text/event-stream")
+
+            self.manuscript = create_manuscript([chapter("One"), "First, again.", chapter("Two"), "Second."])
+            self.preview.refresh()
+
+            self.assertEqual(events.readline(), b'data: ["/text/chapter_000.html"]\n')
+            self.assertEqual(events.readline(), b"\n")
+
+
+if __name__ == '__main__':
+    unittest.main()
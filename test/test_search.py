@@ -0,0 +1,88 @@
+import unittest
+import tempfile
+from pathlib import Path
+
+# We need to start by adding the packages we're testing into the path, which is an unfortunate reality of not wanting to
+# install the package just to run unit tests.
+import test_utils
+test_utils.finagle_dependencies()
+
+from manuscript_generator_3000.search import search
+from manuscript_generator_3000.manuscript import Manuscript
+from test_utils import chapter
+
+
+CONTENT = [
+    "A preamble, about *nothing* much.",
+    Manuscript.StartPart(Manuscript.SeparatorConfig("Part", True)),
+    chapter("One"),
+    "The old lighthouse stood there.",
+    "Nobody went to the lighthouse, or the lighthouse keeper's house.",
+    Manuscript.BreakScene(),
+    "Then the OLD keeper came back.",
+    chapter("Two"),
+    "Lights out, said the keeper. Don't wait up.",
+]
+
+
+class TestSplitContentIntoScenes(unittest.TestCase):
+    def test_scenes(self):
+        output = list(search.split_content_into_scenes(CONTENT))
+
+        self.assertEqual([(chapter, scene, title) for chapter, scene, title, _ in output],
+                         [(0, 0, None), (1, 0, "One"), (1, 1, "One"), (2, 0, "Two")])
+        self.assertEqual(output[1][3], CONTENT[3:5])
+
+
+class TestManuscriptIndex(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.index = search.build_index(Manuscript(CONTENT, None))
+
+    def test_find(self):
+        """Terms should be found wherever they are, whatever their case, in order.
+        """
+        self.assertEqual(self.index.find("Lighthouse"), [search.Hit(1, 0, 0, 2),
+                                                         search.Hit(1, 0, 1, 4),
+                                                         search.Hit(1, 0, 1, 7)])
+        self.assertEqual(self.index.find("don’t"), [search.Hit(2, 0, 0, 5)])
+        self.assertEqual(self.index.find("nothing"), [search.Hit(0, 0, 0, 3)])
+        self.assertEqual(self.index.find("missing"), [])
+        self.assertEqual(self.index.chapter_titles, {0: None, 1: "One", 2: "Two"})
+
+    def test_find_phrase(self):
+        self.assertEqual(self.index.find_phrase("the lighthouse keeper’s"), [search.Hit(1, 0, 1, 6)])
+        self.assertEqual(self.index.find_phrase("old keeper"), [search.Hit(1, 1, 0, 2)])
+        self.assertEqual(self.index.find_phrase("keeper old"), [])
+
+    def test_find_prefix(self):
+        self.assertEqual(self.index.terms_with_prefix("Light"), ["lighthouse", "lights"])
+        self.assertEqual(len(self.index.find_prefix("light")), 4)
+        self.assertEqual(self.index.find_prefix("zzz"), [])
+
+    def test_incremental_update(self):
+        """Only scenes that changed should be indexed again, and the index should reflect the changes.
+        """
+        content = list(CONTENT)
+        content[6] = "Then the new keeper came back."
+
+        self.assertEqual(self.index.update(Manuscript(content, None)), 1)
+        self.assertEqual(self.index.find("old"), [search.Hit(1, 0, 0, 1)])
+        self.assertEqual(self.index.find("new"), [search.Hit(1, 1, 0, 2)])
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            index_file = Path(temp_dir) / "index.json"
+            search.build_index(Manuscript(CONTENT, None), index_file)
+
+            index = search.ManuscriptIndex.load(index_file)
+            self.assertEqual(index.update(Manuscript(CONTENT, None)), 0)
+            self.assertEqual(index.find("lighthouse"), self.index.find("lighthouse"))
+
+            index_file.write_text("not json", encoding="utf-8")
+            with self.assertLogs(search.logger, "WARNING"):
+                self.assertEqual(search.ManuscriptIndex.load(index_file).update(Manuscript(CONTENT, None)), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
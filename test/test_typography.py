@@ -0,0 +1,81 @@
+import unittest
+from unittest import mock
+
+# We need to start by adding the packages we're testing into the path, which is an unfortunate reality of not wanting to
+# install the package just to run unit tests.
+import test_utils
+test_utils.finagle_dependencies()
+
+from manuscript_generator_3000.typography import typography
+from manuscript_generator_3000.manuscript import Manuscript
+from test_utils import chapter
+
+
+class TestTypesetParagraph(unittest.TestCase):
+    def test_english(self):
+        self.assertEqual(typography.typeset_paragraph("\"Don't,\" she said -- twice... 'Really.'", typography.ENGLISH),
+                         "“Don’t,” she said — twice… ‘Really.’")
+
+    def test_french(self):
+        """French gets guillemets, with non-breaking spaces inside them and before ;:!?, typed or not.
+        """
+        self.assertEqual(typography.typeset_paragraph("\"Bonjour\", dit-il. \" Quoi ? \" Oui : non !",
+                                                      typography.FRENCH),
+                         "«\u00a0Bonjour\u00a0», dit-il. «\u00a0Quoi\u00a0?\u00a0» Oui\u00a0: non\u00a0!")
+        self.assertEqual(typography.typeset_paragraph("-- Tu viens ? « Non »", typography.FRENCH),
+                         "—\u00a0Tu viens\u00a0? «\u00a0Non\u00a0»")
+        self.assertEqual(typography.typeset_paragraph("Il dit : \" Bonjour \" !", typography.FRENCH),
+                         "Il dit\u00a0: «\u00a0Bonjour\u00a0»\u00a0!")
+
+    def test_portuguese(self):
+        self.assertEqual(typography.typeset_paragraph("--- Olá, disse ela. \"Adeus.\"", typography.PORTUGUESE),
+                         "—\u00a0Olá, disse ela. «Adeus.»")
+
+    def test_left_alone(self):
+        """Code, raw TeX, link targets and rules shouldn't be touched.
+        """
+        text = "Run `a -- \"b\"`, \\textsc{it's...} or see [the \"docs\"](http://example.com/a--b)."
+        self.assertEqual(typography.typeset_paragraph(text, typography.ENGLISH),
+                         "Run `a -- \"b\"`, \\textsc{it's...} or see [the “docs”](http://example.com/a--b).")
+        self.assertEqual(typography.typeset_paragraph("---", typography.ENGLISH), "---")
+
+    def test_unknown_language(self):
+        with self.assertLogs(typography.logger, "WARNING"):
+            self.assertEqual(typography.get_typography("klingon"), typography.ENGLISH)
+        self.assertEqual(typography.get_typography("francais"), typography.FRENCH)
+
+
+class TestApplyTypography(unittest.TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        typography._scenes.clear()
+
+    def test_content(self):
+        """Only paragraphs should change, with everything else where it was.
+        """
+        start = chapter("\"One\"")
+        content = ["\"Hi.\"", start, "A -- B", Manuscript.BreakScene(), "C...", chapter("Two")]
+        output = typography.apply_typography(Manuscript(content, None), "english")
+
+        self.assertEqual(output.content, ["“Hi.”", start, "A — B", content[3], "C…", content[5]])
+        self.assertEqual(content[2], "A -- B")
+
+    def test_cached(self):
+        """Only scenes that changed should be typeset again, and typesetting for another language is another thing.
+        """
+        content = [chapter("One"), "First...", "Second...", Manuscript.BreakScene(), "Third..."]
+        with mock.patch.object(typography, "typeset_paragraph", wraps=typography.typeset_paragraph) as typeset:
+            typography.apply_typography(Manuscript(content, None), "english")
+            self.assertEqual(typeset.call_count, 3)
+
+            content[-1] = "Third, again..."
+            output = typography.apply_typography(Manuscript(content, None), "english")
+            self.assertEqual(typeset.call_count, 4)
+            self.assertEqual(output.content[-1], "Third, again…")
+
+            typography.apply_typography(Manuscript(content, None), "french")
+            self.assertEqual(typeset.call_count, 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,4 +2,23 @@ import sys
 from pathlib import Path
 
 def finagle_dependencies():
-    sys.path.append(str(Path(__file__).parents[2]))
\ No newline at end of file
+    sys.path.append(str(Path(__file__).parents[2]))
+
+
+def chapter(title, numbered=True):
+    """Starts a chapter with the given title, for writing manuscripts in tests.
+    """
+    from manuscript_generator_3000.manuscript import Manuscript
+
+    return Manuscript.StartChapter(Manuscript.SeparatorConfig(title, numbered))
+
+
+def assert_within_memory_budgets(test_case, recorder, budgets):
+    """Fails the given test if any of the stages the given recorder saw needed more memory than its budget (in bytes, by
+    stage name). See instrumentation.exceeded_memory_budgets.
+    """
+    from manuscript_generator_3000.instrumentation import instrumentation
+
+    exceeded = instrumentation.exceeded_memory_budgets(recorder, budgets)
+    if exceeded:
+        test_case.fail("Over the memory budget:\n" + "\n".join(exceeded))
@@ -0,0 +1 @@
+from .typography import *
\ No newline at end of file
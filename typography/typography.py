@@ -0,0 +1,247 @@
+import collections
+import dataclasses
+import functools
+import hashlib
+import logging
+import re
+import threading
+from dataclasses import dataclass
+from typing import Iterator, List, Tuple
+
+from ..manuscript import Manuscript
+from ..instrumentation import instrumentation
+from ..exporters.epub_exporter_innards import (MD_CODE_PATTERN, MD_ESCAPE_PATTERN, MD_TARGET_PATTERN,
+                                               OPENING_QUOTE_CONTEXT)
+from ..exporters.pandoc_ast import MD_RAW_TEX_PATTERN
+
+logger = logging.getLogger(__name__)
+
+NBSP = "\u00a0"
+EM_DASH = "\u2014"
+ELLIPSIS = "\u2026"
+APOSTROPHE = "\u2019"
+
+# What's left alone, as it's not prose: code, escaped characters, raw TeX commands and where links and images point to.
+PROTECTED_PATTERNS = [MD_CODE_PATTERN, MD_ESCAPE_PATTERN, MD_RAW_TEX_PATTERN, MD_TARGET_PATTERN]
+
+# Whatever a rule (protected text included) can start with, as part of a character class.
+FIRST_CHARACTERS = r"`\\\]\-.\"'"
+
+# Paragraphs that are nothing but a horizontal rule (e.g. "---") aren't dashes.
+MD_RULE_PATTERN = re.compile(r"\s*(?:[-*_]\s*){3,}")
+
+# Punctuation that gets a non-breaking space before it, in languages that space it (see Typography).
+SPACED_PUNCTUATION = ";:!?"
+
+# How many typeset scenes are kept around (see apply_typography).
+SCENE_CACHE_SIZE = 4096
+
+
+@dataclass(frozen=True)
+class Typography:
+    """The typographic conventions of a language.
+
+    double_quotes and single_quotes are the (opening, closing) quotes straight ones turn into. If spaced is set, there's
+    a non-breaking space inside guillemets and before ;:!?, as in French. If dialogue is set, the space after a dash
+    opening a paragraph (of dialogue) is non-breaking, so the dash never ends up alone at the end of a line.
+    """
+    name: str
+    double_quotes: Tuple[str, str] = ("“", "”")
+    single_quotes: Tuple[str, str] = ("‘", "’")
+    spaced: bool = False
+    dialogue: bool = False
+
+
+ENGLISH = Typography("english")
+FRENCH = Typography("french", ("«", "»"), ("“", "”"), spaced=True, dialogue=True)
+PORTUGUESE = Typography("portuguese", ("«", "»"), ("“", "”"), dialogue=True)
+BRAZILIAN = Typography("brazilian", dialogue=True)
+GERMAN = Typography("german", ("„", "“"), ("‚", "‘"))
+SPANISH = Typography("spanish", ("«", "»"), ("“", "”"))
+
+# Typographies, keyed on the babel languages that use them.
+LANGUAGES = {
+    **dict.fromkeys(["english", "american", "USenglish", "british", "UKenglish", "canadian", "australian",
+                     "newzealand"], ENGLISH),
+    **dict.fromkeys(["french", "francais", "acadian", "canadien"], FRENCH),
+    **dict.fromkeys(["portuguese", "portuges"], PORTUGUESE),
+    **dict.fromkeys(["brazilian", "brazil"], BRAZILIAN),
+    **dict.fromkeys(["german", "ngerman", "austrian", "naustrian"], GERMAN),
+    "spanish": SPANISH,
+}
+
+# Typeset scenes, keyed on the typography and a hash of the scene. Exports can run in threads, hence the lock.
+_scenes: collections.OrderedDict = collections.OrderedDict()
+_scenes_lock = threading.Lock()
+
+
+def get_typography(babel_language: str) -> Typography:
+    """Finds the typography of the given babel language, falling back to English for languages it doesn't know.
+    """
+    typography = LANGUAGES.get(babel_language)
+    if typography is None:
+        logger.warning(f"No typography for babel language {babel_language!r}, so going with English.")
+        return ENGLISH
+
+    return typography
+
+
+@functools.lru_cache(maxsize=None)
+def _compile(typography: Typography) -> re.Pattern:
+    """Puts every rule of the given typography into a single pattern, so paragraphs are typeset in one go.
+    """
+    patterns = [f"(?P<protected>{'|'.join(pattern.pattern for pattern in PROTECTED_PATTERNS)})"]
+    if typography.dialogue:
+        patterns.append(r"(?P<dialogue>^(?:---?|\u2014|\u2015)[ \t]+)")
+    patterns.extend([r"(?P<ellipsis>\.\.\.)", r"(?P<dash>---?)"])
+    if typography.spaced:
+        # Whitespace around quotes and before punctuation turns into non-breaking spaces (see typeset_paragraph).
+        patterns.extend([r"(?P<quote>[ \t]*[\"'][ \t]*)",
+                         fr"(?P<space_before>[ \t]+(?=[{SPACED_PUNCTUATION}»]))",
+                         r"(?P<space_after>(?<=«)[ \t]+)"])
+    else:
+        patterns.append(r"(?P<quote>[\"'])")
+
+    # Matches can only start with one of these, which lets the search skip over everything else quickly.
+    first_characters = FIRST_CHARACTERS
+    if typography.dialogue:
+        first_characters += "\u2014\u2015"
+    if typography.spaced:
+        first_characters += " \t"
+    return re.compile(f"(?=[{first_characters}])(?:{'|'.join(patterns)})")
+
+
+def typeset_paragraph(paragraph: str, typography: Typography) -> str:
+    """Curls the quotes in the given paragraph, turns -- and --- into em dashes and ... into an ellipsis, and puts in the
+    non-breaking spaces the given typography asks for.
+
+    Note:
+    * Quotes open at the start of the paragraph, after whitespace and after opening punctuation (as pandoc's smart
+      quotes do), and close everywhere else. Quotes with whitespace on both sides close the last one opened, if any.
+      A single quote between two letters is an apostrophe.
+    * With spaced typographies, whitespace typed inside quotes or before spaced punctuation becomes a single
+      non-breaking space.
+    * Code, escaped characters, raw TeX and link targets are left alone, as are paragraphs that are just a rule.
+    """
+    if MD_RULE_PATTERN.fullmatch(paragraph):
+        return paragraph
+
+    # Which quotes are open at this point, for those that could go either way.
+    open_quotes = set()
+
+    def replace(match: re.Match) -> str:
+        kind = match.lastgroup
+        if kind == "protected":
+            return match.group()
+        elif kind == "dialogue":
+            return EM_DASH + NBSP
+        elif kind == "ellipsis":
+            return ELLIPSIS
+        elif kind == "dash":
+            return EM_DASH
+        elif kind in ("space_before", "space_after"):
+            return NBSP
+
+        text = match.group()
+        quote = text.strip(" \t")
+        leading = text[:text.index(quote)]
+        trailing = text[text.index(quote) + 1:]
+        before = leading or (paragraph[match.start() - 1] if match.start() > 0 else "")
+        after = trailing or paragraph[match.end():match.end() + 1]
+
+        if quote == "'" and before.isalnum() and after.isalnum():
+            return APOSTROPHE
+
+        opening, closing = typography.double_quotes if quote == '"' else typography.single_quotes
+        if not before or before.isspace() or before in OPENING_QUOTE_CONTEXT:
+            # Quotes with space on both sides (e.g. as typed in French) close whatever they opened.
+            is_opening = quote not in open_quotes if not after or after.isspace() else True
+        else:
+            is_opening = False
+
+        if is_opening:
+            open_quotes.add(quote)
+            if typography.spaced and opening == "«":
+                return leading + opening + NBSP
+            return leading + opening + trailing
+        else:
+            open_quotes.discard(quote)
+            # The whitespace after a closing quote is part of the match, so space_before never gets to see it.
+            next_character = paragraph[match.end():match.end() + 1]
+            if typography.spaced and trailing and next_character and next_character in SPACED_PUNCTUATION:
+                trailing = NBSP
+            if typography.spaced and closing == "»":
+                return NBSP + closing + trailing
+            return leading + closing + trailing
+
+    return _compile(typography).sub(replace, paragraph)
+
+
+def _split_into_scenes(content: Manuscript.Content) -> Iterator[Tuple[List[str], list]]:
+    """Goes through the content of a Manuscript one run of paragraphs (i.e. scene) at a time.
+
+    Yields the paragraphs, followed by whatever control elements come after them.
+    """
+    paragraphs = []
+    controls = []
+    for line in content:
+        if Manuscript.is_control_type(line):
+            controls.append(line)
+            continue
+
+        if controls:
+            yield paragraphs, controls
+            paragraphs = []
+            controls = []
+        paragraphs.append(line)
+
+    yield paragraphs, controls
+
+
+def _hash_scene(paragraphs: List[str], typography: Typography) -> str:
+    hasher = hashlib.sha256(repr(typography).encode("utf-8"))
+    for paragraph in paragraphs:
+        hasher.update(b"\0")
+        hasher.update(paragraph.encode("utf-8"))
+
+    return hasher.hexdigest()
+
+
+@instrumentation.timed("typography")
+def apply_typography(manuscript: Manuscript, babel_language: str) -> Manuscript:
+    """Creates a copy of the given manuscript with its paragraphs typeset for the given babel language (see
+    typeset_paragraph and get_typography).
+
+    Note:
+    * Typeset scenes are remembered (up to SCENE_CACHE_SIZE of them) by what's in them, so typesetting a manuscript
+      again after changing it only typesets the scenes that changed.
+    * Titles aren't touched, only paragraphs.
+    """
+    typography = get_typography(babel_language)
+    content = []
+    scenes = 0
+    typeset = 0
+
+    for paragraphs, controls in _split_into_scenes(manuscript.content):
+        if paragraphs:
+            scenes += 1
+            key = _hash_scene(paragraphs, typography)
+            with _scenes_lock:
+                output = _scenes.get(key)
+                if output is not None:
+                    _scenes.move_to_end(key)
+
+            if output is None:
+                output = [typeset_paragraph(paragraph, typography) for paragraph in paragraphs]
+                typeset += 1
+                with _scenes_lock:
+                    _scenes[key] = output
+                    while len(_scenes) > SCENE_CACHE_SIZE:
+                        _scenes.popitem(last=False)
+
+            content.extend(output)
+        content.extend(controls)
+
+    instrumentation.count("scenes_typeset", typeset)
+    logger.info(f"Typeset {typeset} out of {scenes} scenes ({typography.name}).")
+    return dataclasses.replace(manuscript, content=content)
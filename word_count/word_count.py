@@ -1,6 +1,7 @@
 import logging
 
 from ..manuscript import Manuscript
+from ..instrumentation import instrumentation
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +16,7 @@ def count_words(string: str) -> int:
     return len(words)
 
 
+@instrumentation.timed("word_count")
 def count_words_in_manuscript(manuscript: Manuscript) -> int:
     count = sum([count_words(elem) for elem in manuscript.content if not Manuscript.is_control_type(elem)])
     return count